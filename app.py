@@ -1,17 +1,56 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import requests
 import os
+import functools
+import json
+import random
+import re
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 
+import batch
+import cache
+import circuit_breaker
+import codec
+import deadline
+import dispatch
+import gemini_cache
+import http_client
+import local_model
+import logs
+import metrics
+import microbatch
+import probes
+import prompts
+import ratelimit
+import retry
+import routing
+import sessions as sesje
+import singleflight
+import store
+import tracing
+import warmup
+
 # Załaduj zmienne środowiskowe z pliku .env
 load_dotenv()
 
 app = Flask(__name__)
+# jsonify i request.get_json przez szybki koder (orjson), jeśli jest zainstalowany
+app.json = codec.Dostawca(app)
+START_APLIKACJI = time.time()
+
+logs.konfiguruj()
+log = logs.get('app')
+log_gemini = logs.get('gemini')
+log_hf = logs.get('hf')
 
 # Konfiguracja Google Gemini AI - przez REST API
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', "https://generativelanguage.googleapis.com/v1beta").rstrip('/')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', "gemini-2.0-flash")
+GEMINI_API_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent"
+GEMINI_STREAM_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse"
 
 if GEMINI_API_KEY:
     print(f"✅ Gemini API skonfigurowane (klucz: {GEMINI_API_KEY[:10]}...)")
@@ -21,7 +60,9 @@ else:
     USE_GEMINI = False
 
 # Backup/Alternative - Hugging Face API
-API_URL = "https://api-inference.huggingface.co/models/openai-community/gpt2"
+API_URL = os.getenv('HF_API_URL', "https://api-inference.huggingface.co/models/openai-community/gpt2")
+# Dodatkowe modele HF (np. "distilgpt2,openai-community/gpt2-medium") - kandydaci routingu obok API_URL
+HF_MODELS = [model.strip() for model in os.getenv('HF_MODELS', '').split(',') if model.strip()]
 HF_TOKEN = os.getenv('HF_TOKEN')
 if HF_TOKEN:
     HF_TOKEN = HF_TOKEN.strip().replace('\n', '').replace('\r', '').replace('\t', '')
@@ -38,170 +79,372 @@ else:
     print(f"✅ Token HF ustawiony (długość: {len(HF_TOKEN)})")
     print(f"🔗 Używany model: {API_URL}")
 
-def generuj_odpowiedz(pytanie):
+# Parametry generowania Gemini
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.8,
+    "topP": 0.9,
+    "topK": 40,
+    "maxOutputTokens": 200
+}
+
+# Parametry generowania GPT-2 (Hugging Face)
+HF_PARAMETERS = {
+    "max_length": 150,
+    "temperature": 0.7,
+    "do_sample": True,
+    "top_p": 0.9,
+    "pad_token_id": 50256
+}
+
+# Headers zgodnie z dokumentacją - budowane raz, treść zapytań to gotowe bajty JSON
+GEMINI_HEADERS = {
+    'Content-Type': 'application/json',
+    'X-goog-api-key': GEMINI_API_KEY
+}
+HF_HEADERS = {**headers, 'Content-Type': 'application/json'}
+
+# Szablony promptów z katalogu prompts/ (persona, instrukcje)
+prompts.wczytaj(GEMINI_GENERATION_CONFIG, HF_PARAMETERS)
+
+# Opcjonalny cache kontekstu Gemini dla persony (GEMINI_CONTEXT_CACHE)
+cache_kontekstu = gemini_cache.CacheKontekstu(GEMINI_API_BASE, GEMINI_MODEL, GEMINI_API_KEY)
+
+# Część klucza cache - zmiana modelu lub parametrów unieważnia zapisane odpowiedzi
+KONFIGURACJA_CACHE = json.dumps([
+    GEMINI_API_URL if USE_GEMINI else None,
+    GEMINI_GENERATION_CONFIG,
+    API_URL
+], sort_keys=True)
+
+def klucz_cache(pytanie, historia=None):
+    """Klucz cache odpowiedzi - tylko dla początku rozmowy, bo dalsze odpowiedzi zależą od historii"""
+    if not cache.CACHE_ENABLED or historia:
+        return None
+    return cache.klucz(pytanie, f"{KONFIGURACJA_CACHE}|{prompts.get().wersja}")
+
+# Lista gotowych komplementów na wypadek problemów z API
+BACKUP_RESPONSES = [
+    "Przepraszam, mam chwilową przerwę w myśleniu! 😅 Spróbuj ponownie za chwilę.",
+    "Moment, muszę się skupić - za bardzo się śmieję z naszej rozmowy! 😄 Napisz ponownie.",
+    "Oj, chyba jestem tak rozrywkowy, że zapomniałem jak mówić! 😊 Spróbuj jeszcze raz.",
+    "Wybacz, ale nasze rozmowy są tak fajne, że nie mogę się skupić! 🤗"
+]
+
+def modele_hf():
+    """(nazwa, url) modeli HF - główny z API_URL jako 'hf', dodatkowe z HF_MODELS jako 'hf:<model>'"""
+    baza = API_URL.rsplit('/models/', 1)[0]
+    return [('hf', API_URL)] + [(f"hf:{model}", f"{baza}/models/{model}") for model in HF_MODELS
+                                if f"{baza}/models/{model}" != API_URL]
+
+def dostawcy_odpowiedzi(historia=None):
+    """Lista (nazwa, funkcja) dostawców w kolejności wybranej przez routing (czas, skuteczność, priorytet)"""
+    dostawcy = []
+    if USE_GEMINI:
+        gemini = tracing.opakuj('provider.gemini', functools.partial(generuj_odpowiedz_gemini, historia=historia))
+        gemini = routing.router.mierz('gemini', metrics.upstream('gemini', gemini))
+        dostawcy.append(('gemini', gemini_w_tempie(circuit_breaker.chron('gemini', gemini), historia)))
+    for nazwa, url in modele_hf():
+        hf = tracing.opakuj('provider.hf', functools.partial(generuj_odpowiedz_hf_api, historia=historia, url=url),
+                            model=nazwa)
+        hf = routing.router.mierz(nazwa, metrics.upstream(nazwa, hf))
+        dostawcy.append((nazwa, circuit_breaker.chron(nazwa, hf)))
+    return routing.router.kolejnosc(dostawcy)
+
+def tokeny_gemini(pytanie, historia=None):
+    """Szacowana liczba tokenów wywołania Gemini (persona, historia, pytanie i maksymalna odpowiedź)"""
+    znaki = len(prompts.get().gemini_system) + len(pytanie) + sum(len(tekst) for _, tekst in (historia or []))
+    return znaki // 4 + GEMINI_GENERATION_CONFIG['maxOutputTokens']
+
+def gemini_w_tempie(funkcja, historia=None):
+    """Wywołanie Gemini w granicach RPM/TPM - przy zbyt długim czekaniu od razu następny dostawca.
+
+    Limit sprawdzany jest przed circuit breakerem, więc pominięte wywołanie nie jest liczone jako błąd.
+    """
+    def wywolaj(pytanie):
+        with tracing.span('gemini.pacing'):
+            ratelimit.tempo_gemini(tokeny_gemini(pytanie, historia))
+        return funkcja(pytanie)
+    return wywolaj
+
+def klucz_lotu(pytanie, historia=None):
+    """Klucz łączenia identycznych zapytań w toku - ta sama wiadomość, historia i konfiguracja"""
+    historia_json = codec.dumps(historia or [])
+    return cache.klucz(pytanie, f"{KONFIGURACJA_CACHE}|{prompts.get().wersja}|{historia_json}")
+
+def generuj_odpowiedz(pytanie, historia=None, request_id=None):
     """Generuje zabawną i miłą odpowiedź dla znajomej - używa Gemini jako główne API"""
     
-    # Lista gotowych komplementów na wypadek problemów z API
-    backup_responses = [
-        "Przepraszam, mam chwilową przerwę w myśleniu! 😅 Spróbuj ponownie za chwilę.",
-        "Moment, muszę się skupić - za bardzo się śmieję z naszej rozmowy! 😄 Napisz ponownie.",
-        "Oj, chyba jestem tak rozrywkowy, że zapomniałem jak mówić! 😊 Spróbuj jeszcze raz.",
-        "Wybacz, ale nasze rozmowy są tak fajne, że nie mogę się skupić! 🤗"
-    ]
-    
-    # Spróbuj najpierw Gemini (jeśli dostępne)
-    if USE_GEMINI:
+    with tracing.span('generuj_odpowiedz', **{'history.turns': len(historia or [])}) as span:
+        klucz = klucz_cache(pytanie, historia)
+        if klucz:
+            odpowiedz = cache.odpowiedzi.get(klucz)
+            if odpowiedz is not None:
+                log.debug("Odpowiedź z cache", extra={"request_id": request_id, "response_len": len(odpowiedz)})
+                metrics.zwieksz('chat_responses_total', source='cache')
+                span.ustaw(source='cache')
+                return odpowiedz
+        
+        zapytaj = functools.partial(zapytaj_dostawcow, pytanie, historia, klucz, request_id)
+        if not singleflight.SINGLEFLIGHT_ENABLED:
+            odpowiedz, zrodlo = zapytaj()
+            span.ustaw(source=zrodlo)
+            return odpowiedz
+        
+        # Identyczne zapytania w toku czekają na jedno wywołanie dostawców
         try:
-            return generuj_odpowiedz_gemini(pytanie)
-        except Exception as e:
-            print(f"❌ Błąd Gemini: {e}, przechodzę na backup HF")
-    
-    # Fallback do Hugging Face
-    return generuj_odpowiedz_hf(pytanie)
+            (odpowiedz, zrodlo), wspoldzielona = singleflight.zapytania.wykonaj(klucz_lotu(pytanie, historia), zapytaj)
+        except singleflight.TerminMinalError:
+            # Klient już nie czeka - bez dodatkowego wywołania dostawców
+            log.warning("Termin minął w czasie czekania na identyczne zapytanie", extra={"request_id": request_id})
+            metrics.zwieksz('chat_timeouts_total', provider='singleflight')
+            span.ustaw(source='backup')
+            return odpowiedz_awaryjna()
+        if wspoldzielona:
+            metrics.zwieksz('chat_responses_total', source='coalesced')
+            zrodlo = 'coalesced'
+        span.ustaw(source=zrodlo)
+        return odpowiedz
+
+def zapytaj_dostawcow(pytanie, historia=None, klucz=None, request_id=None):
+    """Odpowiedź od dostawców albo gotowa odpowiedź awaryjna - zwraca (odpowiedź, źródło)"""
+    # Gemini (jeśli dostępne) i Hugging Face - kolejno, z hedgingiem lub wyścigiem (DISPATCH_MODE)
+    dostawcy = dostawcy_odpowiedzi(historia)
+    try:
+        nazwa, odpowiedz = dispatch.uruchom(dostawcy, pytanie)
+    except dispatch.BrakOdpowiedziError as e:
+        log.error("Brak odpowiedzi z API, używam gotowej odpowiedzi",
+                  extra={"request_id": request_id, "error": str(e)[:300]})
+        if e.przekroczono_limit:
+            metrics.zwieksz('chat_timeouts_total', provider='dispatch')
+        # Lokalny model bez sieci, a dopiero potem gotowe odpowiedzi
+        odpowiedz = odpowiedz_lokalna(pytanie, historia)
+        if odpowiedz is None:
+            return odpowiedz_awaryjna(), 'backup'
+        metrics.zwieksz('chat_responses_total', source='local')
+        metrics.zwieksz('chat_fallbacks_total', provider='local')
+        return odpowiedz, 'local'
+    
+    metrics.zwieksz('chat_responses_total', source=nazwa)
+    if nazwa != dostawcy[0][0]:
+        metrics.zwieksz('chat_fallbacks_total', provider=nazwa)
+    if klucz:
+        cache.odpowiedzi.set(klucz, odpowiedz)
+    return odpowiedz, nazwa
+
+def odpowiedz_awaryjna():
+    """Losowa gotowa odpowiedź z BACKUP_RESPONSES (liczona w metrykach)"""
+    metrics.zwieksz('chat_responses_total', source='backup')
+    metrics.zwieksz('chat_backup_responses_total')
+    return random.choice(BACKUP_RESPONSES)
+
+# Tekst pierwszej części pierwszego kandydata, dopasowany tylko wewnątrz candidates[0]:
+# "content" to jego pierwszy klucz, "parts" pierwszy (lub po "role") klucz content,
+# a "text" pierwszy klucz parts[0]; każdy inny układ idzie do pełnego dekodowania
+GEMINI_TEKST = re.compile(
+    rb'"candidates"\s*:\s*\[\s*\{\s*"content"\s*:\s*\{\s*'
+    rb'(?:"role"\s*:\s*"[^"\\]*"\s*,\s*)?'
+    rb'"parts"\s*:\s*\[\s*\{\s*"text"\s*:\s*'
+)
+
+def tekst_odpowiedzi_gemini(dane):
+    """Tekst z ciała odpowiedzi Gemini (bajty) - bez dekodowania całego JSON, gdy kształt jest typowy"""
+    tekst = codec.napis(dane, GEMINI_TEKST)
+    if tekst is not None:
+        return tekst
+    # Inny kształt (np. blokada treści, inna kolejność kluczy) - pełne dekodowanie
+    return wyciagnij_tekst_gemini(codec.loads(dane))
 
-def generuj_odpowiedz_gemini(pytanie):
+def wyciagnij_tekst_gemini(result):
+    """Wyciąga tekst z odpowiedzi (lub fragmentu strumienia) Gemini - None jeśli brak"""
+    if 'candidates' in result and len(result['candidates']) > 0:
+        candidate = result['candidates'][0]
+        if 'content' in candidate and 'parts' in candidate['content']:
+            parts = candidate['content']['parts']
+            if len(parts) > 0 and 'text' in parts[0]:
+                return parts[0]['text']
+    return None
+
+def wyslij_do_gemini(url, pytanie, historia=None, **kwargs):
+    """Wysyła zapytanie do Gemini - z cache kontekstu, jeśli jest aktywny"""
+    prompty = prompts.get()
+    nazwa_cache = cache_kontekstu.nazwa(prompty.gemini_system, prompty.wersja)
+    with tracing.span('gemini.body', cached_content=bool(nazwa_cache)):
+        body = prompty.gemini_body(pytanie, historia, cached_content=nazwa_cache)
+    response = retry.ponawiaj('gemini', lambda: http_client.post(
+        url, headers=GEMINI_HEADERS, data=body, timeout=http_client.GEMINI_TIMEOUT, **kwargs))
+    
+    if nazwa_cache and response.status_code in (400, 403, 404):
+        # Cache wygasł lub został usunięty - ponów raz z personą w systemInstruction
+        log_gemini.warning("Cache kontekstu Gemini odrzucony, ponawiam bez cache",
+                           extra={"status": response.status_code})
+        response.close()
+        cache_kontekstu.uniewaznij(nazwa_cache)
+        body = prompty.gemini_body(pytanie, historia)
+        response = retry.ponawiaj('gemini', lambda: http_client.post(
+            url, headers=GEMINI_HEADERS, data=body, timeout=http_client.GEMINI_TIMEOUT, **kwargs))
+    return response
+
+def generuj_odpowiedz_gemini(pytanie, historia=None):
     """Generuje odpowiedź używając Google Gemini REST API"""
     
-    # Spersonalizowany prompt dla Dominiki
-    prompt = f"""
-    Jesteś bardzo zabawnym, romantycznym, przyjaznym i pozytywnym chatbotem stworzonym specjalnie dla Dominiki.
-    
-    O Dominice:
-    - Ma 23 lata
-    - Jest tancerką i pracuje w przedszkolu
-    - Ma 164 cm wzrostu
-    - Ma piękne ciemne włosy i wspaniałą sylwetkę
-    - Jest bardzo sympatyczna i urocza
-    - Świetnie tańczy, ale czasem brakuje jej energii do aktywności
-    
-    Twoje zadanie:
-    - Odpowiadaj w sposób, który ją rozśmieszy, pocieszy i sprawi radość
-    - Używaj emotikonek i pozytywnych komentarzy
-    - Pisz po polsku jak do dobrej znajomej
-    - Bądź romantyczny ale w sposób przyjazny i zabawny
-    - Doceniaj jej pasję do tańca i pracę z dziećmi
-    - Odpowiedź powinna być krótka (1-3 zdania)
-    
-    Pytanie od Dominiki: {pytanie}
-    
-    Odpowiedz w sposób ciepły, zabawny i pozytywny:
-    """
-    
-    print(f"🤖 Wysyłam zapytanie do Gemini REST API: {pytanie[:50]}...")
-    
-    # Przygotuj payload zgodnie z REST API
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {
-                        "text": prompt.strip()
-                    }
-                ]
-            }
-        ],
-        "generationConfig": {
-            "temperature": 0.8,
-            "topP": 0.9,
-            "topK": 40,
-            "maxOutputTokens": 200
-        }
-    }
-    
-    # Headers zgodnie z dokumentacją
-    headers = {
-        'Content-Type': 'application/json',
-        'X-goog-api-key': GEMINI_API_KEY
-    }
-    
+    stoper = logs.Stoper()
     try:
-        response = requests.post(GEMINI_API_URL, headers=headers, json=payload, timeout=15)
-        print(f"📊 Gemini Status: {response.status_code}")
-        print(f"📝 Gemini Response: {response.text[:200]}...")
+        response = wyslij_do_gemini(GEMINI_API_URL, pytanie, historia)
+        log_gemini.debug("Odpowiedź Gemini", extra={
+            "status": response.status_code, "ms": stoper.ms,
+            "message_len": len(pytanie), "history_turns": len(historia or [])
+        })
         
         if response.status_code == 200:
-            result = response.json()
-            
             # Wyciągnij tekst z odpowiedzi Gemini
-            if 'candidates' in result and len(result['candidates']) > 0:
-                candidate = result['candidates'][0]
-                if 'content' in candidate and 'parts' in candidate['content']:
-                    parts = candidate['content']['parts']
-                    if len(parts) > 0 and 'text' in parts[0]:
-                        odpowiedz = parts[0]['text'].strip()
-                        print(f"✅ Gemini odpowiedź: {odpowiedz[:100]}...")
-                        return odpowiedz
+            with tracing.span('gemini.parse'):
+                tekst = tekst_odpowiedzi_gemini(response.content)
+            if tekst is not None:
+                odpowiedz = tekst.strip()
+                log_gemini.info("Gemini odpowiedział", extra={"ms": stoper.ms, "response_len": len(odpowiedz)})
+                return odpowiedz
             
             raise Exception("Nie znaleziono tekstu w odpowiedzi Gemini")
         else:
-            raise Exception(f"Gemini API błąd: {response.status_code} - {response.text}")
+            raise Exception(f"Gemini API błąd: {response.status_code} - {codec.fragment(response)}")
             
     except requests.exceptions.RequestException as e:
         raise Exception(f"Błąd połączenia z Gemini: {e}")
     except Exception as e:
         raise Exception(f"Błąd przetwarzania odpowiedzi Gemini: {e}")
 
-def generuj_odpowiedz_hf(pytanie):
-    """Backup funkcja używająca Hugging Face GPT-2"""
+def generuj_odpowiedz_gemini_stream(pytanie, historia=None):
+    """Generator fragmentów odpowiedzi z Gemini (streamGenerateContent, format SSE)"""
     
-    backup_responses = [
-        "Przepraszam, mam chwilową przerwę w myśleniu! 😅 Spróbuj ponownie za chwilę.",
-        "Moment, muszę się skupić - za bardzo się śmieję z naszej rozmowy! 😄 Napisz ponownie.",
-        "Oj, chyba jestem tak rozrywkowy, że zapomniałem jak mówić! 😊 Spróbuj jeszcze raz.",
-        "Wybacz, ale nasze rozmowy są tak fajne, że nie mogę się skupić! 🤗"
-    ]
+    stoper = logs.Stoper()
+    try:
+        response = wyslij_do_gemini(GEMINI_STREAM_URL, pytanie, historia, stream=True)
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Błąd połączenia z Gemini: {e}")
     
-    # Prompt dostosowany do GPT-2
-    prompt = (
-        "Jestem przyjaznym chatbotem dla Dominiki. "
-        "Dominika to urocza 23-letnia tancerka. "
-        f"Pytanie: {pytanie}\n"
-        "Odpowiedź:"
+    try:
+        log_gemini.debug("Strumień Gemini otwarty", extra={"status": response.status_code, "ms": stoper.ms})
+        if response.status_code != 200:
+            raise Exception(f"Gemini API błąd: {response.status_code} - {codec.fragment(response)}")
+        
+        # Każde zdarzenie SSE to linia "data: {json}" z kolejnym fragmentem odpowiedzi
+        for line in response.iter_lines():
+            if not line or not line.startswith(b'data:'):
+                continue
+            tekst = tekst_odpowiedzi_gemini(line[5:])
+            if tekst:
+                yield tekst
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Błąd połączenia z Gemini: {e}")
+    finally:
+        response.close()
+
+def generuj_odpowiedz_hf_api(pytanie, historia=None, url=None):
+    """Odpowiedź z Hugging Face GPT-2 - rzuca wyjątek, gdy API nie da sensownego tekstu"""
+    
+    # Prompt dostosowany do GPT-2 (szablon prompts/hf_prompt.txt)
+    with tracing.span('hf.body'):
+        prompt = prompts.get().hf_prompt(pytanie, poprzednie_hf(historia))
+    
+    if microbatch.MICROBATCH_ENABLED and batch.BATCH_HF_LIST_INPUTS:
+        # Równoczesne prompty do tego samego modelu idą jednym wywołaniem (lista `inputs`)
+        url = url or API_URL
+        paczki = microbatch.get('hf:' + url, lambda prompty: generuj_paczke_hf(prompty, url))
+        with tracing.span('hf.microbatch'):
+            return paczki.dodaj(prompt)
+    
+    wynik = generuj_paczke_hf([prompt], url)[0]
+    if isinstance(wynik, Exception):
+        raise wynik
+    return wynik
+
+def poprzednie_hf(historia=None):
+    """Wcześniejsze wymiany w tym samym formacie co bieżące pytanie (do promptu GPT-2)"""
+    return "".join(
+        f"{'Pytanie' if rola == sesje.UZYTKOWNIK else 'Odpowiedź'}: {tekst}\n"
+        for rola, tekst in (historia or [])
     )
+
+def tekst_hf(wynik, prompt):
+    """Tekst odpowiedzi GPT-2 bez promptu - None, jeśli nie ma sensownego tekstu"""
+    tekst = wynik.get('generated_text', '') if isinstance(wynik, dict) else ''
+    
+    # Usuń oryginalny prompt z odpowiedzi
+    if tekst.startswith(prompt):
+        tekst = tekst[len(prompt):].strip()
+    
+    # Dla GPT-2 może być też tylko część po "Odpowiedź:"
+    if "Odpowiedź:" in tekst:
+        tekst = tekst.split("Odpowiedź:")[-1].strip()
     
+    return tekst if tekst and len(tekst) > 5 else None
+
+def generuj_odpowiedzi_hf_api(pytania):
+    """Odpowiedzi HF dla wielu pytań w jednym wywołaniu (lista `inputs`) - lista tekstów lub wyjątków"""
+    prompty = prompts.get()
+    return generuj_paczke_hf([prompty.hf_prompt(pytanie) for pytanie in pytania])
+
+def generuj_paczke_hf(wejscia, url=None):
+    """Jedno wywołanie HF dla gotowych promptów - lista tekstów lub wyjątków (po jednym na prompt)"""
+    prompty = prompts.get()
+    with tracing.span('hf.body', inputs=len(wejscia)):
+        # Pojedynczy prompt jako tekst - nie każdy model przyjmuje listę `inputs`
+        body = prompty.hf_body(wejscia[0]) if len(wejscia) == 1 else prompty.hf_body_wiele(wejscia)
+    
+    stoper = logs.Stoper()
+    # 503 "model is loading" i 429 ponawiane z odstępem z estimated_time / Retry-After
+    response = retry.ponawiaj('hf', lambda: http_client.post(
+        url or API_URL, headers=HF_HEADERS, data=body, timeout=http_client.HF_TIMEOUT))
+    log_hf.debug("Odpowiedź HF", extra={"status": response.status_code, "ms": stoper.ms, "inputs": len(wejscia)})
+    
+    if response.status_code != 200:
+        raise Exception(f"Błąd HF API: {response.status_code} - {codec.fragment(response)}")
+    
+    with tracing.span('hf.parse'):
+        result = codec.loads(response.content)
+    if not isinstance(result, list) or len(result) != len(wejscia):
+        raise Exception("Nieoczekiwany format odpowiedzi HF")
+    
+    odpowiedzi = []
+    for prompt, wynik in zip(wejscia, result):
+        # Dla listy wejść HF zwraca listę wygenerowanych tekstów na każde wejście
+        tekst = tekst_hf(wynik[0] if isinstance(wynik, list) and wynik else wynik, prompt)
+        odpowiedzi.append(tekst if tekst else Exception("Brak sensownego tekstu w odpowiedzi HF"))
+    log_hf.info("HF odpowiedział", extra={"ms": stoper.ms, "inputs": len(wejscia),
+                                          "ok": sum(1 for o in odpowiedzi if isinstance(o, str))})
+    return odpowiedzi
+
+def generuj_odpowiedz_hf(pytanie, historia=None):
+    """Backup funkcja używająca Hugging Face GPT-2"""
+    return odpowiedz_zapasowa(pytanie, historia)[0]
+
+def odpowiedz_zapasowa(pytanie, historia=None):
+    """Hugging Face, potem lokalny model, a na końcu gotowa odpowiedź - zwraca (odpowiedź, źródło)"""
     try:
-        payload = {
-            "inputs": prompt,
-            "parameters": {
-                "max_length": 150,
-                "temperature": 0.7,
-                "do_sample": True,
-                "top_p": 0.9,
-                "pad_token_id": 50256
-            }
-        }
-        
-        print(f"🔍 Wysyłam zapytanie do HF: {prompt[:50]}...")
-        response = requests.post(API_URL, headers=headers, json=payload, timeout=10)
-        print(f"📊 Status code: {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            if isinstance(result, list) and len(result) > 0:
-                tekst = result[0].get('generated_text', '')
-                
-                # Usuń oryginalny prompt z odpowiedzi
-                if tekst.startswith(prompt):
-                    tekst = tekst[len(prompt):].strip()
-                
-                # Dla GPT-2 może być też tylko część po "Odpowiedź:"
-                if "Odpowiedź:" in tekst:
-                    tekst = tekst.split("Odpowiedź:")[-1].strip()
-                
-                if tekst and len(tekst) > 5:
-                    print(f"🎉 Zwracam odpowiedź HF: {tekst}")
-                    return tekst
-        else:
-            print(f"❌ Błąd HF API: {response.status_code} - {response.text}")
-        
-        # Fallback do gotowych odpowiedzi
-        import random
-        return random.choice(backup_responses)
-        
+        return metrics.upstream('hf', generuj_odpowiedz_hf_api)(pytanie, historia), 'hf'
     except Exception as e:
-        print(f"💥 Błąd HF API: {e}")
-        import random
-        return random.choice(backup_responses)
+        log_hf.warning("Błąd HF API, próbuję lokalnego modelu", extra={"error": str(e)[:300]})
+    
+    odpowiedz = odpowiedz_lokalna(pytanie, historia)
+    if odpowiedz:
+        return odpowiedz, 'local'
+    # Fallback do gotowych odpowiedzi
+    return odpowiedz_awaryjna(), 'backup'
+
+def odpowiedz_lokalna(pytanie, historia=None):
+    """Odpowiedź lokalnego modelu na CPU (bez sieci) albo None, gdy jest wyłączony lub zawiódł"""
+    if not local_model.model.dostepny:
+        return None
+    prompt = prompts.get().hf_prompt(pytanie, poprzednie_hf(historia))
+    lokalny = circuit_breaker.chron('local', metrics.upstream('local', local_model.model.generuj))
+    try:
+        with tracing.span('provider.local'):
+            tekst = lokalny(prompt, deadline.przytnij(local_model.LOCAL_MODEL_TIMEOUT))
+    except Exception as e:
+        log.warning("Lokalny model nie odpowiedział", extra={"error": str(e)[:300]})
+        return None
+    # Model zwraca tylko nowy tekst - to samo czyszczenie co dla odpowiedzi HF
+    return tekst_hf({'generated_text': tekst}, prompt)
 
 @app.route('/')
 def home():
@@ -238,6 +481,7 @@ def debug():
         <li><a href="/test-hf-backup">🔄 Test HF Backup</a> - test zapasowego HF</li>
         <li><a href="/debug-token-raw">🔍 Debug Raw Token</a> - szczegółowy debug tokena HF</li>
         <li><a href="/test-token">🔐 Test tokena HF</a> - standardowy test HF</li>
+        <li><a href="/status">📈 Status</a> - stan dostawców i circuit breakerów (JSON)</li>
     </ul>
     
     <h2>📁 Wszystkie pliki na serwerze:</h2>
@@ -264,7 +508,7 @@ def test_api():
             }
         }
         
-        response = requests.post(API_URL, headers=headers, json=payload, timeout=15)
+        response = http_client.post(API_URL, headers=headers, json=payload, timeout=http_client.timeout(15))
         
         result_html = f"""
         <h1>🔍 Test API Hugging Face</h1>
@@ -311,6 +555,8 @@ def test_api():
         """
 
 @app.route('/chat', methods=['POST'])
+@metrics.endpoint('chat')
+@ratelimit.ogranicz
 def chat():
     """Endpoint do obsługi wiadomości czatu"""
     data = request.get_json()
@@ -319,13 +565,315 @@ def chat():
     if not user_message:
         return jsonify({'error': 'Pusta wiadomość'}), 400
     
-    # Generuj odpowiedź
-    bot_response = generuj_odpowiedz(user_message)
+    # Identyfikator zapytania do logów i śladu (X-Request-ID od proxy albo nowy)
+    request_id = tracing.nowy_request_id(request.headers.get('X-Request-ID'))
     
-    return jsonify({
+    with tracing.slad('POST /chat', request_id), deadline.termin():
+        # Sesja rozmowy - nowa, jeśli klient nie podał (poprawnego) identyfikatora
+        session_id = sesje.poprawny_id(data.get('session_id')) or sesje.nowy_id()
+        with tracing.span('session.load'):
+            historia = sesje.historia(session_id)
+        
+        # Generuj odpowiedź
+        bot_response = generuj_odpowiedz(user_message, historia, request_id=request_id)
+        
+        # Gotowe odpowiedzi awaryjne nie trafiają do historii
+        if bot_response not in BACKUP_RESPONSES:
+            with tracing.span('session.save'):
+                sesje.dopisz(session_id, user_message, bot_response)
+    
+    odpowiedz = jsonify({
         'response': bot_response,
+        'session_id': session_id,
         'timestamp': datetime.now().strftime('%H:%M')
     })
+    odpowiedz.headers['X-Request-ID'] = request_id
+    return odpowiedz
+
+def gemini_w_limicie(pytanie, historia=None):
+    """Czy strumień Gemini mieści się w limitach RPM/TPM (po ewentualnym krótkim czekaniu)"""
+    try:
+        ratelimit.tempo_gemini(tokeny_gemini(pytanie, historia))
+        return True
+    except ratelimit.LimitPrzekroczonyError:
+        log_gemini.info("Limit Gemini - strumień idzie przez HF")
+        return False
+
+def zdarzenie_sse(dane, event=None):
+    """Formatuje jedno zdarzenie Server-Sent Events"""
+    linia = f"data: {codec.dumps(dane)}\n\n"
+    return f"event: {event}\n{linia}" if event else linia
+
+@app.route('/chat-stream', methods=['POST'])
+@metrics.endpoint('chat-stream')
+@ratelimit.ogranicz
+def chat_stream():
+    """Endpoint czatu przesyłający odpowiedź fragmentami (Server-Sent Events)"""
+    data = request.get_json()
+    user_message = data.get('message', '').strip()
+
+    if not user_message:
+        return jsonify({'error': 'Pusta wiadomość'}), 400
+
+    session_id = sesje.poprawny_id(data.get('session_id')) or sesje.nowy_id()
+    historia = sesje.historia(session_id)
+    request_id = tracing.nowy_request_id(request.headers.get('X-Request-ID'))
+
+    def generuj():
+        # Ślad obejmuje całe przesyłanie strumienia, nie tylko start odpowiedzi
+        with tracing.slad('POST /chat-stream', request_id, **{'history.turns': len(historia)}), \
+                deadline.termin():
+            yield from generuj_zdarzenia()
+
+    def generuj_zdarzenia():
+        odpowiedz = None
+        przerwano = False
+        klucz = klucz_cache(user_message, historia)
+        if klucz:
+            odpowiedz = cache.odpowiedzi.get(klucz)
+            if odpowiedz is not None:
+                metrics.zwieksz('chat_responses_total', source='cache')
+                yield zdarzenie_sse({'text': odpowiedz})
+
+        breaker = circuit_breaker.get('gemini')
+        if odpowiedz is None and USE_GEMINI and gemini_w_limicie(user_message, historia) and breaker.pozwol():
+            start = time.monotonic()
+            fragmenty = []
+            try:
+                with tracing.span('provider.gemini', stream=True):
+                    for fragment in generuj_odpowiedz_gemini_stream(user_message, historia):
+                        fragmenty.append(fragment)
+                        yield zdarzenie_sse({'text': fragment})
+                breaker.zapisz(bool(fragmenty), time.monotonic() - start)
+                metrics.obserwuj('chat_upstream_duration_seconds', time.monotonic() - start,
+                                 provider='gemini', outcome='ok' if fragmenty else 'error')
+                if fragmenty:
+                    metrics.zwieksz('chat_responses_total', source='gemini')
+                    odpowiedz = ''.join(fragmenty).strip()
+                    if klucz:
+                        cache.odpowiedzi.set(klucz, odpowiedz)
+            except Exception as e:
+                log_gemini.warning("Błąd strumienia Gemini",
+                                   extra={"request_id": request_id, "error": str(e)[:300], "chunks": len(fragmenty)})
+                breaker.zapisz(False, time.monotonic() - start)
+                wynik = 'timeout' if metrics.czy_timeout(e) else 'error'
+                if wynik == 'timeout':
+                    metrics.zwieksz('chat_timeouts_total', provider='gemini')
+                metrics.obserwuj('chat_upstream_duration_seconds', time.monotonic() - start,
+                                 provider='gemini', outcome=wynik)
+                if fragmenty:
+                    # Część odpowiedzi już dotarła - nie dokładamy drugiej z backupu
+                    przerwano = True
+                    yield zdarzenie_sse({'error': 'Przerwany strumień'}, event='error')
+
+        if odpowiedz is None and not przerwano:
+            # Fallback do Hugging Face - cała odpowiedź jako jeden fragment
+            with tracing.span('provider.hf'):
+                odpowiedz, zrodlo = odpowiedz_zapasowa(user_message, historia)
+            if zrodlo != 'backup':
+                metrics.zwieksz('chat_responses_total', source=zrodlo)
+                if USE_GEMINI or zrodlo == 'local':
+                    metrics.zwieksz('chat_fallbacks_total', provider=zrodlo)
+            yield zdarzenie_sse({'text': odpowiedz})
+
+        if odpowiedz and odpowiedz not in BACKUP_RESPONSES:
+            sesje.dopisz(session_id, user_message, odpowiedz)
+
+        yield zdarzenie_sse({
+            'session_id': session_id,
+            'request_id': request_id,
+            'timestamp': datetime.now().strftime('%H:%M')
+        }, event='done')
+
+    return Response(
+        stream_with_context(generuj()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Request-ID': request_id}
+    )
+
+def dostawcy_paczki():
+    """(pojedynczo, zbiorczo) dla batch.przetworz - HF zbiorczo, jeśli model przyjmuje listę `inputs`.
+
+    Pojedynczo idą wtedy tylko dostawcy spoza HF - także dodatkowe modele 'hf:<model>',
+    które inaczej dostawałyby każdą wiadomość osobno, zanim trafi ona do paczki.
+    """
+    pojedynczo = dostawcy_odpowiedzi()
+    if not batch.BATCH_HF_LIST_INPUTS:
+        return pojedynczo, None
+    hf = tracing.opakuj('provider.hf', generuj_odpowiedzi_hf_api, batch=True)
+    hf = circuit_breaker.chron('hf', metrics.upstream('hf', hf))
+    return [(nazwa, f) for nazwa, f in pojedynczo if not (nazwa == 'hf' or nazwa.startswith('hf:'))], ('hf', hf)
+
+def wyniki_paczki(wiadomosci, request_id=None):
+    """Generator wyników {index, response, source} lub {index, error} w kolejności ukończenia"""
+    pytania = {}
+    for i, wiadomosc in enumerate(wiadomosci):
+        pytanie = wiadomosc.strip() if isinstance(wiadomosc, str) else ''
+        if not pytanie:
+            yield {'index': i, 'error': 'Pusta wiadomość'}
+            continue
+        klucz = klucz_cache(pytanie)
+        odpowiedz = cache.odpowiedzi.get(klucz) if klucz else None
+        if odpowiedz is not None:
+            metrics.zwieksz('chat_responses_total', source='cache')
+            yield {'index': i, 'response': odpowiedz, 'source': 'cache'}
+            continue
+        pytania[i] = pytanie
+    
+    if not pytania:
+        return
+    indeksy = list(pytania)
+    pojedynczo, zbiorczo = dostawcy_paczki()
+    for j, odpowiedz, zrodlo, blad in batch.przetworz(list(pytania.values()), pojedynczo, zbiorczo):
+        i = indeksy[j]
+        if blad is not None:
+            # Szczegóły tylko w logach - klient dostaje ogólny komunikat
+            log.warning("Brak odpowiedzi dla wiadomości z paczki",
+                        extra={"request_id": request_id, "index": i, "error": blad[:300]})
+            metrics.zwieksz('chat_batch_errors_total')
+            yield {'index': i, 'error': 'Brak odpowiedzi - spróbuj ponownie'}
+            continue
+        metrics.zwieksz('chat_responses_total', source=zrodlo)
+        klucz = klucz_cache(pytania[i])
+        if klucz:
+            cache.odpowiedzi.set(klucz, odpowiedz)
+        yield {'index': i, 'response': odpowiedz, 'source': zrodlo}
+
+@app.route('/chat-batch', methods=['POST'])
+@metrics.endpoint('chat-batch')
+@ratelimit.ogranicz
+def chat_batch():
+    """Wiele wiadomości naraz - wyniki w kolejności albo (stream) NDJSON w kolejności ukończenia"""
+    data = request.get_json(silent=True) or {}
+    wiadomosci = data.get('messages')
+    
+    if not isinstance(wiadomosci, list) or not wiadomosci:
+        return jsonify({'error': 'Podaj listę wiadomości w polu messages'}), 400
+    if len(wiadomosci) > batch.BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Maksymalnie {batch.BATCH_MAX_ITEMS} wiadomości naraz'}), 400
+    
+    request_id = tracing.nowy_request_id(request.headers.get('X-Request-ID'))
+    strumien = bool(data.get('stream')) or 'application/x-ndjson' in request.headers.get('Accept', '')
+    
+    def generuj():
+        with tracing.slad('POST /chat-batch', request_id, items=len(wiadomosci)), \
+                deadline.termin(batch.BATCH_DEADLINE):
+            yield from wyniki_paczki(wiadomosci, request_id)
+    
+    if strumien:
+        # Jedna linia JSON na wiadomość, wysyłana zaraz po jej ukończeniu
+        linie = (codec.dumps(wynik) + '\n' for wynik in generuj())
+        return Response(
+            stream_with_context(linie),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Request-ID': request_id}
+        )
+    
+    odpowiedz = jsonify({
+        'results': sorted(generuj(), key=lambda wynik: wynik['index']),
+        'timestamp': datetime.now().strftime('%H:%M')
+    })
+    odpowiedz.headers['X-Request-ID'] = request_id
+    return odpowiedz
+
+def proba_gemini():
+    """Rozgrzewka Gemini: metadane modelu (bez zużycia limitu generowania) i start cache kontekstu"""
+    response = http_client.get(f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}", headers=GEMINI_HEADERS,
+                               timeout=http_client.timeout(warmup.WARMUP_TIMEOUT))
+    if response.status_code != 200:
+        raise Exception(f"Gemini API błąd: {response.status_code} - {codec.fragment(response)}")
+    prompty = prompts.get()
+    cache_kontekstu.nazwa(prompty.gemini_system, prompty.wersja)
+    return f"HTTP {response.status_code}"
+
+def proba_hf():
+    """Rozgrzewka HF: jeden token z `wait_for_model`, żeby model był załadowany przed pierwszą wiadomością"""
+    payload = {
+        "inputs": "Hej",
+        "parameters": {"max_new_tokens": 1},
+        "options": {"wait_for_model": warmup.WARMUP_HF_WAIT_FOR_MODEL}
+    }
+    response = http_client.post(API_URL, headers=HF_HEADERS, json=payload,
+                                timeout=http_client.timeout(warmup.WARMUP_TIMEOUT))
+    if response.status_code != 200:
+        raise Exception(f"Błąd HF API: {response.status_code} - {codec.fragment(response)}")
+    return f"HTTP {response.status_code}"
+
+def proby_rozgrzewki():
+    """Próby rozgrzewki (nazwa, funkcja) dla magazynu i skonfigurowanych dostawców"""
+    proby = [('store', lambda: store.get_store().nazwa)]
+    if USE_GEMINI:
+        proby.append(('gemini', proba_gemini))
+    if HF_TOKEN and HF_TOKEN != 'TWÓJ_TOKEN_HF':
+        proby.append(('hf', proba_hf))
+    if local_model.LOCAL_MODEL_ENABLED:
+        proby.append(('local', proba_lokalna))
+    return proby
+
+def proba_lokalna():
+    """Wczytanie lokalnego modelu, zanim trafi do niego pierwsze zapytanie"""
+    local_model.model.zaladuj()
+    if not local_model.model.dostepny:
+        raise local_model.ModelNiedostepnyError(local_model.model.statystyki()['error'])
+    return local_model.model.nazwa
+
+def rozgrzej():
+    """Rozgrzewka workera i harmonogram sond modeli - wywoływane z hooka post_worker_init gunicorna"""
+    warmup.rozgrzewka.uruchom(proby_rozgrzewki())
+    probes.uruchom_harmonogram()
+
+@app.route('/healthz')
+def healthz():
+    """Liveness - proces odpowiada (bez I/O i wywołań API)"""
+    return jsonify({'status': 'ok', 'pid': os.getpid(), 'uptime': round(time.time() - START_APLIKACJI, 1)})
+
+@app.route('/readyz')
+def readyz():
+    """Gotowość workera do ruchu z zapamiętanego stanu - bez wywołań API (503, dopóki trwa rozgrzewka)"""
+    konfiguracja = {
+        'prompts': prompts.wczytane(),
+        'gemini': USE_GEMINI,
+        'hf': bool(HF_TOKEN and HF_TOKEN != 'TWÓJ_TOKEN_HF'),
+    }
+    dostawcy = circuit_breaker.wszystkie_skrocone()
+    rozgrzany = warmup.rozgrzewka.gotowy()
+    gotowy = rozgrzany and konfiguracja['prompts']
+    
+    # Otwarte obwody nie zdejmują workera z ruchu - odpowiedzi awaryjne nadal działają
+    skonfigurowani = [nazwa for nazwa in ('gemini', 'hf') if konfiguracja[nazwa]]
+    return jsonify({
+        'status': 'ready' if gotowy else ('warming' if not rozgrzany else 'not_ready'),
+        'config': konfiguracja,
+        'providers': dostawcy,
+        'degraded': bool(skonfigurowani) and all(
+            dostawcy.get(nazwa, {}).get('state') == circuit_breaker.OTWARTY for nazwa in skonfigurowani),
+        'warmup': warmup.rozgrzewka.status,
+    }), 200 if gotowy else 503
+
+@app.route('/status')
+def status():
+    """Stan dostawców i circuit breakerów (JSON, bez wywołań API)"""
+    return jsonify({
+        'gemini_configured': USE_GEMINI,
+        'hf_configured': bool(HF_TOKEN and HF_TOKEN != 'TWÓJ_TOKEN_HF'),
+        'dispatch_mode': dispatch.DISPATCH_MODE,
+        'circuit_breakers': circuit_breaker.wszystkie(),
+        'cache': cache.odpowiedzi.statystyki(),
+        'singleflight': singleflight.zapytania.statystyki(),
+        'rate_limit': ratelimit.statystyki(),
+        'retry_budgets': retry.statystyki(),
+        'routing': routing.router.statystyki(),
+        'local_model': local_model.model.statystyki(),
+        'json_codec': codec.NAZWA,
+        'microbatch': microbatch.statystyki(),
+        'gemini_context_cache': cache_kontekstu.statystyki(),
+        'warmup': warmup.rozgrzewka.statystyki()
+    })
+
+@app.route('/metrics')
+def metryki():
+    """Metryki wszystkich workerów w formacie Prometheusa"""
+    return Response(metrics.eksport(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/test-token')
 def test_token():
@@ -335,10 +883,10 @@ def test_token():
         test_headers = {"Authorization": f"Bearer {HF_TOKEN}"}
         
         # Próba prostego zapytania do API - test tokena
-        response = requests.get(
+        response = http_client.get(
             "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium",
             headers=test_headers,
-            timeout=10
+            timeout=http_client.timeout(10)
         )
         
         result_html = f"""
@@ -392,57 +940,55 @@ def test_token():
         <p><a href="/">🏠 Powrót do chatbota</a></p>
         """
 
+def proba_modelu_hf(model, prompt, parametry):
+    """Jedno wywołanie modelu HF dla sondy - kod odpowiedzi i próbka wygenerowanego tekstu"""
+    url = f"https://api-inference.huggingface.co/models/{model}"
+    payload = {"inputs": prompt, "parameters": parametry}
+    response = http_client.post(url, headers=headers, json=payload, timeout=http_client.timeout(probes.PROBE_DEADLINE))
+    
+    wynik = {'ok': response.status_code == 200, 'status_code': response.status_code, 'raw': codec.fragment(response)}
+    if response.status_code == 200:
+        try:
+            json_data = codec.loads(response.content)
+            tekst = json_data[0].get('generated_text', 'Brak tekstu') if isinstance(json_data, list) and json_data else 'Brak odpowiedzi'
+            # Usuń oryginalny prompt z odpowiedzi
+            if tekst.startswith(prompt):
+                tekst = tekst[len(prompt):].strip()
+            wynik['sample'] = tekst[:200]
+        except (ValueError, AttributeError):
+            wynik['sample'] = "Błąd parsowania JSON"
+    return wynik
+
+def naglowek_sondy(zapis, sciezka):
+    """Wiersz z wiekiem wyników sondy i linkiem do ponownego sprawdzenia"""
+    wiek = time.time() - zapis['checked_at']
+    return (f"<p><strong>Sprawdzono:</strong> {wiek:.0f} s temu "
+            f"(wyniki odświeżane co {probes.PROBE_TTL:g} s) - <a href=\"{sciezka}?refresh=1\">🔄 Sprawdź teraz</a></p>")
+
+TEST_MODELS_INPUT = "Cześć! Jak się masz?"
+sonda_modeli = probes.zarejestruj('models', [
+    "openai-community/gpt2",        # Stabilny GPT-2
+    "gpt2",                         # Alternatywny GPT-2
+    "facebook/blenderbot-400M-distill",
+    "microsoft/DialoGPT-medium", 
+    "facebook/blenderbot-small-90M",
+    "google/flan-t5-small"
+], functools.partial(proba_modelu_hf, prompt=TEST_MODELS_INPUT, parametry={
+    "max_length": 100,
+    "temperature": 0.7,
+    "do_sample": True
+}))
+
 @app.route('/test-models')
 def test_models():
-    """Test różnych modeli do chatbota"""
-    models_to_test = [
-        "openai-community/gpt2",        # Stabilny GPT-2
-        "gpt2",                         # Alternatywny GPT-2
-        "facebook/blenderbot-400M-distill",
-        "microsoft/DialoGPT-medium", 
-        "facebook/blenderbot-small-90M",
-        "google/flan-t5-small"
-    ]
-    
-    results = []
-    test_input = "Cześć! Jak się masz?"
-    
-    for model in models_to_test:
-        try:
-            url = f"https://api-inference.huggingface.co/models/{model}"
-            
-            payload = {
-                "inputs": test_input,
-                "parameters": {
-                    "max_length": 100,
-                    "temperature": 0.7,
-                    "do_sample": True
-                }
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=15)
-            
-            status = "✅ OK" if response.status_code == 200 else f"❌ Error {response.status_code}"
-            
-            results.append({
-                'model': model,
-                'status': status,
-                'response_code': response.status_code,
-                'response_text': response.text[:200]
-            })
-            
-        except Exception as e:
-            results.append({
-                'model': model,
-                'status': f"❌ Exception: {str(e)[:100]}",
-                'response_code': 'Error',
-                'response_text': str(e)
-            })
+    """Test różnych modeli do chatbota - wyniki sondy (wszystkie modele naraz, z cache)"""
+    zapis = sonda_modeli.wyniki(odswiez=request.args.get('refresh') == '1')
     
     result_html = f"""
     <h1>🤖 Test różnych modeli</h1>
-    <p><strong>Test input:</strong> {test_input}</p>
+    <p><strong>Test input:</strong> {TEST_MODELS_INPUT}</p>
     <p><strong>Token Status:</strong> {'✅ Set' if HF_TOKEN and HF_TOKEN != 'TWÓJ_TOKEN_HF' else '❌ Not set'}</p>
+    {naglowek_sondy(zapis, '/test-models')}
     
     <h2>Wyniki:</h2>
     <table border="1" style="border-collapse: collapse; width: 100%;">
@@ -450,17 +996,25 @@ def test_models():
             <th>Model</th>
             <th>Status</th>
             <th>Response Code</th>
+            <th>Czas</th>
             <th>Response Preview</th>
         </tr>
     """
     
-    for result in results:
+    for result in zapis['results']:
+        if result['ok']:
+            status = "✅ OK"
+        elif result['status_code']:
+            status = f"❌ Error {result['status_code']}"
+        else:
+            status = f"❌ Exception: {result.get('error', '')[:100]}"
         result_html += f"""
         <tr>
             <td>{result['model']}</td>
-            <td>{result['status']}</td>
-            <td>{result['response_code']}</td>
-            <td><pre style="white-space: pre-wrap; max-width: 300px; overflow: hidden;">{result['response_text']}</pre></td>
+            <td>{status}</td>
+            <td>{result['status_code'] or 'Error'}</td>
+            <td>{result['ms'] if result['ms'] is not None else '-'} ms</td>
+            <td><pre style="white-space: pre-wrap; max-width: 300px; overflow: hidden;">{result.get('raw', result.get('error', ''))}</pre></td>
         </tr>
         """
     
@@ -469,7 +1023,7 @@ def test_models():
     
     <h2>Instrukcje:</h2>
     <p>Model z statusem ✅ OK można użyć w chatbocie</p>
-    <p>Aby zmienić model, zaktualizuj zmienną API_URL w kodzie</p>
+    <p>Aby zmienić model, ustaw zmienną HF_API_URL</p>
     
     <hr>
     <p><a href="/test-token">🔐 Test tokena</a></p>
@@ -569,10 +1123,10 @@ def test_hardcoded_token():
     try:
         test_headers = {"Authorization": f"Bearer {HARDCODED_TOKEN}"}
         
-        response = requests.get(
+        response = http_client.get(
             "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium",
             headers=test_headers,
-            timeout=10
+            timeout=http_client.timeout(10)
         )
         
         hardcoded_test_result = f"""
@@ -635,10 +1189,10 @@ def test_token_formats():
         try:
             test_headers = {"Authorization": header_value}
             
-            response = requests.get(
+            response = http_client.get(
                 "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium",
                 headers=test_headers,
-                timeout=10
+                timeout=http_client.timeout(10)
             )
             
             status = "✅ OK" if response.status_code == 200 else f"❌ {response.status_code}"
@@ -729,7 +1283,7 @@ def test_simple_api():
             # Bardzo prosty payload
             payload = {"inputs": "Hello"}
             
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
+            response = http_client.post(url, headers=headers, json=payload, timeout=http_client.timeout(10))
             
             status = "✅ OK" if response.status_code == 200 else f"❌ {response.status_code}"
             
@@ -786,79 +1340,32 @@ def test_simple_api():
     
     return result_html
 
+TEST_GPT2_PROMPT = "Cześć! Jestem przyjaznym chatbotem. Jak się masz?"
+sonda_gpt2 = probes.zarejestruj('gpt2', [
+    "openai-community/gpt2",
+    "gpt2",
+    "distilgpt2",
+    "openai-community/gpt2-medium",
+    "openai-community/gpt2-large"
+], functools.partial(proba_modelu_hf, prompt=TEST_GPT2_PROMPT, parametry={
+    # Parametry dostosowane do GPT-2
+    "max_length": 100,
+    "temperature": 0.7,
+    "do_sample": True,
+    "top_p": 0.9,
+    "pad_token_id": 50256
+}))
+
 @app.route('/test-gpt2')
 def test_gpt2():
-    """Test specjalnie dla modelu GPT-2"""
-    
-    # Test różnych wariantów GPT-2
-    gpt2_models = [
-        "openai-community/gpt2",
-        "gpt2",
-        "distilgpt2",
-        "openai-community/gpt2-medium",
-        "openai-community/gpt2-large"
-    ]
-    
-    # Prosty prompt dla GPT-2
-    test_prompt = "Cześć! Jestem przyjaznym chatbotem. Jak się masz?"
-    
-    results = []
-    
-    for model in gpt2_models:
-        try:
-            url = f"https://api-inference.huggingface.co/models/{model}"
-            headers = {"Authorization": f"Bearer {HF_TOKEN}"}
-            
-            # Parametry dostosowane do GPT-2
-            payload = {
-                "inputs": test_prompt,
-                "parameters": {
-                    "max_length": 100,
-                    "temperature": 0.7,
-                    "do_sample": True,
-                    "top_p": 0.9,
-                    "pad_token_id": 50256
-                }
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=15)
-            
-            status = "✅ OK" if response.status_code == 200 else f"❌ {response.status_code}"
-            
-            # Sparsuj odpowiedź
-            generated_text = "Brak odpowiedzi"
-            if response.status_code == 200:
-                try:
-                    json_data = response.json()
-                    if isinstance(json_data, list) and len(json_data) > 0:
-                        generated_text = json_data[0].get('generated_text', 'Brak tekstu')
-                        # Usuń oryginalny prompt z odpowiedzi
-                        if generated_text.startswith(test_prompt):
-                            generated_text = generated_text[len(test_prompt):].strip()
-                except:
-                    generated_text = "Błąd parsowania JSON"
-            
-            results.append({
-                'model': model,
-                'status': status,
-                'response_code': response.status_code,
-                'generated_text': generated_text[:200],
-                'raw_response': response.text[:200]
-            })
-            
-        except Exception as e:
-            results.append({
-                'model': model,
-                'status': f"❌ Error: {str(e)[:50]}",
-                'response_code': 'Exception',
-                'generated_text': str(e)[:100],
-                'raw_response': str(e)[:200]
-            })
+    """Test specjalnie dla modelu GPT-2 - wyniki sondy (wszystkie warianty naraz, z cache)"""
+    zapis = sonda_gpt2.wyniki(odswiez=request.args.get('refresh') == '1')
     
     result_html = f"""
     <h1>🤖 Test GPT-2 Models</h1>
-    <p><strong>Test Prompt:</strong> {test_prompt}</p>
+    <p><strong>Test Prompt:</strong> {TEST_GPT2_PROMPT}</p>
     <p><strong>Token Status:</strong> {'✅ Set' if HF_TOKEN and HF_TOKEN != 'TWÓJ_TOKEN_HF' else '❌ Not set'}</p>
+    {naglowek_sondy(zapis, '/test-gpt2')}
     
     <h2>Wyniki:</h2>
     <table border="1" style="border-collapse: collapse; width: 100%;">
@@ -866,19 +1373,27 @@ def test_gpt2():
             <th>Model</th>
             <th>Status</th>
             <th>Response Code</th>
+            <th>Czas</th>
             <th>Generated Text</th>
             <th>Raw Response</th>
         </tr>
     """
     
-    for result in results:
+    for result in zapis['results']:
+        if result['ok']:
+            status = "✅ OK"
+        elif result['status_code']:
+            status = f"❌ {result['status_code']}"
+        else:
+            status = f"❌ Error: {result.get('error', '')[:50]}"
         result_html += f"""
         <tr>
             <td>{result['model']}</td>
-            <td>{result['status']}</td>
-            <td>{result['response_code']}</td>
-            <td><pre style="white-space: pre-wrap; max-width: 250px; overflow: hidden;">{result['generated_text']}</pre></td>
-            <td><pre style="white-space: pre-wrap; max-width: 250px; overflow: hidden;">{result['raw_response']}</pre></td>
+            <td>{status}</td>
+            <td>{result['status_code'] or 'Exception'}</td>
+            <td>{result['ms'] if result['ms'] is not None else '-'} ms</td>
+            <td><pre style="white-space: pre-wrap; max-width: 250px; overflow: hidden;">{result.get('sample', 'Brak odpowiedzi')}</pre></td>
+            <td><pre style="white-space: pre-wrap; max-width: 250px; overflow: hidden;">{result.get('raw', result.get('error', ''))}</pre></td>
         </tr>
         """
     
@@ -1021,7 +1536,7 @@ def test_gemini_simple():
             'X-goog-api-key': GEMINI_API_KEY
         }
         
-        response = requests.post(GEMINI_API_URL, headers=headers, json=payload, timeout=10)
+        response = http_client.post(GEMINI_API_URL, headers=headers, json=payload, timeout=http_client.timeout(10))
         
         result_html = f"""
         <h1>🧪 Test Simple Gemini</h1>
@@ -1210,4 +1725,6 @@ if __name__ == '__main__':
     else:
         print("🌐 Aplikacja działa w trybie produkcyjnym")
     
+    # Serwer developerski przyjmuje ruch od razu - rozgrzewka w tle
+    warmup.rozgrzewka.uruchom_w_tle(proby_rozgrzewki())
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
@@ -0,0 +1,109 @@
+"""Przetwarzanie wielu wiadomości w jednym zapytaniu (endpoint /chat-batch).
+
+Każda wiadomość to osobny początek rozmowy. Dostawcy pojedynczy (Gemini)
+pracują w puli BATCH_CONCURRENCY wątków, a wiadomości, na które żaden nie
+odpowiedział, trafiają zbiorczo do dostawcy paczkowego (HF - lista `inputs`)
+po BATCH_HF_SIZE naraz. Wyniki wychodzą w kolejności ukończenia, z indeksem
+wiadomości; błąd jednej wiadomości nie przerywa pozostałych.
+
+Całość ograniczona jest terminem BATCH_DEADLINE (deadline.py) - wiadomości
+bez odpowiedzi do tego czasu kończą się błędem.
+"""
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import deadline
+import logs
+import tracing
+from settings import env_bool, env_int, env_float
+
+log = logs.get('batch')
+
+BATCH_MAX_ITEMS = env_int('BATCH_MAX_ITEMS', 50)
+BATCH_CONCURRENCY = env_int('BATCH_CONCURRENCY', 4)
+BATCH_HF_SIZE = env_int('BATCH_HF_SIZE', 8)
+BATCH_DEADLINE = env_float('BATCH_DEADLINE', 60.0)
+# Czy model HF przyjmuje listę w `inputs` - inaczej HF odpowiada na każdą wiadomość osobno
+BATCH_HF_LIST_INPUTS = env_bool('BATCH_HF_LIST_INPUTS', True)
+
+
+def przetworz(pytania, pojedynczo=(), zbiorczo=None, rownolegle=BATCH_CONCURRENCY, paczka=BATCH_HF_SIZE):
+    """Generator (indeks, odpowiedź, źródło, błąd) - po jednym na każde pytanie.
+
+    `pojedynczo` to lista (nazwa, funkcja(pytanie)) próbowanych kolejno dla
+    każdego pytania; `zbiorczo` to (nazwa, funkcja(lista pytań)) zwracająca
+    listę odpowiedzi lub wyjątków w tej samej kolejności. Powinien być
+    wywoływany w terminie zapytania (deadline.termin).
+    """
+    wyniki = queue.Queue()  # (z_paczki, indeks, odpowiedź, źródło, błąd)
+    bledy = {i: [] for i in range(len(pytania))}
+
+    def pojedyncze(i):
+        for nazwa, funkcja in pojedynczo:
+            if deadline.pozostalo() == 0:
+                break
+            try:
+                wyniki.put((False, i, funkcja(pytania[i]), nazwa, None))
+                return
+            except Exception as e:
+                bledy[i].append(f"{nazwa}: {e}")
+        # Bez odpowiedzi i bez błędu końcowego - pytanie przechodzi do paczki
+        wyniki.put((False, i, None, None, None))
+
+    def zbiorcze(indeksy):
+        nazwa, funkcja = zbiorczo
+        try:
+            odpowiedzi = funkcja([pytania[i] for i in indeksy])
+        except Exception as e:
+            odpowiedzi = [e] * len(indeksy)
+        for i, odpowiedz in zip(indeksy, odpowiedzi):
+            if isinstance(odpowiedz, Exception):
+                bledy[i].append(f"{nazwa}: {odpowiedz}")
+                wyniki.put((True, i, None, None, "; ".join(bledy[i])))
+            else:
+                wyniki.put((True, i, odpowiedz, nazwa, None))
+
+    pula = ThreadPoolExecutor(max_workers=max(rownolegle, 1), thread_name_prefix='batch')
+    # Każde zadanie dostaje kopię kontekstu (ślad i termin zapytania)
+    if pojedynczo:
+        for i in range(len(pytania)):
+            pula.submit(tracing.w_kontekscie(pojedyncze), i)
+        pojedyncze_w_toku = len(pytania)
+        do_paczki = []
+    else:
+        pojedyncze_w_toku = 0
+        do_paczki = list(range(len(pytania)))
+
+    zostalo = set(range(len(pytania)))
+    try:
+        while zostalo:
+            # Paczka idzie, gdy jest pełna albo nic więcej już do niej nie trafi
+            while do_paczki and (len(do_paczki) >= paczka or not pojedyncze_w_toku):
+                czesc, do_paczki = do_paczki[:paczka], do_paczki[paczka:]
+                if zbiorczo:
+                    pula.submit(tracing.w_kontekscie(zbiorcze), czesc)
+                    continue
+                for i in czesc:
+                    zostalo.discard(i)
+                    yield i, None, None, "; ".join(bledy[i]) or "Brak dostawców"
+            if not zostalo:
+                break
+
+            try:
+                z_paczki, i, odpowiedz, zrodlo, blad = wyniki.get(timeout=deadline.pozostalo())
+            except queue.Empty:
+                log.warning("Przekroczony termin paczki", extra={"pending": len(zostalo)})
+                for i in sorted(zostalo):
+                    yield i, None, None, "Przekroczony termin zapytania"
+                return
+
+            if not z_paczki:
+                pojedyncze_w_toku -= 1
+                if zrodlo is None:
+                    do_paczki.append(i)
+                    continue
+            zostalo.discard(i)
+            yield i, odpowiedz, zrodlo, blad
+    finally:
+        # Niedokończone wywołania kończą się w tle, a ich wyniki są pomijane
+        pula.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,5 @@
+"""Benchmark czatu bez prawdziwych API: mock Gemini/HF, generator obciążenia i porównanie z bazą.
+
+Uruchomienie z katalogu głównego repozytorium:
+    python -m benchmark.run
+"""
@@ -0,0 +1,211 @@
+"""Generator obciążenia dla /chat i raport opóźnień.
+
+Dla każdego poziomu współbieżności N wątków wysyła zapytania do /chat
+(albo /chat-stream) i mierzy czas do pełnej odpowiedzi. Raport: przepustowość,
+p50/p95/p99, błędy - w strumieniu także odpowiedź 200 z `event: error`.
+Wyniki można zapisać jako bazę (JSON) i porównać z nią kolejny przebieg -
+regresja powyżej tolerancji kończy się kodem 1, podobnie jak poziom, na którym
+odsetek nieudanych odpowiedzi przekracza --max-error-rate.
+
+Samodzielnie (aplikacja już działa):
+    python -m benchmark.load --url http://localhost:5000 --concurrency 1,8,32
+"""
+import argparse
+import itertools
+import json
+import secrets
+import sys
+import threading
+import time
+
+import requests
+
+PYTANIA = [
+    "Cześć! Jak się masz?",
+    "Opowiedz mi żart o tańcu",
+    "Jaki taniec powinnam dziś poćwiczyć?",
+    "Daj mi komplement na dobry dzień",
+    "Co sądzisz o salsie?",
+]
+
+# Numeracja pytań wspólna dla wszystkich poziomów i inna w każdym przebiegu,
+# żeby kolejne poziomy nie trafiały w cache wypełniony przez poprzednie
+_numery = itertools.count()
+_PRZEBIEG = secrets.token_hex(3)
+
+ZDARZENIE_BLEDU = b'event: error'
+
+# Metryki porównywane z bazą: nazwa -> czy większa wartość jest lepsza
+POROWNYWANE = {'rps': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False}
+
+
+def percentyl(posortowane, p):
+    """Percentyl metodą najbliższego rangą (posortowana lista)"""
+    if not posortowane:
+        return 0.0
+    indeks = max(int(round(p / 100 * len(posortowane) + 0.5)) - 1, 0)
+    return posortowane[min(indeks, len(posortowane) - 1)]
+
+
+def _zapytanie(sesja, url, strumien, pytanie):
+    if not strumien:
+        response = sesja.post(f"{url}/chat", json={'message': pytanie}, timeout=60)
+        response.content
+        return response.status_code
+    with sesja.post(f"{url}/chat-stream", json={'message': pytanie}, timeout=60, stream=True) as response:
+        blad = False
+        ogon = b''
+        for fragment in response.iter_content(chunk_size=None):
+            # Ramka może być podzielona między fragmenty - szukamy też na styku
+            blad = blad or ZDARZENIE_BLEDU in ogon + fragment
+            ogon = fragment[-len(ZDARZENIE_BLEDU):]
+        # 200 z `event: error` to przerwana albo nieudana odpowiedź, nie sukces
+        return 'event: error' if blad and response.status_code == 200 else response.status_code
+
+
+def poziom(url, wspolbieznosc, liczba, strumien=False, unikalne=True, rozgrzewka=0):
+    """Wyniki jednego poziomu współbieżności"""
+    licznik = itertools.count()
+    czasy = []
+    bledy = {}
+    lock = threading.Lock()
+
+    def pracownik():
+        sesja = requests.Session()
+        while True:
+            i = next(licznik)
+            if i >= liczba + rozgrzewka:
+                return
+            pytanie = PYTANIA[i % len(PYTANIA)]
+            if unikalne:
+                # Inna treść w każdym zapytaniu, żeby nie mierzyć samego cache
+                pytanie = f"{pytanie} #{_PRZEBIEG}-{next(_numery)}"
+            start = time.perf_counter()
+            try:
+                status = _zapytanie(sesja, url, strumien, pytanie)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            czas = time.perf_counter() - start
+            if i < rozgrzewka:
+                continue
+            with lock:
+                if isinstance(status, int) and 200 <= status < 300:
+                    czasy.append(czas)
+                else:
+                    bledy[str(status)] = bledy.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    watki = [threading.Thread(target=pracownik) for _ in range(wspolbieznosc)]
+    for w in watki:
+        w.start()
+    for w in watki:
+        w.join()
+    calkowity = time.perf_counter() - start
+
+    czasy.sort()
+    return {
+        'concurrency': wspolbieznosc,
+        'requests': liczba,
+        'ok': len(czasy),
+        'errors': bledy,
+        'rps': round(len(czasy) / calkowity, 2) if calkowity else 0.0,
+        'p50_ms': round(percentyl(czasy, 50) * 1000, 1),
+        'p95_ms': round(percentyl(czasy, 95) * 1000, 1),
+        'p99_ms': round(percentyl(czasy, 99) * 1000, 1),
+        'max_ms': round(czasy[-1] * 1000, 1) if czasy else 0.0,
+    }
+
+
+def raport(wyniki):
+    """Tabela wyników jako tekst"""
+    linie = [f"{'N':>5} {'ok':>6} {'błędy':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for w in wyniki:
+        linie.append(f"{w['concurrency']:>5} {w['ok']:>6} {sum(w['errors'].values()):>6} {w['rps']:>8} "
+                     f"{w['p50_ms']:>9} {w['p95_ms']:>9} {w['p99_ms']:>9} {w['max_ms']:>9}")
+    return '\n'.join(linie)
+
+
+def porownaj(wyniki, baza, tolerancja):
+    """Porównanie z bazą - zwraca (tekst, czy_regresja)"""
+    bazowe = {w['concurrency']: w for w in baza.get('results', [])}
+    linie = []
+    regresja = False
+    for w in wyniki:
+        b = bazowe.get(w['concurrency'])
+        if b is None:
+            linie.append(f"N={w['concurrency']}: brak w bazie")
+            continue
+        czesci = []
+        for metryka, wiecej_lepiej in POROWNYWANE.items():
+            if not b.get(metryka):
+                continue
+            zmiana = (w[metryka] - b[metryka]) / b[metryka]
+            gorzej = -zmiana if wiecej_lepiej else zmiana
+            znacznik = ''
+            if gorzej > tolerancja:
+                znacznik = ' ❌'
+                regresja = True
+            czesci.append(f"{metryka} {b[metryka]} → {w[metryka]} ({zmiana:+.1%}){znacznik}")
+        linie.append(f"N={w['concurrency']}: " + ', '.join(czesci))
+    return '\n'.join(linie), regresja
+
+
+def dodaj_argumenty(parser):
+    """Argumenty generatora (wspólne z benchmark.run)"""
+    parser.add_argument('--concurrency', default='1,8,32', help='poziomy współbieżności, np. 1,8,32')
+    parser.add_argument('--requests', type=int, default=200, help='liczba zapytań na poziom')
+    parser.add_argument('--warmup', type=int, default=10, help='zapytania rozgrzewające (niemierzone)')
+    parser.add_argument('--stream', action='store_true', help='/chat-stream zamiast /chat')
+    parser.add_argument('--repeat-prompts', action='store_true', help='powtarzaj te same pytania (test cache)')
+    parser.add_argument('--save-baseline', metavar='PLIK', help='zapisz wyniki jako bazę')
+    parser.add_argument('--baseline', metavar='PLIK', help='porównaj z bazą')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='dopuszczalne pogorszenie (0.10 = 10%%)')
+    parser.add_argument('--max-error-rate', type=float, default=0.5,
+                        help='dopuszczalny odsetek nieudanych odpowiedzi na poziomie (0.5 = 50%%)')
+
+
+def wykonaj(url, args, opis=None):
+    """Przebieg wszystkich poziomów, raport i porównanie z bazą - zwraca kod wyjścia"""
+    wyniki = []
+    nieudane = []
+    for n in (int(x) for x in args.concurrency.split(',')):
+        wynik = poziom(url, n, args.requests, args.stream, not args.repeat_prompts, args.warmup)
+        wyniki.append(wynik)
+        bledy = sum(wynik['errors'].values())
+        if bledy > args.max_error_rate * wynik['requests']:
+            nieudane.append(n)
+            print(f"❌ N={n}: {bledy}/{wynik['requests']} nieudanych odpowiedzi {wynik['errors']}", file=sys.stderr)
+        else:
+            print(f"✅ N={n}: {wynik['rps']} rps, p95 {wynik['p95_ms']} ms", file=sys.stderr)
+
+    print(raport(wyniki))
+    if nieudane:
+        print(f"\n❌ Za dużo błędów na poziomach: {', '.join(map(str, nieudane))} - wyniki nie są miarodajne")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'setup': opis or {}, 'results': wyniki}, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"💾 Baza zapisana: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baza = json.load(f)
+        if opis and baza.get('setup') and baza['setup'] != opis:
+            print(f"⚠️ Inne ustawienia niż w bazie: {baza['setup']}", file=sys.stderr)
+        tekst, regresja = porownaj(wyniki, baza, args.tolerance)
+        print(f"\n📊 Porównanie z {args.baseline} (tolerancja {args.tolerance:.0%}):\n{tekst}")
+        return 1 if regresja or nieudane else 0
+    return 1 if nieudane else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    dodaj_argumenty(parser)
+    args = parser.parse_args()
+    sys.exit(wykonaj(args.url.rstrip('/'), args))
+
+
+if __name__ == '__main__':
+    main()
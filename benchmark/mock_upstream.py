@@ -0,0 +1,264 @@
+"""Lokalny mock Gemini i Hugging Face do benchmarków.
+
+Obsługuje:
+- POST /v1beta/models/<model>:generateContent
+- POST /v1beta/models/<model>:streamGenerateContent?alt=sse (fragmenty co --chunk-delay-ms)
+- POST/PATCH /v1beta/cachedContents[/<nazwa>]
+- POST /models/<model> (HF Inference API, także lista w `inputs`)
+
+Opóźnienie odpowiedzi ma rozkład log-normalny (mediana --*-latency-ms,
+rozrzut --sigma). Część odpowiedzi to błędy 500 (--*-error-rate) albo 429
+z Retry-After (--*-429-rate); HF zwraca też 503 "model is loading" z
+estimated_time (--hf-loading-rate). Część strumieni Gemini urywa się po
+pierwszym fragmencie (--stream-break-rate).
+
+Samodzielnie: python -m benchmark.mock_upstream --port 8090
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ODPOWIEDZ = "Hej Dominiko! 💃 Twoje pytanie rozbawiło mnie do łez - jesteś niesamowita!"
+
+_GEMINI = re.compile(r'^/v1beta/models/[^/:]+:(generateContent|streamGenerateContent)')
+
+
+@dataclass
+class Profil:
+    """Rozkład opóźnień i błędów jednego dostawcy"""
+    latency_ms: float = 300.0
+    sigma: float = 0.4
+    error_rate: float = 0.0
+    rate_429: float = 0.0
+    retry_after: int = 1
+
+    def opoznienie(self, los):
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.latency_ms * math.exp(los.gauss(0, self.sigma)) / 1000
+
+    def blad(self, los):
+        """None albo (status, treść, nagłówki) wylosowanego błędu"""
+        x = los.random()
+        if x < self.rate_429:
+            return 429, {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED'}}, {'Retry-After': str(self.retry_after)}
+        if x < self.rate_429 + self.error_rate:
+            return 500, {'error': {'code': 500, 'status': 'INTERNAL'}}, {}
+        return None
+
+
+@dataclass
+class Konfiguracja:
+    gemini: Profil
+    hf: Profil
+    hf_loading_rate: float = 0.0
+    stream_chunks: int = 4
+    chunk_delay_ms: float = 40.0
+    stream_break_rate: float = 0.0
+    seed: int = None
+
+
+class Liczniki:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wartosci = {}
+
+    def zwieksz(self, klucz):
+        with self._lock:
+            self.wartosci[klucz] = self.wartosci.get(klucz, 0) + 1
+
+
+def _tekst_gemini(tekst):
+    return {'candidates': [{'content': {'role': 'model', 'parts': [{'text': tekst}]}, 'finishReason': 'STOP'}]}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    konfiguracja = None
+    liczniki = None
+    los = None
+
+    def log_message(self, *args):
+        pass
+
+    def _wyslij(self, status, dane, naglowki=None):
+        tresc = json.dumps(dane, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(tresc)))
+        for nazwa, wartosc in (naglowki or {}).items():
+            self.send_header(nazwa, wartosc)
+        self.end_headers()
+        self.wfile.write(tresc)
+
+    def _tresc(self):
+        dlugosc = int(self.headers.get('Content-Length') or 0)
+        dane = self.rfile.read(dlugosc) if dlugosc else b''
+        return json.loads(dane) if dane else {}
+
+    def do_GET(self):
+        # Metadane modelu Gemini (próba rozgrzewki workera)
+        if self.path.startswith('/v1beta/models/'):
+            self.liczniki.zwieksz('gemini_models')
+            return self._wyslij(200, {'name': self.path.split('/v1beta/', 1)[-1]})
+        self._wyslij(404, {'error': 'unknown path'})
+
+    def do_PATCH(self):
+        self._tresc()
+        self._cached_contents({'name': self.path.split('/v1beta/', 1)[-1]})
+
+    def _cached_contents(self, odpowiedz):
+        # Opóźnienia i błędy jak w pozostałych wywołaniach Gemini
+        profil = self.konfiguracja.gemini
+        blad = profil.blad(self.los)
+        time.sleep(profil.opoznienie(self.los))
+        if blad:
+            self.liczniki.zwieksz(f'cached_contents_{blad[0]}')
+            return self._wyslij(*blad)
+        self.liczniki.zwieksz('cached_contents')
+        self._wyslij(200, odpowiedz)
+
+    def do_POST(self):
+        tresc = self._tresc()
+        if self.path.startswith('/v1beta/cachedContents'):
+            return self._cached_contents({'name': f"cachedContents/mock{random.randrange(10**6)}"})
+
+        dopasowanie = _GEMINI.match(self.path)
+        if dopasowanie:
+            return self._gemini(dopasowanie.group(1) == 'streamGenerateContent')
+        if self.path.startswith('/models/'):
+            return self._hf(tresc)
+        self._wyslij(404, {'error': 'unknown path'})
+
+    def _gemini(self, strumien):
+        profil = self.konfiguracja.gemini
+        blad = profil.blad(self.los)
+        time.sleep(profil.opoznienie(self.los))
+        if blad:
+            self.liczniki.zwieksz(f'gemini_{blad[0]}')
+            return self._wyslij(*blad)
+        self.liczniki.zwieksz('gemini_stream' if strumien else 'gemini')
+        if not strumien:
+            return self._wyslij(200, _tekst_gemini(ODPOWIEDZ))
+
+        # SSE w kodowaniu chunked, jak w Gemini - połączenie zerwane przed
+        # końcowym pustym chunkiem to dla klienta błąd strumienia
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        urwij = self.los.random() < self.konfiguracja.stream_break_rate
+        slowa = ODPOWIEDZ.split(' ')
+        n = max(self.konfiguracja.stream_chunks, 1)
+        krok = math.ceil(len(slowa) / n)
+        for i in range(0, len(slowa), krok):
+            fragment = ' '.join(slowa[i:i + krok]) + (' ' if i + krok < len(slowa) else '')
+            zdarzenie = b'data: ' + json.dumps(_tekst_gemini(fragment), ensure_ascii=False).encode('utf-8') + b'\r\n\r\n'
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(zdarzenie), zdarzenie))
+            self.wfile.flush()
+            if urwij:
+                self.liczniki.zwieksz('gemini_stream_broken')
+                break
+            time.sleep(self.konfiguracja.chunk_delay_ms / 1000)
+        else:
+            self.wfile.write(b'0\r\n\r\n')
+        self.close_connection = True
+
+    def _hf(self, tresc):
+        profil = self.konfiguracja.hf
+        if self.los.random() < self.konfiguracja.hf_loading_rate:
+            self.liczniki.zwieksz('hf_503')
+            return self._wyslij(503, {'error': 'Model openai-community/gpt2 is currently loading',
+                                      'estimated_time': 20.0})
+        blad = profil.blad(self.los)
+        time.sleep(profil.opoznienie(self.los))
+        if blad:
+            self.liczniki.zwieksz(f'hf_{blad[0]}')
+            return self._wyslij(*blad)
+        self.liczniki.zwieksz('hf')
+        wejscia = tresc.get('inputs', '')
+        if isinstance(wejscia, list):
+            return self._wyslij(200, [[{'generated_text': f"{p} {ODPOWIEDZ}"}] for p in wejscia])
+        return self._wyslij(200, [{'generated_text': f"{wejscia} {ODPOWIEDZ}"}])
+
+
+class MockUpstream:
+    """Serwer mocka w wątku w tle: `with MockUpstream(konfiguracja) as mock: mock.url`"""
+
+    def __init__(self, konfiguracja, host='127.0.0.1', port=0):
+        handler = type('Handler', (MockHandler,), {
+            'konfiguracja': konfiguracja,
+            'liczniki': Liczniki(),
+            'los': random.Random(konfiguracja.seed),
+        })
+        self.konfiguracja = konfiguracja
+        self.liczniki = handler.liczniki
+        self.serwer = ThreadingHTTPServer((host, port), handler)
+        self.serwer.daemon_threads = True
+        self.url = f"http://{host}:{self.serwer.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serwer.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.serwer.shutdown()
+        self.serwer.server_close()
+
+
+def dodaj_argumenty(parser):
+    """Argumenty rozkładów mocka (wspólne z benchmark.run)"""
+    parser.add_argument('--gemini-latency-ms', type=float, default=300)
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+    parser.add_argument('--gemini-429-rate', type=float, default=0.0)
+    parser.add_argument('--hf-latency-ms', type=float, default=800)
+    parser.add_argument('--hf-error-rate', type=float, default=0.0)
+    parser.add_argument('--hf-429-rate', type=float, default=0.0)
+    parser.add_argument('--hf-loading-rate', type=float, default=0.0)
+    parser.add_argument('--sigma', type=float, default=0.4, help='rozrzut log-normalny opóźnień')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--stream-chunks', type=int, default=4)
+    parser.add_argument('--chunk-delay-ms', type=float, default=40)
+    parser.add_argument('--stream-break-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def konfiguracja_z_argumentow(args):
+    return Konfiguracja(
+        gemini=Profil(args.gemini_latency_ms, args.sigma, args.gemini_error_rate, args.gemini_429_rate, args.retry_after),
+        hf=Profil(args.hf_latency_ms, args.sigma, args.hf_error_rate, args.hf_429_rate, args.retry_after),
+        hf_loading_rate=args.hf_loading_rate,
+        stream_chunks=args.stream_chunks,
+        chunk_delay_ms=args.chunk_delay_ms,
+        stream_break_rate=args.stream_break_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    dodaj_argumenty(parser)
+    args = parser.parse_args()
+
+    with MockUpstream(konfiguracja_z_argumentow(args), args.host, args.port) as mock:
+        print(f"🧪 Mock Gemini/HF: {mock.url}")
+        print(f"   GEMINI_API_BASE={mock.url}/v1beta")
+        print(f"   HF_API_URL={mock.url}/models/openai-community/gpt2")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            print(f"📊 Zapytania: {mock.liczniki.wartosci}")
+
+
+if __name__ == '__main__':
+    main()
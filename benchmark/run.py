@@ -0,0 +1,124 @@
+"""Pełny benchmark offline: mock Gemini/HF + aplikacja + generator obciążenia.
+
+Startuje mock w tle, uruchamia aplikację jako osobny proces (gunicorn z
+gunicorn.conf.py, jeśli jest zainstalowany, inaczej serwer Flaska) z
+GEMINI_API_BASE i HF_API_URL wskazującymi na mocka, czeka aż odpowie i
+przepuszcza obciążenie przez kolejne poziomy współbieżności.
+
+    python -m benchmark.run --baseline benchmark/baseline.json
+    python -m benchmark.run --gemini-429-rate 0.05 --concurrency 16 --stream
+"""
+import argparse
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmark import load, mock_upstream
+
+KATALOG = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _wolny_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def uruchom_aplikacje(port, mock_url, args):
+    """Proces aplikacji skierowany na mocka"""
+    srodowisko = dict(os.environ)
+    srodowisko.update({
+        'GEMINI_API_KEY': 'benchmark',
+        'HF_TOKEN': 'hf_benchmark',
+        'GEMINI_API_BASE': f"{mock_url}/v1beta",
+        'HF_API_URL': f"{mock_url}/models/openai-community/gpt2",
+        'STORE_SQLITE_PATH': os.path.join(tempfile.mkdtemp(prefix='chat_domi_bench_'), 'store.sqlite3'),
+        'LOG_LEVEL': srodowisko.get('LOG_LEVEL', 'WARNING'),
+        'PORT': str(port),
+    })
+    if args.no_cache:
+        srodowisko['CACHE_ENABLED'] = 'false'
+    if not args.rate_limit:
+        # Cały ruch benchmarku idzie z 127.0.0.1 - limit na klienta odrzuciłby prawie wszystko
+        srodowisko['RATE_LIMIT_ENABLED'] = 'false'
+
+    if args.server == 'gunicorn' or (args.server == 'auto' and importlib.util.find_spec('gunicorn')):
+        polecenie = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f"127.0.0.1:{port}", 'app:app']
+        if args.workers:
+            polecenie += ['-w', str(args.workers)]
+        serwer = 'gunicorn'
+    else:
+        polecenie = [sys.executable, '-c',
+                     f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+        serwer = 'flask'
+    proces = subprocess.Popen(polecenie, cwd=KATALOG, env=srodowisko,
+                              stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    return proces, serwer
+
+
+def czekaj_na_aplikacje(url, proces, limit=30):
+    koniec = time.monotonic() + limit
+    while time.monotonic() < koniec:
+        if proces.poll() is not None:
+            raise RuntimeError(f"Aplikacja zakończyła się z kodem {proces.returncode}")
+        try:
+            if requests.get(f"{url}/status", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Aplikacja nie odpowiada")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mock_upstream.dodaj_argumenty(parser)
+    load.dodaj_argumenty(parser)
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'flask'), default='auto')
+    parser.add_argument('--workers', type=int, default=None, help='liczba workerów gunicorna')
+    parser.add_argument('--no-cache', action='store_true', help='wyłącz cache odpowiedzi (CACHE_ENABLED=false)')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='zostaw limity zapytań włączone (domyślnie RATE_LIMIT_ENABLED=false)')
+    parser.add_argument('--verbose', action='store_true', help='pokaż logi aplikacji')
+    args = parser.parse_args()
+
+    konfiguracja = mock_upstream.konfiguracja_z_argumentow(args)
+    with mock_upstream.MockUpstream(konfiguracja) as mock:
+        port = _wolny_port()
+        proces, serwer = uruchom_aplikacje(port, mock.url, args)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            czekaj_na_aplikacje(url, proces)
+            print(f"🚀 {serwer} na {url}, mock na {mock.url}", file=sys.stderr)
+            opis = {
+                'server': serwer,
+                'stream': args.stream,
+                'requests': args.requests,
+                'warmup': args.warmup,
+                'gemini_latency_ms': args.gemini_latency_ms,
+                'hf_latency_ms': args.hf_latency_ms,
+                'gemini_error_rate': args.gemini_error_rate,
+                'gemini_429_rate': args.gemini_429_rate,
+                'sigma': args.sigma,
+            }
+            if args.rate_limit:
+                opis['rate_limit'] = True
+            kod = load.wykonaj(url, args, opis)
+            print(f"\n🧪 Zapytania do mocka: {mock.liczniki.wartosci}")
+        finally:
+            proces.terminate()
+            try:
+                proces.wait(10)
+            except subprocess.TimeoutExpired:
+                proces.kill()
+    sys.exit(kod)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Cache odpowiedzi dla powtarzających się (i prawie identycznych) wiadomości.
+
+Klucz to znormalizowany tekst wiadomości + konfiguracja dostawców i generowania.
+Odpowiedzi trzymane są we wspólnym magazynie (store.py), więc wszystkie workery
+gunicorna korzystają z tych samych wpisów. Wpisy wygasają po CACHE_TTL sekundach;
+limity wpisów i pamięci egzekwuje magazyn. Przy CACHE_VARIANTS > 1 pod jednym
+kluczem zbieranych jest kilka odpowiedzi i przy trafieniu losowana jest jedna,
+żeby bot nie powtarzał się słowo w słowo.
+"""
+import hashlib
+import random
+import re
+import threading
+import unicodedata
+
+import codec
+import store
+import logs
+from settings import env_bool, env_int, env_float
+
+log = logs.get('cache')
+
+CACHE_ENABLED = env_bool('CACHE_ENABLED', True)
+CACHE_TTL = env_float('CACHE_TTL', 3600)
+CACHE_VARIANTS = max(env_int('CACHE_VARIANTS', 1), 1)
+
+PREFIKS = 'resp:'
+
+_BIALE_ZNAKI = re.compile(r'\s+')
+
+
+def normalizuj(tekst):
+    """Sprowadza wiadomość do postaci porównywalnej: wielkość liter, interpunkcja, spacje"""
+    tekst = unicodedata.normalize('NFKC', tekst).casefold()
+    bez_interpunkcji = ''.join(
+        ' ' if unicodedata.category(znak).startswith('P') else znak for znak in tekst
+    )
+    return _BIALE_ZNAKI.sub(' ', bez_interpunkcji).strip() or tekst.strip()
+
+
+def klucz(tekst, konfiguracja=''):
+    """Klucz cache: skrót znormalizowanej wiadomości i konfiguracji generowania"""
+    dane = f"{konfiguracja}\x00{normalizuj(tekst)}".encode('utf-8')
+    return hashlib.sha256(dane).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, magazyn=None, ttl=CACHE_TTL, warianty=CACHE_VARIANTS):
+        self._magazyn = magazyn
+        self.ttl = ttl
+        self.warianty = warianty
+
+        self._lock = threading.Lock()
+        self.trafienia = 0
+        self.chybienia = 0
+        self.bledy = 0
+
+    @property
+    def magazyn(self):
+        return self._magazyn or store.get_store()
+
+    def _warianty(self, klucz):
+        try:
+            wartosc = self.magazyn.get(PREFIKS + klucz)
+        except Exception as e:
+            # Awaria magazynu nie może zatrzymać czatu - traktujemy jak brak wpisu
+            log.warning("Błąd odczytu cache", extra={"error": str(e)})
+            with self._lock:
+                self.bledy += 1
+            return []
+        return codec.loads(wartosc) if wartosc else []
+
+    def get(self, klucz):
+        """Zwraca zapisaną odpowiedź lub None (także gdy brakuje jeszcze wariantów)"""
+        odpowiedzi = self._warianty(klucz)
+        with self._lock:
+            if len(odpowiedzi) < self.warianty:
+                self.chybienia += 1
+                return None
+            self.trafienia += 1
+        return random.choice(odpowiedzi)
+
+    def set(self, klucz, odpowiedz):
+        """Dodaje odpowiedź (kolejny wariant) pod kluczem"""
+        odpowiedzi = self._warianty(klucz) if self.warianty > 1 else []
+        if odpowiedz not in odpowiedzi:
+            odpowiedzi = (odpowiedzi + [odpowiedz])[-self.warianty:]
+        try:
+            self.magazyn.set(PREFIKS + klucz, codec.dumps(odpowiedzi), self.ttl)
+        except Exception as e:
+            log.warning("Błąd zapisu cache", extra={"error": str(e)})
+            with self._lock:
+                self.bledy += 1
+
+    def statystyki(self):
+        """Liczniki trafień/chybień (bieżącego workera) i stan magazynu do endpointu statusu"""
+        with self._lock:
+            zapytania = self.trafienia + self.chybienia
+            wynik = {
+                'enabled': CACHE_ENABLED,
+                'hits': self.trafienia,
+                'misses': self.chybienia,
+                'hit_rate': round(self.trafienia / zapytania, 3) if zapytania else 0.0,
+                'errors': self.bledy,
+                'variants': self.warianty,
+            }
+        try:
+            wynik['store'] = self.magazyn.statystyki()
+        except Exception as e:
+            wynik['store'] = {'error': str(e)}
+        return wynik
+
+
+odpowiedzi = ResponseCache()
@@ -0,0 +1,182 @@
+"""Circuit breaker dla każdego dostawcy (Gemini, Hugging Face).
+
+Breaker liczy błędy i czasy odpowiedzi w przesuwanym oknie. Gdy odsetek błędów
+(lub zbyt wolnych wywołań) przekroczy próg, obwód się otwiera i dostawca jest
+od razu pomijany. Po CB_OPEN_SECONDS przepuszczane jest jedno wywołanie próbne
+(half-open): sukces zamyka obwód, błąd otwiera go ponownie.
+"""
+import threading
+import time
+from collections import deque
+
+import deadline
+import logs
+from settings import env_int, env_float
+
+log = logs.get('circuit_breaker')
+
+CB_WINDOW_SECONDS = env_float('CB_WINDOW_SECONDS', 60)
+CB_MIN_CALLS = env_int('CB_MIN_CALLS', 5)
+CB_ERROR_RATE = env_float('CB_ERROR_RATE', 0.5)
+CB_SLOW_CALL_SECONDS = env_float('CB_SLOW_CALL_SECONDS', 10)
+CB_OPEN_SECONDS = env_float('CB_OPEN_SECONDS', 30)
+
+ZAMKNIETY = 'closed'
+OTWARTY = 'open'
+POLOTWARTY = 'half_open'
+
+
+class ObwodOtwartyError(Exception):
+    """Dostawca pominięty, bo jego obwód jest otwarty"""
+
+
+class CircuitBreaker:
+    def __init__(self, nazwa, okno=CB_WINDOW_SECONDS, min_wywolan=CB_MIN_CALLS,
+                 prog_bledow=CB_ERROR_RATE, wolne_wywolanie=CB_SLOW_CALL_SECONDS,
+                 czas_otwarcia=CB_OPEN_SECONDS):
+        self.nazwa = nazwa
+        self.okno = okno
+        self.min_wywolan = min_wywolan
+        self.prog_bledow = prog_bledow
+        self.wolne_wywolanie = wolne_wywolanie
+        self.czas_otwarcia = czas_otwarcia
+
+        self._lock = threading.Lock()
+        self._wywolania = deque()  # (czas, sukces, opóźnienie)
+        self._stan = ZAMKNIETY
+        self._otwarty_od = 0.0
+        self._proba_w_toku = False
+        self._proba_od = 0.0
+        self._ostatni_sukces = None
+        self._ostatni_blad = None
+
+    def _przytnij(self, teraz):
+        while self._wywolania and self._wywolania[0][0] < teraz - self.okno:
+            self._wywolania.popleft()
+
+    def pozwol(self):
+        """Czy wywołać dostawcę? W stanie half-open przepuszcza tylko jedną próbę"""
+        with self._lock:
+            if self._stan == ZAMKNIETY:
+                return True
+            teraz = time.monotonic()
+            if self._stan == OTWARTY and teraz - self._otwarty_od >= self.czas_otwarcia:
+                self._stan = POLOTWARTY
+                self._proba_w_toku = False
+            # Próba, która nie wróciła (np. przerwany strumień), wygasa po czas_otwarcia
+            if self._stan == POLOTWARTY and (not self._proba_w_toku
+                                             or teraz - self._proba_od >= self.czas_otwarcia):
+                self._proba_w_toku = True
+                self._proba_od = teraz
+                return True
+            return False
+
+    def zapisz(self, sukces, opoznienie):
+        """Zapisuje wynik wywołania; wolne wywołanie liczy się jak błąd"""
+        teraz = time.monotonic()
+        udane = sukces and opoznienie < self.wolne_wywolanie
+        with self._lock:
+            if sukces:
+                self._ostatni_sukces = time.time()
+            else:
+                self._ostatni_blad = time.time()
+
+            if self._stan == POLOTWARTY:
+                self._proba_w_toku = False
+                if udane:
+                    log.info("Obwód zamknięty po udanej próbie", extra={"provider": self.nazwa})
+                    self._stan = ZAMKNIETY
+                    self._wywolania.clear()
+                else:
+                    self._otworz(teraz)
+                return
+
+            self._wywolania.append((teraz, udane, opoznienie))
+            self._przytnij(teraz)
+            if self._stan == ZAMKNIETY and len(self._wywolania) >= self.min_wywolan:
+                bledy = sum(1 for _, ok, _ in self._wywolania if not ok)
+                if bledy / len(self._wywolania) >= self.prog_bledow:
+                    self._otworz(teraz)
+
+    def pomin(self):
+        """Wywołanie anulowane (inny dostawca odpowiedział) - bez wyniku, zwalnia próbę half-open"""
+        with self._lock:
+            if self._stan == POLOTWARTY:
+                self._proba_w_toku = False
+
+    def _otworz(self, teraz):
+        log.warning("Obwód otwarty", extra={"provider": self.nazwa, "open_seconds": self.czas_otwarcia})
+        self._stan = OTWARTY
+        self._otwarty_od = teraz
+
+    def stan_skrocony(self):
+        """Tylko stan obwodu i czas ostatniego sukcesu - bez przeliczania okna (health check)"""
+        with self._lock:
+            return {'state': self._stan, 'last_success': self._ostatni_sukces}
+
+    def stan(self):
+        """Stan breakera do endpointu statusu"""
+        with self._lock:
+            teraz = time.monotonic()
+            self._przytnij(teraz)
+            liczba = len(self._wywolania)
+            bledy = sum(1 for _, ok, _ in self._wywolania if not ok)
+            opoznienia = [o for _, _, o in self._wywolania]
+            return {
+                'state': self._stan,
+                'calls': liczba,
+                'error_rate': round(bledy / liczba, 3) if liczba else 0.0,
+                'avg_latency': round(sum(opoznienia) / liczba, 3) if liczba else None,
+                'open_for': round(max(self.czas_otwarcia - (teraz - self._otwarty_od), 0), 1)
+                            if self._stan == OTWARTY else 0,
+                'last_success': self._ostatni_sukces,
+                'last_failure': self._ostatni_blad,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get(nazwa):
+    """Breaker dostawcy (jeden na proces)"""
+    with _breakers_lock:
+        if nazwa not in _breakers:
+            _breakers[nazwa] = CircuitBreaker(nazwa)
+        return _breakers[nazwa]
+
+
+def wszystkie():
+    """Stan wszystkich breakerów: {nazwa: stan}"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.nazwa: b.stan() for b in breakers}
+
+
+def wszystkie_skrocone():
+    """Skrócony stan wszystkich breakerów: {nazwa: {'state', 'last_success'}}"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.nazwa: b.stan_skrocony() for b in breakers}
+
+
+def chron(nazwa, funkcja):
+    """Opakowuje funkcję dostawcy breakerem - przy otwartym obwodzie od razu rzuca ObwodOtwartyError"""
+    breaker = get(nazwa)
+
+    def wywolaj(*args, **kwargs):
+        if not breaker.pozwol():
+            raise ObwodOtwartyError(f"Obwód {nazwa} otwarty - pomijam")
+        start = time.monotonic()
+        try:
+            wynik = funkcja(*args, **kwargs)
+        except Exception:
+            if deadline.anulowane():
+                breaker.pomin()
+            else:
+                breaker.zapisz(False, time.monotonic() - start)
+            raise
+        breaker.zapisz(True, time.monotonic() - start)
+        return wynik
+
+    return wywolaj
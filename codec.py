@@ -0,0 +1,107 @@
+"""Kodowanie JSON - szybki koder (orjson), jeśli jest zainstalowany, inaczej stdlib.
+
+JSON_CODEC:
+- auto (domyślnie) - orjson, gdy jest dostępny (`pip install orjson`), inaczej json
+- orjson - wymaga pakietu
+- stdlib - zawsze moduł json
+
+Oba kodery dają UTF-8 bez sekwencji \\uXXXX (jak ensure_ascii=False). Wartości,
+których orjson nie obsługuje (np. klucze słownika inne niż napisy), kodowane
+są przez stdlib, więc wynik nie zależy od zainstalowanych pakietów.
+
+Odpowiedzi dostawców są dekodowane wprost z bajtów (`response.content`) -
+`response.text` zgaduje kodowanie i dekoduje całe ciało przy każdym użyciu.
+`napis()` wyciąga jedną wartość tekstową bez budowania całego drzewa obiektów.
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+from settings import env_str
+
+JSON_CODEC = env_str('JSON_CODEC', 'auto').lower()
+
+
+def _szybki_koder():
+    if JSON_CODEC == 'stdlib':
+        return None
+    try:
+        import orjson
+        return orjson
+    except ImportError:
+        if JSON_CODEC == 'orjson':
+            raise RuntimeError("JSON_CODEC=orjson wymaga pakietu 'orjson' (pip install orjson)")
+        return None
+
+
+_orjson = _szybki_koder()
+NAZWA = 'orjson' if _orjson else 'stdlib'
+
+
+def dumpb(obj, default=None):
+    """Obiekt jako JSON w bajtach UTF-8"""
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(obj, default=default)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=default).encode('utf-8')
+
+
+def dumps(obj, default=None):
+    """Obiekt jako napis JSON"""
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(obj, default=default).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=default)
+
+
+def loads(dane):
+    """JSON z bajtów albo napisu; rzuca ValueError przy błędnych danych"""
+    if _orjson is not None:
+        return _orjson.loads(dane)
+    return json.loads(dane)
+
+
+def napis(dane, wzorzec):
+    """Napis JSON zaczynający się tuż za dopasowaniem `wzorzec` (bajtowe re) - None, gdy go nie ma.
+
+    Dekodowany jest tylko ten jeden napis, a nie cały dokument.
+    """
+    dopasowanie = wzorzec.search(dane)
+    if dopasowanie is None:
+        return None
+    poczatek = dopasowanie.end()
+    if dane[poczatek:poczatek + 1] != b'"':
+        return None
+    # Koniec napisu - pierwszy cudzysłów, przed którym jest parzysta liczba ukośników
+    koniec = dane.find(b'"', poczatek + 1)
+    while koniec != -1:
+        ukosniki = 0
+        while dane[koniec - 1 - ukosniki] == 0x5C:
+            ukosniki += 1
+        if ukosniki % 2 == 0:
+            return loads(dane[poczatek:koniec + 1])
+        koniec = dane.find(b'"', koniec + 1)
+    return None
+
+
+def fragment(response, limit=200):
+    """Początek ciała odpowiedzi do logów - bez dekodowania całości"""
+    return response.content[:limit].decode('utf-8', 'replace')
+
+
+class Dostawca(DefaultJSONProvider):
+    """Koder JSON Flaska (jsonify, request.get_json) oparty na codec"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, default=kwargs.get('default', self.default))
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        dane = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumpb(dane, default=self.default), mimetype=self.mimetype)
@@ -0,0 +1,124 @@
+"""Termin zapytania - ile czasu zostało do limitu widocznego dla użytkownika.
+
+Endpoint czatu ustawia termin (REQUEST_DEADLINE sekund od startu), a niżej
+http_client skraca limity odczytu, dispatch - czas hedgingu, a retry - liczbę
+i długość ponowień, tak żeby żadne z nich nie przeciągnęło odpowiedzi poza
+termin. Termin jest w contextvars, więc trafia też do wątków dispatch.
+
+Tak samo przekazywane jest anulowanie: dispatch (hedge/race) daje każdemu
+wywołaniu dostawcy własne Anulowanie i anuluje przegranych, gdy jeden
+odpowie. Anulowane wywołanie zamyka swoją odpowiedź HTTP (http_client), nie
+ponawia (retry), nie czeka w mikropaczce (microbatch) i nie jest liczone
+jako błąd dostawcy (circuit_breaker, routing, metrics).
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+from settings import env_float
+
+REQUEST_DEADLINE = env_float('REQUEST_DEADLINE', 25.0)
+
+_termin = contextvars.ContextVar('deadline', default=None)
+_anulowanie = contextvars.ContextVar('cancellation', default=None)
+
+
+class AnulowanoError(Exception):
+    """Wywołanie przerwane, bo inny dostawca odpowiedział pierwszy"""
+
+
+class Anulowanie:
+    """Sygnał przerwania jednego wywołania dostawcy, wspólny dla wątku dispatch i wywołującego"""
+
+    def __init__(self):
+        self._zdarzenie = threading.Event()
+        self._lock = threading.Lock()
+        self._sprzatanie = []
+
+    @property
+    def anulowane(self):
+        return self._zdarzenie.is_set()
+
+    def anuluj(self):
+        """Ustawia sygnał i wywołuje zarejestrowane funkcje sprzątające (np. zamknięcie odpowiedzi)"""
+        with self._lock:
+            if self._zdarzenie.is_set():
+                return
+            self._zdarzenie.set()
+            funkcje, self._sprzatanie = self._sprzatanie, []
+        for funkcja in funkcje:
+            try:
+                funkcja()
+            except Exception:
+                pass
+
+    def przy_anulowaniu(self, funkcja):
+        """Rejestruje funkcję sprzątającą; po anulowaniu wywołuje ją od razu"""
+        with self._lock:
+            if not self._zdarzenie.is_set():
+                self._sprzatanie.append(funkcja)
+                return
+        funkcja()
+
+    def czekaj(self, sekundy):
+        """Czeka `sekundy` albo do anulowania - True, jeśli anulowano"""
+        return self._zdarzenie.wait(sekundy)
+
+
+@contextlib.contextmanager
+def termin(sekundy=REQUEST_DEADLINE):
+    """Ustawia termin bieżącego zapytania (krótszy termin zewnętrzny zostaje)"""
+    koniec = time.monotonic() + sekundy
+    obecny = _termin.get()
+    token = _termin.set(min(koniec, obecny) if obecny else koniec)
+    try:
+        yield
+    finally:
+        _termin.reset(token)
+
+
+def pozostalo():
+    """Sekundy do terminu albo None, gdy termin nie jest ustawiony"""
+    koniec = _termin.get()
+    if koniec is None:
+        return None
+    return max(koniec - time.monotonic(), 0.0)
+
+
+def przytnij(sekundy):
+    """Czas oczekiwania skrócony do terminu"""
+    zostalo = pozostalo()
+    return sekundy if zostalo is None else min(sekundy, zostalo)
+
+
+@contextlib.contextmanager
+def anulowanie(sygnal):
+    """Wywołania dostawcy w tym bloku można przerwać przez `sygnal.anuluj()`"""
+    token = _anulowanie.set(sygnal)
+    try:
+        yield sygnal
+    finally:
+        _anulowanie.reset(token)
+
+
+def anulowane():
+    """Czy bieżące wywołanie dostawcy zostało anulowane"""
+    sygnal = _anulowanie.get()
+    return sygnal is not None and sygnal.anulowane
+
+
+def przy_anulowaniu(funkcja):
+    """Rejestruje sprzątanie na wypadek anulowania bieżącego wywołania (bez anulowania - nic)"""
+    sygnal = _anulowanie.get()
+    if sygnal is not None:
+        sygnal.przy_anulowaniu(funkcja)
+
+
+def spij(sekundy):
+    """time.sleep przerywany anulowaniem - True, jeśli anulowano"""
+    sygnal = _anulowanie.get()
+    if sygnal is None:
+        time.sleep(sekundy)
+        return False
+    return sygnal.czekaj(sekundy)
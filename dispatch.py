@@ -0,0 +1,138 @@
+"""Wybór dostawcy odpowiedzi: kolejno, z hedgingiem albo wyścigiem.
+
+Tryby (zmienna DISPATCH_MODE):
+- sequential - następny dostawca dopiero po błędzie poprzedniego (dotychczasowe zachowanie)
+- hedge - następny dostawca startuje, gdy poprzedni nie odpowie w HEDGE_DELAY sekund
+- race - wszyscy dostawcy startują naraz, wygrywa pierwsza poprawna odpowiedź
+
+W trybach hedge/race całość jest ograniczona przez DISPATCH_DEADLINE, więc
+wolny błąd jednego dostawcy nie sumuje się z limitem czasu drugiego. Termin
+zapytania (deadline.py) skraca ten limit, a w trybie sequential pomija
+dostawców, na których nie zostało już czasu. Gdy jeden dostawca odpowie (albo
+minie limit), pozostałe wywołania są anulowane (deadline.Anulowanie): zamykają
+odpowiedź HTTP i nie ponawiają, więc nie zużywają limitów ani połączeń.
+"""
+import queue
+import threading
+import time
+
+import deadline
+import logs
+import tracing
+from settings import env_str, env_float
+
+log = logs.get('dispatch')
+
+DISPATCH_MODE = env_str('DISPATCH_MODE', 'sequential').lower()
+HEDGE_DELAY = env_float('HEDGE_DELAY', 2.0)
+DISPATCH_DEADLINE = env_float('DISPATCH_DEADLINE', 15.0)
+
+TRYBY = ('sequential', 'hedge', 'race')
+
+
+class BrakOdpowiedziError(Exception):
+    """Żaden dostawca nie zwrócił poprawnej odpowiedzi"""
+
+    def __init__(self, komunikat, przekroczono_limit=False):
+        super().__init__(komunikat)
+        self.przekroczono_limit = przekroczono_limit
+
+
+def uruchom(dostawcy, pytanie, tryb=None, opoznienie=None, limit=None):
+    """Zwraca (nazwa, odpowiedź) od pierwszego dostawcy, który odpowiedział poprawnie.
+
+    `dostawcy` to lista par (nazwa, funkcja(pytanie)) w kolejności priorytetu;
+    funkcja rzuca wyjątek, gdy nie ma poprawnej odpowiedzi.
+    """
+    tryb = (tryb or DISPATCH_MODE)
+    if tryb not in TRYBY:
+        log.warning("Nieznany DISPATCH_MODE, używam sequential", extra={"mode": tryb})
+        tryb = 'sequential'
+
+    if not dostawcy:
+        raise BrakOdpowiedziError("Brak skonfigurowanych dostawców")
+
+    if tryb == 'sequential' or len(dostawcy) == 1:
+        return _kolejno(dostawcy, pytanie)
+
+    if tryb == 'race':
+        opoznienie = 0
+    elif opoznienie is None:
+        opoznienie = HEDGE_DELAY
+    return _rownolegle(dostawcy, pytanie, opoznienie, deadline.przytnij(limit or DISPATCH_DEADLINE))
+
+
+def _kolejno(dostawcy, pytanie):
+    bledy = []
+    for nazwa, funkcja in dostawcy:
+        if deadline.pozostalo() == 0:
+            bledy.append("przekroczony termin zapytania")
+            raise BrakOdpowiedziError("; ".join(bledy), przekroczono_limit=True)
+        try:
+            return nazwa, funkcja(pytanie)
+        except Exception as e:
+            log.warning("Błąd dostawcy, przechodzę dalej", extra={"provider": nazwa, "error": str(e)[:300]})
+            bledy.append(f"{nazwa}: {e}")
+    raise BrakOdpowiedziError("; ".join(bledy))
+
+
+def _rownolegle(dostawcy, pytanie, opoznienie, limit):
+    """Hedging: kolejny dostawca startuje po `opoznienie` s albo od razu po błędzie"""
+    wyniki = queue.Queue()
+    koniec = time.monotonic() + limit
+    anulowania = {}
+
+    def wywolaj(nazwa, funkcja, sygnal):
+        try:
+            with deadline.anulowanie(sygnal):
+                wyniki.put((nazwa, True, funkcja(pytanie)))
+        except Exception as e:
+            wyniki.put((nazwa, False, e))
+
+    def anuluj_pozostale():
+        for nazwa, sygnal in anulowania.items():
+            if not sygnal.anulowane:
+                log.debug("Anuluję wywołanie dostawcy", extra={"provider": nazwa})
+                sygnal.anuluj()
+
+    oczekujace = list(dostawcy)
+    w_toku = 0
+    bledy = []
+
+    while oczekujace or w_toku:
+        if oczekujace:
+            nazwa, funkcja = oczekujace.pop(0)
+            anulowania[nazwa] = deadline.Anulowanie()
+            # Wątek dostaje kopię kontekstu, żeby spany dostawcy trafiły do śladu zapytania
+            threading.Thread(target=tracing.w_kontekscie(wywolaj), args=(nazwa, funkcja, anulowania[nazwa]),
+                             daemon=True).start()
+            w_toku += 1
+            czekaj = min(opoznienie, koniec - time.monotonic()) if oczekujace else koniec - time.monotonic()
+        else:
+            czekaj = koniec - time.monotonic()
+
+        if czekaj <= 0 and not oczekujace:
+            break
+
+        try:
+            nazwa, sukces, wynik = wyniki.get(timeout=max(czekaj, 0))
+        except queue.Empty:
+            if oczekujace:
+                if opoznienie:
+                    log.info("Brak odpowiedzi, uruchamiam kolejnego dostawcę", extra={"hedge_delay": opoznienie})
+                continue
+            break
+
+        w_toku -= 1
+        anulowania.pop(nazwa)
+        if sukces:
+            anuluj_pozostale()
+            return nazwa, wynik
+        log.warning("Błąd dostawcy", extra={"provider": nazwa, "error": str(wynik)[:300]})
+        bledy.append(f"{nazwa}: {wynik}")
+
+    if w_toku:
+        # Po limicie wynik i tak nie zostanie użyty
+        anuluj_pozostale()
+        bledy.append(f"przekroczono limit {limit}s")
+    raise BrakOdpowiedziError("; ".join(bledy), przekroczono_limit=bool(w_toku))
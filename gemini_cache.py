@@ -0,0 +1,194 @@
+"""Cache kontekstu Gemini (cachedContents) dla stałej persony.
+
+Persona jest wysyłana jako systemInstruction. Przy GEMINI_CONTEXT_CACHE=true
+persona jest dodatkowo zapisywana raz po stronie Google (cachedContents), a
+zapytania odwołują się do niej nazwą, więc jej tokeny nie są przetwarzane
+od nowa. Cache jest tworzony i odświeżany w tle przed upływem TTL, a jego
+nazwa trafia do wspólnego magazynu, żeby wszystkie workery używały tego samego.
+Tworzy go (i przedłuża) tylko worker, który zajmie blokadę w magazynie
+(store.add); pozostałe czekają na nazwę zapisaną przez niego, zamiast płacić
+za własny cache.
+Gdy cache nie jest dostępny (np. persona jest poniżej minimalnej liczby tokenów
+modelu, brak uprawnień), zapytania idą zwyczajnie z systemInstruction.
+"""
+import os
+import threading
+import time
+
+import codec
+import http_client
+import store
+import logs
+from settings import env_bool, env_int
+
+log = logs.get('gemini_cache')
+
+GEMINI_CONTEXT_CACHE = env_bool('GEMINI_CONTEXT_CACHE', False)
+GEMINI_CACHE_TTL = env_int('GEMINI_CACHE_TTL', 3600)
+GEMINI_CACHE_REFRESH_MARGIN = env_int('GEMINI_CACHE_REFRESH_MARGIN', 300)
+GEMINI_CACHE_RETRY_SECONDS = env_int('GEMINI_CACHE_RETRY_SECONDS', 600)
+
+PREFIKS = 'gemini:cached_content:'
+BLOKADA = 'gemini:cached_content_lock:'
+# Dłużej niż tworzenie cache (limit odczytu Gemini) - potem blokada porzuconego procesu wygasa
+CZAS_BLOKADY = 60
+CZEKANIE_CO = 0.5
+
+
+class CacheKontekstu:
+    def __init__(self, api_base, model, api_key, wlaczony=GEMINI_CONTEXT_CACHE):
+        self.api_base = api_base
+        self.model = model
+        self.wlaczony = wlaczony and bool(api_key)
+        self._headers = {'Content-Type': 'application/json', 'X-goog-api-key': api_key}
+
+        self._lock = threading.Lock()
+        self._wpis = None  # {'name', 'expires', 'version'}
+        self._w_toku = False
+        self._niedostepny_do = 0.0
+        self.ostatni_blad = None
+
+    def nazwa(self, system, wersja):
+        """Nazwa aktywnego cache dla persony w danej wersji albo None (użyj systemInstruction).
+
+        Nigdy nie czeka na sieć - tworzenie i odświeżanie odbywa się w tle.
+        """
+        if not self.wlaczony:
+            return None
+
+        teraz = time.time()
+        wpis = self._wpis
+        if wpis is None or wpis['version'] != wersja or wpis['expires'] <= teraz:
+            wpis = self._z_magazynu(wersja)
+
+        if wpis is None or wpis['expires'] - teraz < GEMINI_CACHE_REFRESH_MARGIN:
+            self._odswiez_w_tle(system, wersja, wpis)
+        if wpis is not None and wpis['expires'] > teraz:
+            return wpis['name']
+        return None
+
+    def uniewaznij(self, nazwa):
+        """Zapomina cache, którego Gemini już nie zna (np. wygasł wcześniej)"""
+        with self._lock:
+            if self._wpis and self._wpis['name'] == nazwa:
+                try:
+                    store.get_store().delete(PREFIKS + self._wpis['version'])
+                except Exception as e:
+                    log.warning("Błąd magazynu cache Gemini", extra={"error": str(e)})
+                self._wpis = None
+
+    def _z_magazynu(self, wersja):
+        try:
+            wartosc = store.get_store().get(PREFIKS + wersja)
+        except Exception as e:
+            log.warning("Błąd magazynu cache Gemini", extra={"error": str(e)})
+            return None
+        if not wartosc:
+            return None
+        wpis = codec.loads(wartosc)
+        self._wpis = wpis
+        return wpis
+
+    def _odswiez_w_tle(self, system, wersja, wpis):
+        with self._lock:
+            if self._w_toku or time.time() < self._niedostepny_do:
+                return
+            self._w_toku = True
+        threading.Thread(target=self._odswiez, args=(system, wersja, wpis), daemon=True).start()
+
+    def _odswiez(self, system, wersja, wpis):
+        blokada = BLOKADA + wersja
+        try:
+            if not store.get_store().add(blokada, str(os.getpid()), CZAS_BLOKADY):
+                self._czekaj_na_inny_worker(wersja, blokada)
+                return
+        except Exception as e:
+            log.warning("Błąd magazynu cache Gemini", extra={"error": str(e)})
+            self._w_toku = False
+            return
+        try:
+            # Inny worker mógł zapisać nowy cache tuż przed zajęciem blokady
+            zapisany = self._z_magazynu(wersja)
+            if zapisany is not None and zapisany['expires'] - time.time() >= GEMINI_CACHE_REFRESH_MARGIN:
+                return
+            self._utworz_lub_przedluz(system, wersja, wpis)
+        finally:
+            try:
+                store.get_store().delete(blokada)
+            except Exception as e:
+                log.warning("Błąd magazynu cache Gemini", extra={"error": str(e)})
+            self._w_toku = False
+
+    def _czekaj_na_inny_worker(self, wersja, blokada):
+        """Cache tworzy inny worker - czeka na jego nazwę w magazynie zamiast tworzyć własny"""
+        try:
+            koniec = time.time() + CZAS_BLOKADY
+            while time.time() < koniec:
+                time.sleep(CZEKANIE_CO)
+                wpis = self._z_magazynu(wersja)
+                if wpis is not None and wpis['expires'] - time.time() >= GEMINI_CACHE_REFRESH_MARGIN:
+                    log.info("Cache kontekstu Gemini z innego workera", extra={"cache_name": wpis['name']})
+                    return
+                if store.get_store().get(blokada) is None:
+                    break
+            # Tamten worker nie utworzył cache - kolejna próba jak po błędzie
+            self._niedostepny_do = time.time() + GEMINI_CACHE_RETRY_SECONDS
+        except Exception as e:
+            log.warning("Błąd magazynu cache Gemini", extra={"error": str(e)})
+        finally:
+            self._w_toku = False
+
+    def _utworz_lub_przedluz(self, system, wersja, wpis):
+        try:
+            nowy = None
+            if wpis is not None and wpis['expires'] > time.time():
+                try:
+                    nowy = self._przedluz(wpis)
+                except Exception as e:
+                    log.warning("Nie udało się przedłużyć cache Gemini, tworzę nowy", extra={"error": str(e)})
+            if nowy is None:
+                nowy = self._utworz(system, wersja)
+            self._wpis = nowy
+            store.get_store().set(PREFIKS + wersja, codec.dumps(nowy),
+                                  max(nowy['expires'] - time.time(), 1))
+            self.ostatni_blad = None
+            log.info("Cache kontekstu Gemini aktywny", extra={"cache_name": nowy['name']})
+        except Exception as e:
+            # Cache niedostępny - zapytania idą z systemInstruction, kolejna próba później
+            self.ostatni_blad = str(e)
+            self._niedostepny_do = time.time() + GEMINI_CACHE_RETRY_SECONDS
+            log.warning("Cache kontekstu Gemini niedostępny", extra={"error": str(e)})
+
+    def _utworz(self, system, wersja):
+        payload = {
+            "model": f"models/{self.model}",
+            "systemInstruction": {"parts": [{"text": system}]},
+            "ttl": f"{GEMINI_CACHE_TTL}s"
+        }
+        response = http_client.post(f"{self.api_base}/cachedContents", headers=self._headers, data=codec.dumpb(payload),
+                                    timeout=http_client.GEMINI_TIMEOUT)
+        if response.status_code != 200:
+            raise Exception(f"{response.status_code} - {codec.fragment(response)}")
+        return {'name': codec.loads(response.content)['name'], 'version': wersja,
+                'expires': time.time() + GEMINI_CACHE_TTL}
+
+    def _przedluz(self, wpis):
+        response = http_client.get_session().patch(
+            f"{self.api_base}/{wpis['name']}",
+            headers=self._headers,
+            data=codec.dumpb({"ttl": f"{GEMINI_CACHE_TTL}s"}),
+            timeout=http_client.GEMINI_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise Exception(f"{response.status_code} - {codec.fragment(response)}")
+        return {**wpis, 'expires': time.time() + GEMINI_CACHE_TTL}
+
+    def statystyki(self):
+        """Stan cache do endpointu statusu"""
+        wpis = self._wpis
+        return {
+            'enabled': self.wlaczony,
+            'name': wpis['name'] if wpis else None,
+            'expires_in': round(wpis['expires'] - time.time()) if wpis else None,
+            'last_error': self.ostatni_blad,
+        }
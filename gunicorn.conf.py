@@ -0,0 +1,63 @@
+"""Konfiguracja gunicorna.
+
+Domyślnie workery są asynchroniczne (gevent): gevent podmienia gniazda i wątki
+na kooperacyjne, więc `requests` i wspólna pula z http_client czekają na Gemini/HF
+bez blokowania workera, a setki rozmów dzielą jeden proces.
+"""
+import os
+
+# "gevent" - tryb asynchroniczny, "sync" - klasyczny worker na jedno zapytanie
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+
+# Maksymalna liczba równoczesnych połączeń na worker (tylko workery asynchroniczne)
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 500))
+
+# Liczba procesów - Render ustawia WEB_CONCURRENCY
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+
+# Worker sync musi zmieścić się w limitach Gemini + HF; gevent nie blokuje heartbeatu
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+
+def post_worker_init(worker):
+    # Rozgrzewka (pula połączeń, TLS, ładowanie modelu HF) zanim worker przyjmie
+    # pierwsze połączenie - WARMUP_TIMEOUT musi być krótszy niż timeout
+    import app
+    app.rozgrzej()
+
+
+def worker_exit(server, worker):
+    # Zapisz zaległe logi z kolejki i ostatnią migawkę metryk przed zamknięciem workera
+    import logs
+    import metrics
+    metrics.zapisz()
+    logs.zatrzymaj()
+
+
+def on_starting(server):
+    # Migawki metryk uruchomień, których master już nie żyje, nie mogą trafić
+    # do sumy. Tylko os/shutil - hooki mastera nie importują modułów aplikacji
+    # (requests, ssl i flask przed monkey-patchingiem gevent w workerach)
+    import shutil
+    import tempfile
+    katalog = os.getenv('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'chat_domi_metrics')
+    if not os.path.isdir(katalog):
+        return
+    for nazwa in os.listdir(katalog):
+        sciezka = os.path.join(katalog, nazwa)
+        if nazwa.isdigit() and os.path.isdir(sciezka):
+            try:
+                os.kill(int(nazwa), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except OSError:
+                continue
+        if os.path.isdir(sciezka):
+            shutil.rmtree(sciezka, ignore_errors=True)
+        else:
+            try:
+                os.remove(sciezka)
+            except OSError:
+                pass
@@ -0,0 +1,103 @@
+"""Wspólny klient HTTP dla wszystkich wywołań Gemini i Hugging Face.
+
+Każdy worker gunicorna trzyma własną sesję `requests` z pulą połączeń
+keep-alive, więc kolejne wiadomości nie płacą za nowe połączenie TCP i TLS.
+"""
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import deadline
+import tracing
+from settings import env_int, env_float
+
+# Rozmiar puli: liczba hostów w pamięci i liczba połączeń na host
+POOL_CONNECTIONS = env_int('HTTP_POOL_CONNECTIONS', 4)
+POOL_MAXSIZE = env_int('HTTP_POOL_MAXSIZE', 100)
+
+# Osobne limity czasu na połączenie i na odczyt odpowiedzi (w sekundach)
+CONNECT_TIMEOUT = env_float('HTTP_CONNECT_TIMEOUT', 3.05)
+GEMINI_READ_TIMEOUT = env_float('GEMINI_READ_TIMEOUT', 15)
+HF_READ_TIMEOUT = env_float('HF_READ_TIMEOUT', 10)
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+
+def timeout(read_timeout):
+    """Zwraca krotkę (connect, read) dla requests"""
+    return (CONNECT_TIMEOUT, read_timeout)
+
+
+GEMINI_TIMEOUT = timeout(GEMINI_READ_TIMEOUT)
+HF_TIMEOUT = timeout(HF_READ_TIMEOUT)
+
+
+def _create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=0,
+        pool_block=False
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Zwraca sesję HTTP bieżącego procesu (nowa pula po forku workera)"""
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _create_session()
+                _session_pid = pid
+    return _session
+
+
+def _w_terminie(timeout):
+    """Limity czasu skrócone do terminu zapytania, jeśli jest ustawiony"""
+    zostalo = deadline.pozostalo()
+    if zostalo is None:
+        return timeout
+    if zostalo <= 0:
+        raise requests.exceptions.Timeout("Przekroczony termin zapytania")
+    if isinstance(timeout, tuple):
+        return tuple(min(t, zostalo) for t in timeout)
+    return min(timeout, zostalo)
+
+
+def _wyslij(metoda, url, timeout, **kwargs):
+    timeout = _w_terminie(timeout)
+    if deadline.anulowane():
+        raise deadline.AnulowanoError("Wywołanie anulowane przed wysłaniem")
+    # Span bez query stringu - nie zapisujemy kluczy API
+    czesci = urlsplit(url)
+    with tracing.span(f"HTTP {metoda}", **{'http.host': czesci.netloc, 'http.path': czesci.path,
+                                           'http.stream': bool(kwargs.get('stream'))}) as span:
+        response = get_session().request(metoda, url, timeout=timeout, **kwargs)
+        span.ustaw(**{'http.status_code': response.status_code})
+        # Przegrany wyścig (dispatch) zamyka odpowiedź - także strumień w trakcie czytania
+        deadline.przy_anulowaniu(response.close)
+        if deadline.anulowane():
+            span.ustaw(cancelled=True)
+            raise deadline.AnulowanoError("Wywołanie anulowane - inny dostawca odpowiedział pierwszy")
+        return response
+
+
+def post(url, timeout=HF_TIMEOUT, **kwargs):
+    """POST przez wspólną pulę połączeń"""
+    return _wyslij('POST', url, timeout, **kwargs)
+
+
+def get(url, timeout=HF_TIMEOUT, **kwargs):
+    """GET przez wspólną pulę połączeń"""
+    return _wyslij('GET', url, timeout, **kwargs)
@@ -0,0 +1,173 @@
+"""Lokalny model językowy na CPU - ostatni dostawca, gdy Gemini i HF zawiodą.
+
+Mały model przyczynowy (domyślnie distilgpt2) działa w procesie workera, bez
+sieci, więc w czasie awarii API odpowiedź ma przewidywalny czas zamiast
+gotowego tekstu z BACKUP_RESPONSES. Wymaga pakietów opcjonalnych:
+- LOCAL_MODEL_BACKEND=transformers - `pip install transformers torch`
+- LOCAL_MODEL_BACKEND=onnx - `pip install optimum[onnxruntime]` (np. model
+  wyeksportowany do ONNX i skwantyzowany do int8 w LOCAL_MODEL_PATH)
+
+Model wczytywany jest w każdym workerze - w rozgrzewce (post_worker_init)
+albo przy pierwszym użyciu. Proces główny gunicorna go nie importuje: torch
+i transformers przed forkiem psułyby monkey-patching gevent w workerach.
+Wagi nie są więc współdzielone między workerami - każdy trzyma własną kopię
+i pamięć rośnie z liczbą workerów (distilgpt2 to ok. 350 MB na worker, model
+ONNX int8 kilka razy mniej); przy ciasnej pamięci lepiej zmniejszyć WEB_CONCURRENCY
+niż wyłączać lokalny model.
+
+Równoczesne zapytania czekają w kolejce (najwyżej LOCAL_MODEL_QUEUE_SIZE)
+i są generowane razem (microbatch) - do LOCAL_MODEL_MAX_BATCH promptów w jednym
+przebiegu modelu, zbieranych przez LOCAL_MODEL_BATCH_WAIT_MS; przebiegi idą
+po jednym. Wczytywanie i obliczenia idą w osobnym wątku systemowym, żeby pod
+gevent nie blokowały pętli workera; blokady, liczniki i logi zostają w greenlecie.
+"""
+import os
+import threading
+
+import logs
+import microbatch
+import threadpool
+from settings import env_bool, env_str, env_int, env_float
+
+log = logs.get('local_model')
+
+LOCAL_MODEL_ENABLED = env_bool('LOCAL_MODEL_ENABLED', False)
+LOCAL_MODEL_BACKEND = env_str('LOCAL_MODEL_BACKEND', 'transformers').lower()
+LOCAL_MODEL_NAME = env_str('LOCAL_MODEL_NAME', 'distilgpt2')
+LOCAL_MODEL_PATH = env_str('LOCAL_MODEL_PATH', None)
+LOCAL_MODEL_THREADS = env_int('LOCAL_MODEL_THREADS', 2)
+LOCAL_MODEL_MAX_NEW_TOKENS = env_int('LOCAL_MODEL_MAX_NEW_TOKENS', 60)
+LOCAL_MODEL_MAX_BATCH = env_int('LOCAL_MODEL_MAX_BATCH', 4)
+LOCAL_MODEL_BATCH_WAIT_MS = env_float('LOCAL_MODEL_BATCH_WAIT_MS', 10)
+LOCAL_MODEL_QUEUE_SIZE = env_int('LOCAL_MODEL_QUEUE_SIZE', 16)
+LOCAL_MODEL_TIMEOUT = env_float('LOCAL_MODEL_TIMEOUT', 10.0)
+
+BACKENDY = ('transformers', 'onnx')
+
+
+class ModelNiedostepnyError(Exception):
+    """Lokalny model wyłączony, niezainstalowany albo przeciążony"""
+
+
+class LokalnyModel:
+    def __init__(self, nazwa=LOCAL_MODEL_NAME, backend=LOCAL_MODEL_BACKEND):
+        self.nazwa = LOCAL_MODEL_PATH or nazwa
+        self.backend = backend if backend in BACKENDY else 'transformers'
+        self._lock = threading.Lock()
+        self._model = None
+        self._tokenizer = None
+        self._blad_ladowania = None
+        self._watki_pid = None
+        self._paczki = microbatch.Mikropaczki(
+            'local', self._wykonaj, maks=LOCAL_MODEL_MAX_BATCH, okno_ms=LOCAL_MODEL_BATCH_WAIT_MS,
+            rownolegle=1, kolejka=LOCAL_MODEL_QUEUE_SIZE)
+
+        self.wygenerowane = 0
+
+    @property
+    def dostepny(self):
+        return LOCAL_MODEL_ENABLED and self._blad_ladowania is None
+
+    def zaladuj(self):
+        """Wczytuje model i tokenizer (raz na proces)"""
+        if self._model is not None or self._blad_ladowania is not None:
+            return
+        with self._lock:
+            if self._model is not None or self._blad_ladowania is not None:
+                return
+            stoper = logs.Stoper()
+            try:
+                tokenizer, model = threadpool.uruchom(self._wczytaj)
+            except Exception as e:
+                self._blad_ladowania = f"{type(e).__name__}: {e}"[:300]
+                log.error("Nie udało się wczytać lokalnego modelu",
+                          extra={"model": self.nazwa, "backend": self.backend, "error": self._blad_ladowania})
+                return
+            self._tokenizer, self._model = tokenizer, model
+            log.info("Lokalny model wczytany", extra={"model": self.nazwa, "backend": self.backend, "ms": stoper.ms})
+
+    def _wczytaj(self):
+        # W wątku systemowym - bez blokad gevent i logowania
+        from transformers import AutoTokenizer
+        if self.backend == 'onnx':
+            from optimum.onnxruntime import ORTModelForCausalLM as Model
+        else:
+            from transformers import AutoModelForCausalLM as Model
+        tokenizer = AutoTokenizer.from_pretrained(self.nazwa)
+        # GPT-2 nie ma tokenu dopełnienia; dopełnianie z lewej dla generowania w paczce
+        tokenizer.pad_token = tokenizer.pad_token or tokenizer.eos_token
+        tokenizer.padding_side = 'left'
+        model = Model.from_pretrained(self.nazwa)
+        if self.backend == 'transformers':
+            model.eval()
+        return tokenizer, model
+
+    def generuj(self, prompt, limit=LOCAL_MODEL_TIMEOUT):
+        """Tekst wygenerowany po prompcie (bez promptu); rzuca ModelNiedostepnyError albo TimeoutError"""
+        if not LOCAL_MODEL_ENABLED:
+            raise ModelNiedostepnyError("Lokalny model wyłączony (LOCAL_MODEL_ENABLED)")
+        if self._blad_ladowania is not None:
+            raise ModelNiedostepnyError(f"Lokalny model niedostępny: {self._blad_ladowania}")
+
+        try:
+            return self._paczki.dodaj(prompt, limit)
+        except microbatch.KolejkaPelnaError:
+            raise ModelNiedostepnyError("Kolejka lokalnego modelu pełna")
+        except TimeoutError:
+            raise TimeoutError(f"Lokalny model nie odpowiedział w {limit:g}s")
+
+    def _wykonaj(self, prompty):
+        self.zaladuj()
+        if self._model is None:
+            raise ModelNiedostepnyError(f"Lokalny model niedostępny: {self._blad_ladowania}")
+        stoper = logs.Stoper()
+        teksty = threadpool.uruchom(self._generuj_paczke, prompty)
+        with self._lock:
+            self.wygenerowane += len(prompty)
+        log.debug("Paczka lokalnego modelu", extra={"batch": len(prompty), "ms": stoper.ms})
+        return teksty
+
+    def _przygotuj_watki(self):
+        # Liczba wątków torcha jest ustawieniem procesu - raz w każdym workerze
+        if self._watki_pid == os.getpid():
+            return
+        self._watki_pid = os.getpid()
+        if self.backend == 'transformers':
+            import torch
+            torch.set_num_threads(max(LOCAL_MODEL_THREADS, 1))
+
+    def _generuj_paczke(self, prompty):
+        # W wątku systemowym - bez blokad gevent i logowania
+        self._przygotuj_watki()
+        wejscie = self._tokenizer(prompty, return_tensors='pt', padding=True)
+        wyjscie = self._model.generate(
+            **wejscie,
+            max_new_tokens=LOCAL_MODEL_MAX_NEW_TOKENS,
+            do_sample=True,
+            top_p=0.9,
+            temperature=0.7,
+            pad_token_id=self._tokenizer.pad_token_id,
+        )
+        # Dopełnienie z lewej - nowe tokeny zaczynają się w tym samym miejscu dla całej paczki
+        nowe = wyjscie[:, wejscie['input_ids'].shape[1]:]
+        teksty = self._tokenizer.batch_decode(nowe, skip_special_tokens=True)
+        return [tekst.strip() for tekst in teksty]
+
+    def statystyki(self):
+        paczki = self._paczki.statystyki()
+        with self._lock:
+            return {
+                'enabled': LOCAL_MODEL_ENABLED,
+                'model': self.nazwa,
+                'backend': self.backend,
+                'loaded': self._model is not None,
+                'error': self._blad_ladowania,
+                'queued': paczki['queued'],
+                'batches': paczki['batches'],
+                'avg_batch': paczki['avg_size'],
+                'generated': self.wygenerowane,
+                'rejected': paczki['rejected'],
+            }
+
+
+model = LokalnyModel()
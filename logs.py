@@ -0,0 +1,153 @@
+"""Strukturalne logi (JSON) zapisywane w tle.
+
+Wątek obsługujący zapytanie tylko wkłada rekord do kolejki - zapis na stdout
+robi osobny wątek (QueueListener), więc zapytanie nie czeka na I/O. Gdy kolejka
+jest pełna, rekord jest pomijany i liczony w `pominiete`.
+
+Konfiguracja:
+- LOG_LEVEL - poziom domyślny (INFO)
+- LOG_LEVELS - poziomy per logger, np. "gemini=DEBUG,hf=WARNING"
+- LOG_FORMAT - json (domyślnie) albo text
+- LOG_DEBUG_SAMPLE_RATE - jaka część rekordów DEBUG trafia do logu (0.0-1.0)
+- LOG_QUEUE_SIZE - pojemność kolejki
+
+Logi nie zawierają treści wiadomości ani odpowiedzi - tylko ich długości.
+"""
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+import codec
+from settings import env_str, env_int, env_float
+
+LOG_LEVEL = env_str('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = env_str('LOG_LEVELS', '')
+LOG_FORMAT = env_str('LOG_FORMAT', 'json').lower()
+LOG_DEBUG_SAMPLE_RATE = env_float('LOG_DEBUG_SAMPLE_RATE', 0.01)
+LOG_QUEUE_SIZE = env_int('LOG_QUEUE_SIZE', 10000)
+
+KORZEN = 'chat_domi'
+
+# Standardowe atrybuty LogRecord - wszystko inne to pola przekazane przez extra=
+_POLA_REKORDU = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+pominiete = 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Jeden rekord = jedna linia JSON z polami z extra="""
+
+    def format(self, record):
+        dane = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        for klucz, wartosc in vars(record).items():
+            if klucz not in _POLA_REKORDU and not klucz.startswith('_'):
+                dane[klucz] = wartosc
+        if record.exc_info:
+            dane['exc'] = self.formatException(record.exc_info)
+        return codec.dumps(dane, default=str)
+
+
+class ProbkowanieDebug(logging.Filter):
+    """Przepuszcza tylko część rekordów DEBUG - reszta poziomów bez zmian"""
+
+    def __init__(self, czesc):
+        super().__init__()
+        self.czesc = czesc
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        return self.czesc >= 1 or random.random() < self.czesc
+
+
+class NieblokujacyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, który przy pełnej kolejce pomija rekord zamiast czekać"""
+
+    def enqueue(self, record):
+        global pominiete
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pominiete += 1
+
+
+def _poziom(nazwa, domyslny=logging.INFO):
+    return getattr(logging, nazwa.strip().upper(), domyslny)
+
+
+def konfiguruj():
+    """Podpina logger 'chat_domi' pod kolejkę i wątek zapisujący (raz na proces)"""
+    global _listener, _listener_pid
+
+    with _lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            return
+        if _listener is not None:
+            # Po forku wątek rodzica nie istnieje - zaczynamy od nowa
+            _listener = None
+
+        kolejka = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        wyjscie = logging.StreamHandler(sys.stdout)
+        if LOG_FORMAT == 'json':
+            wyjscie.setFormatter(JsonFormatter())
+        else:
+            wyjscie.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+        handler = NieblokujacyQueueHandler(kolejka)
+        handler.addFilter(ProbkowanieDebug(LOG_DEBUG_SAMPLE_RATE))
+
+        korzen = logging.getLogger(KORZEN)
+        for stary in list(korzen.handlers):
+            korzen.removeHandler(stary)
+        korzen.addHandler(handler)
+        korzen.setLevel(_poziom(LOG_LEVEL))
+        korzen.propagate = False
+
+        # Poziomy dla pojedynczych loggerów, np. LOG_LEVELS="gemini=DEBUG,hf=WARNING"
+        for wpis in filter(None, (w.strip() for w in LOG_LEVELS.split(','))):
+            nazwa, _, poziom = wpis.partition('=')
+            logging.getLogger(f"{KORZEN}.{nazwa.strip()}").setLevel(_poziom(poziom, logging.NOTSET))
+
+        _listener = logging.handlers.QueueListener(kolejka, wyjscie, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def get(nazwa):
+    """Logger modułu, np. logs.get('gemini') -> 'chat_domi.gemini'"""
+    konfiguruj()
+    return logging.getLogger(f"{KORZEN}.{nazwa}")
+
+
+def zatrzymaj():
+    """Zapisuje zaległe rekordy (np. przy wyłączaniu workera)"""
+    global _listener
+    with _lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+        _listener = None
+
+
+class Stoper:
+    """Mierzy czas w ms do pola `ms` w logach"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+
+    @property
+    def ms(self):
+        return round((time.monotonic() - self.start) * 1000, 1)
@@ -0,0 +1,311 @@
+"""Metryki w formacie Prometheusa (endpoint /metrics).
+
+Każdy worker gunicorna liczy metryki w pamięci i co METRICS_FLUSH_SECONDS
+zapisuje ich migawkę do pliku METRICS_DIR/<pid mastera>/<pid>.json. Endpoint
+/metrics (obsłużony przez dowolny worker) sumuje własne liczniki z migawkami
+pozostałych workerów tego samego mastera, więc wynik nie zależy od tego, który
+worker odpowie. Liczniki zakończonych workerów zostają w sumie do końca
+uruchomienia, ich wskaźniki (zapytania w toku) - nie. Katalogi uruchomień,
+których master już nie żyje, są pomijane i usuwane przy starcie workera (także
+pod serwerem Flaska, gdzie "masterem" jest sam proces).
+
+Serie:
+- chat_requests_total{endpoint,status} - zapytania do endpointów czatu
+- chat_request_duration_seconds{endpoint} - czas całego zapytania (histogram)
+- chat_upstream_duration_seconds{provider,outcome} - czas wywołania Gemini/HF (histogram;
+  outcome: ok/error/timeout/cancelled - przegrany wyścig dispatch)
+- chat_responses_total{source} - skąd pochodziła odpowiedź (cache/gemini/hf/backup/coalesced)
+- chat_fallbacks_total{provider} - odpowiedzi od dostawcy innego niż pierwszy
+- chat_backup_responses_total - gotowe odpowiedzi z BACKUP_RESPONSES
+- chat_timeouts_total{provider} - przekroczone limity czasu
+- chat_in_flight_requests - zapytania w toku
+- chat_rejected_total{reason} - zapytania odrzucone przez limity (429)
+"""
+import functools
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from flask import current_app
+
+import deadline
+import logs
+from settings import env_bool, env_str, env_float
+
+log = logs.get('metrics')
+
+METRICS_ENABLED = env_bool('METRICS_ENABLED', True)
+METRICS_DIR = env_str('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'chat_domi_metrics'))
+METRICS_FLUSH_SECONDS = env_float('METRICS_FLUSH_SECONDS', 5)
+
+BUCKETY = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30)
+
+SERIE = {
+    'chat_requests_total': ('counter', 'Zapytania do endpointów czatu'),
+    'chat_request_duration_seconds': ('histogram', 'Czas obsługi zapytania czatu'),
+    'chat_upstream_duration_seconds': ('histogram', 'Czas wywołania dostawcy odpowiedzi'),
+    'chat_responses_total': ('counter', 'Odpowiedzi według źródła'),
+    'chat_fallbacks_total': ('counter', 'Odpowiedzi od zapasowego dostawcy'),
+    'chat_backup_responses_total': ('counter', 'Gotowe odpowiedzi awaryjne'),
+    'chat_timeouts_total': ('counter', 'Przekroczone limity czasu'),
+    'chat_in_flight_requests': ('gauge', 'Zapytania czatu w toku'),
+    'chat_rejected_total': ('counter', 'Zapytania odrzucone przez limity'),
+    'chat_retries_total': ('counter', 'Ponowione wywołania dostawców'),
+    'chat_batch_errors_total': ('counter', 'Wiadomości z paczki bez odpowiedzi'),
+}
+
+_lock = threading.Lock()
+_wartosci = {}  # (nazwa, etykiety) -> liczba albo [kubełki..., suma, liczba] dla histogramów
+_pid = None
+
+
+def _klucz(nazwa, etykiety):
+    return nazwa, tuple(sorted((k, str(v)) for k, v in etykiety.items()))
+
+
+def _wlasciciel():
+    """PID uruchomienia: master gunicorna dla workera, sam proces pod serwerem Flaska"""
+    return os.getppid() if 'gunicorn' in sys.modules else os.getpid()
+
+
+def _katalog():
+    return os.path.join(METRICS_DIR, str(_wlasciciel()))
+
+
+def _uruchom_zapis():
+    """Wątek zapisujący migawkę - osobno w każdym workerze (po forku)"""
+    global _pid, _wartosci
+    if _pid == os.getpid():
+        return
+    with _lock:
+        if _pid == os.getpid():
+            return
+        if _pid is not None:
+            # Dziecko po forku zaczyna od zera - liczniki rodzica są w jego pliku
+            _wartosci = {}
+        _pid = os.getpid()
+    wyczysc()
+    if METRICS_FLUSH_SECONDS > 0:
+        threading.Thread(target=_zapisuj_co_chwile, daemon=True).start()
+
+
+def _zapisuj_co_chwile():
+    pid = os.getpid()
+    while _pid == pid:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        zapisz()
+
+
+def zwieksz(nazwa, wartosc=1, **etykiety):
+    """Zwiększa licznik (albo wskaźnik - także o wartość ujemną)"""
+    if not METRICS_ENABLED:
+        return
+    _uruchom_zapis()
+    klucz = _klucz(nazwa, etykiety)
+    with _lock:
+        _wartosci[klucz] = _wartosci.get(klucz, 0) + wartosc
+
+
+def obserwuj(nazwa, sekundy, **etykiety):
+    """Dodaje pomiar czasu do histogramu"""
+    if not METRICS_ENABLED:
+        return
+    _uruchom_zapis()
+    klucz = _klucz(nazwa, etykiety)
+    with _lock:
+        wartosc = _wartosci.get(klucz)
+        if wartosc is None:
+            wartosc = _wartosci[klucz] = [0] * (len(BUCKETY) + 2)
+        for i, granica in enumerate(BUCKETY):
+            if sekundy <= granica:
+                wartosc[i] += 1
+        wartosc[-2] += sekundy
+        wartosc[-1] += 1
+
+
+def czy_timeout(e):
+    """Czy wyjątek (lub wyjątek, w czasie obsługi którego powstał) to przekroczenie czasu"""
+    while e is not None:
+        if isinstance(e, (requests.exceptions.Timeout, TimeoutError)):
+            return True
+        e = e.__cause__ or e.__context__
+    return False
+
+
+def upstream(nazwa, funkcja):
+    """Opakowuje wywołanie dostawcy pomiarem czasu i liczeniem timeoutów"""
+    @functools.wraps(funkcja)
+    def mierzona(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            wynik = funkcja(*args, **kwargs)
+        except Exception as e:
+            if deadline.anulowane():
+                wynik_wywolania = 'cancelled'
+            else:
+                wynik_wywolania = 'timeout' if czy_timeout(e) else 'error'
+            if wynik_wywolania == 'timeout':
+                zwieksz('chat_timeouts_total', provider=nazwa)
+            obserwuj('chat_upstream_duration_seconds', time.monotonic() - start,
+                     provider=nazwa, outcome=wynik_wywolania)
+            raise
+        obserwuj('chat_upstream_duration_seconds', time.monotonic() - start, provider=nazwa, outcome='ok')
+        return wynik
+    return mierzona
+
+
+def endpoint(nazwa):
+    """Dekorator widoku: liczba zapytań, czas obsługi i zapytania w toku.
+
+    Dla odpowiedzi strumieniowych pomiar kończy się po wysłaniu ostatniego fragmentu.
+    """
+    def dekorator(widok):
+        @functools.wraps(widok)
+        def mierzony(*args, **kwargs):
+            start = time.monotonic()
+            zwieksz('chat_in_flight_requests', 1)
+            zakonczony = []
+
+            def zakoncz(status):
+                if zakonczony:
+                    return
+                zakonczony.append(True)
+                zwieksz('chat_in_flight_requests', -1)
+                zwieksz('chat_requests_total', endpoint=nazwa, status=status)
+                obserwuj('chat_request_duration_seconds', time.monotonic() - start, endpoint=nazwa)
+
+            try:
+                wynik = widok(*args, **kwargs)
+            except Exception:
+                zakoncz(500)
+                raise
+            odpowiedz = current_app.make_response(wynik)
+            if odpowiedz.is_streamed:
+                odpowiedz.call_on_close(lambda: zakoncz(odpowiedz.status_code))
+            else:
+                zakoncz(odpowiedz.status_code)
+            return odpowiedz
+        return mierzony
+    return dekorator
+
+
+def _migawka():
+    with _lock:
+        return [[nazwa, list(etykiety), wartosc] for (nazwa, etykiety), wartosc in _wartosci.items()]
+
+
+def zapisz():
+    """Zapisuje migawkę metryk tego workera do METRICS_DIR"""
+    if not METRICS_ENABLED:
+        return
+    try:
+        katalog = _katalog()
+        os.makedirs(katalog, exist_ok=True)
+        sciezka = os.path.join(katalog, f"{os.getpid()}.json")
+        tymczasowy = sciezka + '.tmp'
+        with open(tymczasowy, 'w') as f:
+            json.dump(_migawka(), f)
+        os.replace(tymczasowy, sciezka)
+    except OSError as e:
+        log.warning("Nie udało się zapisać metryk", extra={"error": str(e)})
+
+
+def wyczysc():
+    """Usuwa migawki uruchomień, których master już nie żyje"""
+    for sciezka in glob.glob(os.path.join(METRICS_DIR, '*')):
+        nazwa = os.path.basename(sciezka)
+        try:
+            if os.path.isdir(sciezka):
+                if nazwa.isdigit() and not _zyje(int(nazwa)):
+                    shutil.rmtree(sciezka, ignore_errors=True)
+            elif nazwa.endswith('.json'):
+                # Płaskie migawki z wersji bez katalogów uruchomień
+                os.remove(sciezka)
+        except OSError:
+            pass
+
+
+def _zyje(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _zsumuj():
+    """Metryki wszystkich workerów: własne z pamięci, pozostałe z plików"""
+    suma = {}
+
+    def dodaj(nazwa, etykiety, wartosc):
+        klucz = (nazwa, tuple(tuple(e) for e in etykiety))
+        if isinstance(wartosc, list):
+            obecna = suma.setdefault(klucz, [0] * len(wartosc))
+            for i, w in enumerate(wartosc):
+                obecna[i] += w
+        else:
+            suma[klucz] = suma.get(klucz, 0) + wartosc
+
+    for nazwa, etykiety, wartosc in _migawka():
+        dodaj(nazwa, etykiety, wartosc)
+
+    for sciezka in glob.glob(os.path.join(_katalog(), '*.json')):
+        try:
+            pid = int(os.path.basename(sciezka)[:-5])
+            if pid == os.getpid():
+                continue
+            with open(sciezka) as f:
+                wpisy = json.load(f)
+        except (ValueError, OSError):
+            continue
+        zywy = _zyje(pid)
+        for nazwa, etykiety, wartosc in wpisy:
+            if SERIE.get(nazwa, ('counter',))[0] == 'gauge' and not zywy:
+                continue
+            dodaj(nazwa, etykiety, wartosc)
+    return suma
+
+
+def _etykiety(etykiety, dodatkowe=()):
+    pary = list(etykiety) + list(dodatkowe)
+    if not pary:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pary) + '}'
+
+
+def _escape(wartosc):
+    return str(wartosc).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _liczba(wartosc):
+    return repr(float(wartosc)) if isinstance(wartosc, float) else str(wartosc)
+
+
+def eksport():
+    """Tekst w formacie ekspozycji Prometheusa (text/plain; version=0.0.4)"""
+    suma = _zsumuj()
+    linie = []
+    for nazwa, (typ, opis) in SERIE.items():
+        linie.append(f"# HELP {nazwa} {opis}")
+        linie.append(f"# TYPE {nazwa} {typ}")
+        for (seria, etykiety), wartosc in sorted(suma.items()):
+            if seria != nazwa:
+                continue
+            if typ != 'histogram':
+                linie.append(f"{nazwa}{_etykiety(etykiety)} {_liczba(wartosc)}")
+                continue
+            for granica, liczba in zip(BUCKETY, wartosc):
+                linie.append(f"{nazwa}_bucket{_etykiety(etykiety, [('le', granica)])} {liczba}")
+            linie.append(f"{nazwa}_bucket{_etykiety(etykiety, [('le', '+Inf')])} {wartosc[-1]}")
+            linie.append(f"{nazwa}_sum{_etykiety(etykiety)} {_liczba(wartosc[-2])}")
+            linie.append(f"{nazwa}_count{_etykiety(etykiety)} {wartosc[-1]}")
+    return '\n'.join(linie) + '\n'
+
@@ -0,0 +1,184 @@
+"""Mikropaczki - łączenie równoczesnych wywołań w jedno wywołanie zbiorcze.
+
+Pod obciążeniem wiele zapytań naraz woła HF (albo lokalny model) z jednym
+promptem. Mikropaczka zbiera prompty, które przyjdą w oknie MICROBATCH_WINDOW_MS
+od pierwszego (najwyżej MICROBATCH_MAX_SIZE), wykonuje dla nich jedno wywołanie
+(lista `inputs` HF albo jeden przebieg modelu) i rozdaje wyniki czekającym.
+Kilka milisekund w kolejce w zamian za wielokrotnie mniej wywołań dostawcy.
+
+- paczki wykonywane są w tle, najwyżej `rownolegle` naraz; gdy wszystkie
+  miejsca są zajęte, kolejna paczka rośnie, zamiast czekać z jednym promptem
+- termin paczki to najdłuższy termin czekających (deadline), a każdy
+  czekający przestaje czekać po swoim; anulowany czekający (przegrany wyścig
+  dispatch) przestaje czekać od razu i nie trafia do paczki, jeśli jeszcze
+  nie ruszyła
+- `wykonaj(elementy)` zwraca listę wyników w tej samej kolejności; wyjątek
+  na liście trafia tylko do swojego wywołującego, rzucony - do wszystkich
+"""
+import os
+import queue
+import threading
+import time
+
+import deadline
+import logs
+from settings import env_bool, env_int, env_float
+
+log = logs.get('microbatch')
+
+MICROBATCH_ENABLED = env_bool('MICROBATCH_ENABLED', True)
+MICROBATCH_WINDOW_MS = env_float('MICROBATCH_WINDOW_MS', 15)
+MICROBATCH_MAX_SIZE = env_int('MICROBATCH_MAX_SIZE', 8)
+MICROBATCH_CONCURRENCY = env_int('MICROBATCH_CONCURRENCY', 4)
+MICROBATCH_QUEUE_SIZE = env_int('MICROBATCH_QUEUE_SIZE', 64)
+MICROBATCH_TIMEOUT = env_float('MICROBATCH_TIMEOUT', 30.0)
+
+
+class KolejkaPelnaError(Exception):
+    """Za dużo elementów czeka na paczkę"""
+
+
+class _Element:
+    def __init__(self, wartosc, koniec):
+        self.wartosc = wartosc
+        self.koniec = koniec
+        self.gotowe = threading.Event()
+        self.wynik = None
+        self.blad = None
+
+
+class Mikropaczki:
+    def __init__(self, nazwa, wykonaj, maks=MICROBATCH_MAX_SIZE, okno_ms=MICROBATCH_WINDOW_MS,
+                 rownolegle=MICROBATCH_CONCURRENCY, kolejka=MICROBATCH_QUEUE_SIZE):
+        self.nazwa = nazwa
+        self.wykonaj = wykonaj
+        self.maks = max(maks, 1)
+        self.okno = okno_ms / 1000
+        self.rownolegle = max(rownolegle, 1)
+        self.rozmiar_kolejki = kolejka
+        self._lock = threading.Lock()
+        self._kolejka = None
+        self._miejsca = None
+        self._pid = None
+
+        self.paczki = 0
+        self.elementy = 0
+        self.najwieksza = 0
+        self.odrzucone = 0
+
+    def dodaj(self, wartosc, limit=MICROBATCH_TIMEOUT):
+        """Wynik dla `wartosc` z najbliższej paczki; rzuca KolejkaPelnaError, TimeoutError albo błąd paczki"""
+        limit = deadline.przytnij(limit)
+        element = _Element(wartosc, time.monotonic() + limit)
+        try:
+            self._uruchom_petle().put_nowait(element)
+        except queue.Full:
+            with self._lock:
+                self.odrzucone += 1
+            raise KolejkaPelnaError(f"Kolejka mikropaczek {self.nazwa} pełna")
+        deadline.przy_anulowaniu(lambda: self._anuluj(element))
+        if not element.gotowe.wait(limit):
+            # Wynik, który przyjdzie później, zostanie pominięty
+            raise TimeoutError(f"Mikropaczka {self.nazwa} nie odpowiedziała w {limit:g}s")
+        if element.blad is not None:
+            raise element.blad
+        return element.wynik
+
+    def _anuluj(self, element):
+        if not element.gotowe.is_set():
+            element.blad = deadline.AnulowanoError(f"Mikropaczka {self.nazwa}: wywołanie anulowane")
+            element.gotowe.set()
+
+    def _uruchom_petle(self):
+        # Osobna kolejka i wątek w każdym workerze (wątki nie przeżywają forka)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._kolejka = queue.Queue(maxsize=self.rozmiar_kolejki)
+                    self._miejsca = threading.BoundedSemaphore(self.rownolegle)
+                    threading.Thread(target=self._petla, args=(self._kolejka, self._miejsca),
+                                     daemon=True).start()
+                    self._pid = os.getpid()
+        return self._kolejka
+
+    def _petla(self, kolejka, miejsca):
+        while True:
+            paczka = [kolejka.get()]
+            koniec = time.monotonic() + self.okno
+            while len(paczka) < self.maks:
+                try:
+                    paczka.append(kolejka.get(timeout=max(koniec - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            miejsca.acquire()
+            # Czekając na wolne miejsce paczka mogła się jeszcze zapełnić
+            while len(paczka) < self.maks:
+                try:
+                    paczka.append(kolejka.get_nowait())
+                except queue.Empty:
+                    break
+            threading.Thread(target=self._wykonaj_paczke, args=(paczka, miejsca), daemon=True).start()
+
+    def _wykonaj_paczke(self, paczka, miejsca):
+        try:
+            teraz = time.monotonic()
+            # Bez elementów po terminie i anulowanych (ich wywołujący już nie czeka)
+            paczka = [e for e in paczka if e.koniec > teraz and not e.gotowe.is_set()]
+            if not paczka:
+                return
+            with self._lock:
+                self.paczki += 1
+                self.elementy += len(paczka)
+                self.najwieksza = max(self.najwieksza, len(paczka))
+            stoper = logs.Stoper()
+            try:
+                with deadline.termin(max(e.koniec for e in paczka) - teraz):
+                    wyniki = self.wykonaj([e.wartosc for e in paczka])
+                if len(wyniki) != len(paczka):
+                    raise ValueError(f"Paczka {self.nazwa}: {len(wyniki)} wyników dla {len(paczka)} elementów")
+            except Exception as e:
+                log.warning("Błąd mikropaczki", extra={"batcher": self.nazwa, "batch": len(paczka),
+                                                       "error": str(e)[:300]})
+                wyniki = [e] * len(paczka)
+            log.debug("Mikropaczka wykonana", extra={"batcher": self.nazwa, "batch": len(paczka), "ms": stoper.ms})
+            for element, wynik in zip(paczka, wyniki):
+                if isinstance(wynik, Exception):
+                    element.blad = wynik
+                else:
+                    element.wynik = wynik
+                element.gotowe.set()
+        finally:
+            miejsca.release()
+
+    def statystyki(self):
+        with self._lock:
+            return {
+                'max_size': self.maks,
+                'window_ms': round(self.okno * 1000, 1),
+                'concurrency': self.rownolegle,
+                'queued': self._kolejka.qsize() if self._kolejka is not None and self._pid == os.getpid() else 0,
+                'batches': self.paczki,
+                'items': self.elementy,
+                'avg_size': round(self.elementy / self.paczki, 2) if self.paczki else None,
+                'largest': self.najwieksza,
+                'rejected': self.odrzucone,
+            }
+
+
+_grupy = {}
+_grupy_lock = threading.Lock()
+
+
+def get(nazwa, wykonaj, **opcje):
+    """Mikropaczki o nazwie `nazwa` (jedne na proces, tworzone przy pierwszym użyciu)"""
+    with _grupy_lock:
+        if nazwa not in _grupy:
+            _grupy[nazwa] = Mikropaczki(nazwa, wykonaj, **opcje)
+        return _grupy[nazwa]
+
+
+def statystyki():
+    """Statystyki wszystkich mikropaczek do endpointu statusu"""
+    with _grupy_lock:
+        grupy = list(_grupy.values())
+    return {'enabled': MICROBATCH_ENABLED, 'batchers': {g.nazwa: g.statystyki() for g in grupy}}
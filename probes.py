@@ -0,0 +1,146 @@
+"""Sprawdzanie dostępności modeli dla stron diagnostycznych (/test-models, /test-gpt2).
+
+Zamiast odpytywać modele jeden po drugim przy każdym wejściu na stronę, sondy:
+- sprawdzają wszystkie modele naraz, całość w PROBE_DEADLINE sekund
+- zapisują wyniki (status, czas, próbka odpowiedzi) we wspólnym magazynie,
+  więc strona czyta je bez wywołań API, także w innych workerach
+- po PROBE_TTL sekundach podają jeszcze stare wyniki, ale odświeżają je w tle
+- co PROBE_REFRESH_SECONDS odświeżają wyniki w tle (0 = tylko przy odczycie);
+  krótka blokada w magazynie sprawia, że robi to jeden worker naraz
+
+Równoczesne odświeżenia tej samej sondy łączy single-flight.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import codec
+import logs
+import singleflight
+import store
+from settings import env_float
+
+log = logs.get('probes')
+
+PROBE_TTL = env_float('PROBE_TTL', 300)
+PROBE_DEADLINE = env_float('PROBE_DEADLINE', 12)
+PROBE_REFRESH_SECONDS = env_float('PROBE_REFRESH_SECONDS', 900)
+
+PREFIKS = 'probe:'
+PREFIKS_BLOKADY = 'probe:lock:'
+
+
+class Sonda:
+    """Wyniki prób jednej grupy modeli: `proba(model)` zwraca słownik wyniku albo rzuca wyjątek"""
+
+    def __init__(self, nazwa, modele, proba, magazyn=None):
+        self.nazwa = nazwa
+        self.modele = list(modele)
+        self.proba = proba
+        self._magazyn = magazyn
+        self._lock = threading.Lock()
+        self._w_tle = False
+
+    @property
+    def magazyn(self):
+        return self._magazyn or store.get_store()
+
+    def wyniki(self, odswiez=False):
+        """{'checked_at', 'results'} - z magazynu albo (gdy brak lub `odswiez`) z nowego sprawdzenia"""
+        zapis = None if odswiez else self._odczytaj()
+        if zapis is None:
+            zapis, _ = singleflight.zapytania.wykonaj(PREFIKS + self.nazwa, self.sprawdz)
+        elif time.time() - zapis['checked_at'] > PROBE_TTL:
+            self._odswiez_w_tle()
+        return zapis
+
+    def sprawdz(self):
+        """Sprawdza wszystkie modele równolegle i zapisuje wyniki"""
+        stoper = logs.Stoper()
+        pula = ThreadPoolExecutor(max_workers=max(len(self.modele), 1), thread_name_prefix='probe')
+        zadania = {pula.submit(self._probuj, model): model for model in self.modele}
+        wait(zadania, timeout=PROBE_DEADLINE)
+        pula.shutdown(wait=False, cancel_futures=True)
+
+        wyniki = []
+        for zadanie, model in zadania.items():
+            if zadanie.done():
+                wyniki.append(zadanie.result())
+            else:
+                wyniki.append({'model': model, 'ok': False, 'status_code': None, 'ms': None,
+                               'error': f"przekroczony limit {PROBE_DEADLINE:g}s"})
+        zapis = {'checked_at': time.time(), 'results': wyniki}
+        try:
+            self.magazyn.set(PREFIKS + self.nazwa, codec.dumps(zapis), PROBE_TTL * 4)
+        except Exception as e:
+            log.warning("Błąd magazynu sond", extra={"probe": self.nazwa, "error": str(e)})
+        log.info("Modele sprawdzone", extra={"probe": self.nazwa, "ms": stoper.ms,
+                                             "ok": sum(1 for w in wyniki if w['ok']), "models": len(wyniki)})
+        return zapis
+
+    def _probuj(self, model):
+        stoper = logs.Stoper()
+        try:
+            wynik = {'model': model, 'ok': False, 'status_code': None, **self.proba(model)}
+        except Exception as e:
+            wynik = {'model': model, 'ok': False, 'status_code': None, 'error': str(e)[:200]}
+        wynik['ms'] = stoper.ms
+        return wynik
+
+    def _odczytaj(self):
+        try:
+            wartosc = self.magazyn.get(PREFIKS + self.nazwa)
+            return codec.loads(wartosc) if wartosc else None
+        except Exception as e:
+            log.warning("Błąd magazynu sond", extra={"probe": self.nazwa, "error": str(e)})
+            return None
+
+    def _odswiez_w_tle(self):
+        with self._lock:
+            if self._w_tle:
+                return
+            self._w_tle = True
+
+        def odswiez():
+            try:
+                singleflight.zapytania.wykonaj(PREFIKS + self.nazwa, self.sprawdz)
+            except Exception as e:
+                log.warning("Błąd odświeżania sond", extra={"probe": self.nazwa, "error": str(e)[:300]})
+            finally:
+                with self._lock:
+                    self._w_tle = False
+        threading.Thread(target=odswiez, daemon=True).start()
+
+
+_sondy = []
+_harmonogram_pid = None
+
+
+def zarejestruj(nazwa, modele, proba):
+    """Nowa sonda, odświeżana też przez harmonogram"""
+    sonda = Sonda(nazwa, modele, proba)
+    _sondy.append(sonda)
+    return sonda
+
+
+def uruchom_harmonogram():
+    """Wątek odświeżający zarejestrowane sondy co PROBE_REFRESH_SECONDS (raz na worker)"""
+    global _harmonogram_pid
+    if PROBE_REFRESH_SECONDS <= 0 or _harmonogram_pid == os.getpid():
+        return
+    _harmonogram_pid = os.getpid()
+    threading.Thread(target=_odswiezaj_co_chwile, daemon=True).start()
+
+
+def _odswiezaj_co_chwile():
+    pid = os.getpid()
+    while _harmonogram_pid == pid:
+        time.sleep(PROBE_REFRESH_SECONDS)
+        for sonda in _sondy:
+            try:
+                # Jeden worker na okres - pozostałe czytają jego wyniki z magazynu
+                if sonda.magazyn.add(PREFIKS_BLOKADY + sonda.nazwa, str(pid), PROBE_REFRESH_SECONDS * 0.9):
+                    sonda.sprawdz()
+            except Exception as e:
+                log.warning("Błąd odświeżania sond", extra={"probe": sonda.nazwa, "error": str(e)[:300]})
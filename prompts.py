@@ -0,0 +1,173 @@
+"""Szablony promptów i gotowe fragmenty treści zapytań do Gemini i HF.
+
+Persona i instrukcje są w plikach tekstowych w PROMPTS_DIR (domyślnie ./prompts):
+- gemini_system.txt - persona i zadania bota (wysyłane jako systemInstruction)
+- gemini_user.txt - tura użytkownika, z miejscem {pytanie}
+- hf_prompt.txt - prompt GPT-2, z miejscami {historia} i {pytanie}
+
+Szablony są wczytywane raz, a stałe części treści JSON zamieniane na bajty,
+więc przy każdym zapytaniu wklejana jest tylko (zakodowana) wiadomość.
+Zmienione pliki są wczytywane ponownie co najwyżej co PROMPTS_RELOAD_SECONDS,
+co pozwala zmienić personę bez ponownego wdrożenia.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import codec
+import logs
+from settings import env_str, env_float
+
+log = logs.get('prompts')
+
+PROMPTS_DIR = env_str('PROMPTS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts'))
+PROMPTS_RELOAD_SECONDS = env_float('PROMPTS_RELOAD_SECONDS', 30)
+
+PLIKI = ('gemini_system.txt', 'gemini_user.txt', 'hf_prompt.txt')
+
+_POLE = re.compile(r'\{(\w+)\}')
+
+
+def _json_tekst(tekst):
+    """Tekst zakodowany jako zawartość napisu JSON (bez cudzysłowów), w UTF-8"""
+    return codec.dumpb(tekst)[1:-1]
+
+
+class Szablon:
+    """Szablon z polami {nazwa}, podzielony raz na stałe fragmenty i pola"""
+
+    def __init__(self, tekst):
+        self.tekst = tekst
+        self._czesci = []  # (stały tekst, nazwa pola lub None)
+        pozycja = 0
+        for pole in _POLE.finditer(tekst):
+            self._czesci.append((tekst[pozycja:pole.start()], pole.group(1)))
+            pozycja = pole.end()
+        self._czesci.append((tekst[pozycja:], None))
+        self._czesci_json = [(_json_tekst(staly), nazwa) for staly, nazwa in self._czesci]
+
+    def wypelnij(self, **wartosci):
+        """Tekst z wklejonymi wartościami pól"""
+        return ''.join(staly + (wartosci[nazwa] if nazwa else '') for staly, nazwa in self._czesci)
+
+    def wypelnij_json(self, **wartosci):
+        """Jak wypelnij(), ale od razu jako zawartość napisu JSON w bajtach"""
+        return b''.join(staly + (_json_tekst(wartosci[nazwa]) if nazwa else b'')
+                        for staly, nazwa in self._czesci_json)
+
+
+class Prompty:
+    """Wczytane szablony i prekompilowane fragmenty treści zapytań"""
+
+    def __init__(self, katalog, gemini_generation_config, hf_parameters):
+        self.katalog = katalog
+        teksty = {}
+        for plik in PLIKI:
+            with open(os.path.join(katalog, plik), encoding='utf-8') as f:
+                teksty[plik] = f.read().rstrip('\n')
+
+        self.gemini_system = teksty['gemini_system.txt']
+        self.gemini_user = Szablon(teksty['gemini_user.txt'])
+        self.hf = Szablon(teksty['hf_prompt.txt'])
+
+        # Wersja szablonów - część klucza cache, zmiana persony unieważnia odpowiedzi
+        self.wersja = hashlib.sha256(
+            '\x00'.join(teksty[plik] for plik in PLIKI).encode('utf-8')
+        ).hexdigest()[:12]
+
+        # Persona jako systemInstruction - stały początek treści zapytania
+        self._gemini_poczatek = (
+            b'{"systemInstruction":{"parts":[{"text":"' + _json_tekst(self.gemini_system)
+            + b'"}]},"contents":['
+        )
+
+        self._gemini_ogon = (
+            b'"}]}],"generationConfig":'
+            + json.dumps(gemini_generation_config, separators=(',', ':')).encode('utf-8')
+            + b'}'
+        )
+        self._hf_ogon = (
+            b'","parameters":'
+            + json.dumps(hf_parameters, separators=(',', ':')).encode('utf-8')
+            + b'}'
+        )
+
+    def gemini_body(self, pytanie, historia=None, cached_content=None):
+        """Treść zapytania generateContent (bajty JSON) z historią rozmowy.
+
+        Z `cached_content` persona nie jest wysyłana - Gemini bierze ją z cache kontekstu.
+        """
+        if cached_content:
+            czesci = [b'{"cachedContent":"', _json_tekst(cached_content), b'","contents":[']
+        else:
+            czesci = [self._gemini_poczatek]
+        for rola, tekst in (historia or []):
+            czesci += [b'{"role":"', rola.encode('ascii'), b'","parts":[{"text":"',
+                       _json_tekst(tekst), b'"}]},']
+        czesci += [b'{"role":"user","parts":[{"text":"',
+                   self.gemini_user.wypelnij_json(pytanie=pytanie),
+                   self._gemini_ogon]
+        return b''.join(czesci)
+
+    def hf_prompt(self, pytanie, historia=''):
+        """Prompt GPT-2 jako tekst (potrzebny też do wycięcia go z odpowiedzi)"""
+        return self.hf.wypelnij(pytanie=pytanie, historia=historia)
+
+    def hf_body(self, prompt):
+        """Treść zapytania do HF Inference API (bajty JSON) dla gotowego promptu"""
+        return b'{"inputs":"' + _json_tekst(prompt) + self._hf_ogon
+
+    def hf_body_wiele(self, prompty):
+        """Jak hf_body(), ale z listą promptów w `inputs` (jedno wywołanie dla paczki)"""
+        return b'{"inputs":["' + b'","'.join(_json_tekst(p) for p in prompty) + b'"]' + self._hf_ogon[1:]
+
+
+_prompty = None
+_stempel = None
+_sprawdzono = 0.0
+_konfiguracja = None
+_lock = threading.Lock()
+
+
+def _stempel_plikow():
+    return tuple(os.stat(os.path.join(PROMPTS_DIR, plik)).st_mtime_ns for plik in PLIKI)
+
+
+def wczytaj(gemini_generation_config, hf_parameters):
+    """Wczytuje szablony przy starcie aplikacji"""
+    global _prompty, _stempel, _sprawdzono, _konfiguracja
+    with _lock:
+        _konfiguracja = (gemini_generation_config, hf_parameters)
+        _stempel = _stempel_plikow()
+        _prompty = Prompty(PROMPTS_DIR, gemini_generation_config, hf_parameters)
+        _sprawdzono = time.monotonic()
+    log.info("Szablony promptów wczytane", extra={"dir": PROMPTS_DIR})
+    return _prompty
+
+
+def wczytane():
+    """Czy szablony są wczytane (bez sprawdzania plików - do health checku)"""
+    return _prompty is not None
+
+
+def get():
+    """Aktualne szablony; co PROMPTS_RELOAD_SECONDS sprawdza, czy pliki się zmieniły"""
+    global _prompty, _stempel, _sprawdzono
+    teraz = time.monotonic()
+    if PROMPTS_RELOAD_SECONDS > 0 and teraz - _sprawdzono >= PROMPTS_RELOAD_SECONDS:
+        with _lock:
+            if teraz - _sprawdzono >= PROMPTS_RELOAD_SECONDS:
+                _sprawdzono = teraz
+                try:
+                    stempel = _stempel_plikow()
+                    if stempel != _stempel:
+                        _prompty = Prompty(PROMPTS_DIR, *_konfiguracja)
+                        _stempel = stempel
+                        log.info("Szablony promptów wczytane ponownie", extra={"dir": PROMPTS_DIR})
+                except Exception as e:
+                    # Uszkodzony lub niepełny plik - zostają poprzednie szablony
+                    log.warning("Nie udało się przeładować szablonów", extra={"error": str(e)})
+    return _prompty
@@ -0,0 +1,316 @@
+"""Limity zapytań i kontrola przyjmowania dla endpointów czatu.
+
+Trzy warstwy:
+- kubełki tokenów per klient (adres IP) i globalny - stan we wspólnym
+  magazynie (store.update), więc limit obowiązuje łącznie dla wszystkich
+  workerów; kubełek globalny można podzielić na RATE_LIMIT_GLOBAL_SHARDS
+  kluczy, żeby zapytania nie czekały na zapis jednego klucza
+- kolejka przyjmowania w workerze - najwyżej ADMISSION_MAX_CONCURRENT zapytań
+  naraz i ADMISSION_QUEUE_SIZE czekających; zapytanie, które i tak nie
+  doczekałoby się miejsca w ADMISSION_MAX_WAIT s, dostaje od razu 429 z Retry-After
+- tempo wywołań Gemini - kubełki RPM/TPM (GEMINI_RPM, GEMINI_TPM), żeby nie
+  przekraczać limitów API; gdy czekanie byłoby dłuższe niż GEMINI_PACING_MAX_WAIT,
+  wywołanie jest pomijane i odpowiada kolejny dostawca
+
+Tokeny pobierane są tylko wtedy, gdy pozwalają wszystkie kubełki danego
+kroku (klient i globalny, RPM i TPM) - odrzucenie przez kolejny kubełek oddaje
+tokeny poprzednim. Adres klienta za proxy to wpis X-Forwarded-For dopisany
+przez zaufane proxy (RATE_LIMIT_PROXY_HOPS od prawej), nie ten podany przez
+klienta. Awaria magazynu nie blokuje czatu - limit jest wtedy pomijany.
+"""
+import functools
+import math
+import random
+import threading
+import time
+
+from flask import current_app, jsonify, request
+
+import logs
+import metrics
+import store
+from settings import env_bool, env_int, env_float
+
+log = logs.get('ratelimit')
+
+RATE_LIMIT_ENABLED = env_bool('RATE_LIMIT_ENABLED', True)
+RATE_LIMIT_CLIENT_PER_MINUTE = env_float('RATE_LIMIT_CLIENT_PER_MINUTE', 20)
+RATE_LIMIT_CLIENT_BURST = env_float('RATE_LIMIT_CLIENT_BURST', 5)
+RATE_LIMIT_GLOBAL_PER_SECOND = env_float('RATE_LIMIT_GLOBAL_PER_SECOND', 20)
+RATE_LIMIT_GLOBAL_BURST = env_float('RATE_LIMIT_GLOBAL_BURST', 40)
+RATE_LIMIT_GLOBAL_SHARDS = env_int('RATE_LIMIT_GLOBAL_SHARDS', 1)
+RATE_LIMIT_MAX_WAIT = env_float('RATE_LIMIT_MAX_WAIT', 1.0)
+RATE_LIMIT_TRUST_PROXY = env_bool('RATE_LIMIT_TRUST_PROXY', False)
+# Liczba zaufanych proxy przed aplikacją (Render - 1), każde dopisuje adres na końcu X-Forwarded-For
+RATE_LIMIT_PROXY_HOPS = env_int('RATE_LIMIT_PROXY_HOPS', 1)
+
+ADMISSION_MAX_CONCURRENT = env_int('ADMISSION_MAX_CONCURRENT', 50)
+ADMISSION_QUEUE_SIZE = env_int('ADMISSION_QUEUE_SIZE', 100)
+ADMISSION_MAX_WAIT = env_float('ADMISSION_MAX_WAIT', 5.0)
+
+# Limity Gemini API (0 = bez ograniczenia) - zależą od planu i modelu
+GEMINI_RPM = env_float('GEMINI_RPM', 0)
+GEMINI_TPM = env_float('GEMINI_TPM', 0)
+GEMINI_PACING_MAX_WAIT = env_float('GEMINI_PACING_MAX_WAIT', 2.0)
+
+PREFIKS = 'rl:'
+
+
+class LimitPrzekroczonyError(Exception):
+    """Limit nie pozwala wykonać wywołania w dopuszczalnym czasie"""
+
+    def __init__(self, komunikat, retry_after):
+        super().__init__(komunikat)
+        self.retry_after = retry_after
+
+
+class KubelekTokenow:
+    """Kubełek tokenów we wspólnym magazynie.
+
+    `pobierz` rezerwuje tokeny z wyprzedzeniem: zwraca, ile sekund trzeba
+    odczekać (0 - od razu), albo rzuca LimitPrzekroczonyError, gdy czekanie
+    byłoby dłuższe niż `maks_czekanie`.
+
+    Przy `shardy` > 1 kubełek to tyle kluczy magazynu, każdy z częścią tempa
+    i pojemności; zapytanie trafia do losowego, a gdy ten odmówi - do drugiego.
+    Suma limitów się nie zmienia, a zapisy rozkładają się na kilka kluczy.
+    """
+
+    def __init__(self, nazwa, na_sekunde, pojemnosc, magazyn=None, shardy=1):
+        self.nazwa = nazwa
+        self.na_sekunde = na_sekunde
+        self.pojemnosc = max(pojemnosc, 1)
+        self._magazyn = magazyn
+        self.shardy = max(shardy, 1)
+
+    @property
+    def magazyn(self):
+        return self._magazyn or store.get_store()
+
+    def _klucz(self, klucz, shard):
+        if self.shardy == 1:
+            return f"{PREFIKS}{self.nazwa}:{klucz}"
+        return f"{PREFIKS}{self.nazwa}:{klucz}#{shard}"
+
+    def pobierz(self, ile=1, maks_czekanie=0.0, klucz=''):
+        if self.na_sekunde <= 0:
+            return 0.0
+
+        na_sekunde = self.na_sekunde / self.shardy
+        pojemnosc = max(self.pojemnosc / self.shardy, 1)
+
+        def rezerwuj(stan):
+            teraz = time.time()
+            if stan:
+                tokeny, czas = (float(x) for x in stan.split(':'))
+                tokeny = min(pojemnosc, tokeny + (teraz - czas) * na_sekunde)
+            else:
+                tokeny = pojemnosc
+            # Tokeny mogą zejść poniżej zera o tyle, ile nadrobi się w maks_czekanie
+            if tokeny - ile < -maks_czekanie * na_sekunde:
+                return f"{tokeny:.6f}:{teraz:.6f}", (False, (ile - tokeny) / na_sekunde)
+            tokeny -= ile
+            return f"{tokeny:.6f}:{teraz:.6f}", (True, max(-tokeny / na_sekunde, 0.0))
+
+        ttl = pojemnosc / na_sekunde + 60
+        for shard in random.sample(range(self.shardy), min(self.shardy, 2)):
+            try:
+                zgoda, sekundy = self.magazyn.update(self._klucz(klucz, shard), rezerwuj, ttl)
+            except Exception as e:
+                log.warning("Błąd magazynu limitów, pomijam limit", extra={"bucket": self.nazwa, "error": str(e)})
+                return 0.0
+            if zgoda:
+                return sekundy
+        raise LimitPrzekroczonyError(f"Limit {self.nazwa}", sekundy)
+
+    def oddaj(self, ile=1, klucz=''):
+        """Zwraca tokeny pobrane przez `pobierz` (wywołanie jednak się nie odbędzie) - do dowolnego shardu"""
+        if self.na_sekunde <= 0:
+            return
+
+        pojemnosc = max(self.pojemnosc / self.shardy, 1)
+
+        def zwroc(stan):
+            if not stan:
+                return f"{pojemnosc:.6f}:{time.time():.6f}", None
+            tokeny, czas = (float(x) for x in stan.split(':'))
+            return f"{min(pojemnosc, tokeny + ile):.6f}:{czas:.6f}", None
+
+        try:
+            self.magazyn.update(self._klucz(klucz, random.randrange(self.shardy)), zwroc,
+                                pojemnosc / (self.na_sekunde / self.shardy) + 60)
+        except Exception as e:
+            log.warning("Błąd magazynu limitów", extra={"bucket": self.nazwa, "error": str(e)})
+
+
+def pobierz_wszystkie(pozycje):
+    """Pobiera tokeny z (kubełek, ile, maks_czekanie, klucz) tylko wtedy, gdy pozwalają wszystkie.
+
+    Zwraca najdłuższe czekanie; przy odrzuceniu oddaje już pobrane tokeny
+    i rzuca LimitPrzekroczonyError z atrybutem `kubelek`.
+    """
+    pobrane = []
+    czekanie = 0.0
+    for kubelek, ile, maks_czekanie, klucz in pozycje:
+        try:
+            czekanie = max(czekanie, kubelek.pobierz(ile, maks_czekanie, klucz))
+        except LimitPrzekroczonyError as e:
+            for poprzedni, ile_, klucz_ in pobrane:
+                poprzedni.oddaj(ile_, klucz_)
+            e.kubelek = kubelek.nazwa
+            raise
+        pobrane.append((kubelek, ile, klucz))
+    return czekanie
+
+
+class Przyjmowanie:
+    """Ograniczona liczba zapytań w toku i krótka kolejka w jednym workerze"""
+
+    def __init__(self, maks_rownoczesnie=ADMISSION_MAX_CONCURRENT, maks_kolejka=ADMISSION_QUEUE_SIZE,
+                 maks_czekanie=ADMISSION_MAX_WAIT):
+        self.maks_rownoczesnie = maks_rownoczesnie
+        self.maks_kolejka = maks_kolejka
+        self.maks_czekanie = maks_czekanie
+        self._warunek = threading.Condition()
+        self.w_toku = 0
+        self.czeka = 0
+        self.odrzucone = 0
+        # Średni czas obsługi (EWMA) - do szacowania czekania w kolejce
+        self.sredni_czas = 1.0
+
+    def wejdz(self):
+        """Zajmuje miejsce albo rzuca LimitPrzekroczonyError, jeśli nie zdąży w maks_czekanie"""
+        with self._warunek:
+            if self.w_toku < self.maks_rownoczesnie:
+                self.w_toku += 1
+                return
+            szacowane = (self.czeka + 1) * self.sredni_czas / self.maks_rownoczesnie
+            if self.czeka >= self.maks_kolejka or szacowane > self.maks_czekanie:
+                self.odrzucone += 1
+                raise LimitPrzekroczonyError("Kolejka pełna", szacowane)
+
+            self.czeka += 1
+            koniec = time.monotonic() + self.maks_czekanie
+            try:
+                while self.w_toku >= self.maks_rownoczesnie:
+                    zostalo = koniec - time.monotonic()
+                    if zostalo <= 0:
+                        self.odrzucone += 1
+                        raise LimitPrzekroczonyError("Przekroczony czas w kolejce", self.sredni_czas)
+                    self._warunek.wait(zostalo)
+            finally:
+                self.czeka -= 1
+            self.w_toku += 1
+
+    def wyjdz(self, czas):
+        with self._warunek:
+            self.w_toku -= 1
+            self.sredni_czas = 0.9 * self.sredni_czas + 0.1 * czas
+            self._warunek.notify()
+
+    def statystyki(self):
+        with self._warunek:
+            return {
+                'in_flight': self.w_toku,
+                'queued': self.czeka,
+                'rejected': self.odrzucone,
+                'avg_service_seconds': round(self.sredni_czas, 3),
+            }
+
+
+klient = KubelekTokenow('client', RATE_LIMIT_CLIENT_PER_MINUTE / 60, RATE_LIMIT_CLIENT_BURST)
+globalny = KubelekTokenow('global', RATE_LIMIT_GLOBAL_PER_SECOND, RATE_LIMIT_GLOBAL_BURST,
+                          shardy=RATE_LIMIT_GLOBAL_SHARDS)
+przyjmowanie = Przyjmowanie()
+
+# Zapas na krótkie serie - ćwierć minutowego limitu
+gemini_rpm = KubelekTokenow('gemini_rpm', GEMINI_RPM / 60, GEMINI_RPM / 4)
+gemini_tpm = KubelekTokenow('gemini_tpm', GEMINI_TPM / 60, GEMINI_TPM / 4)
+
+
+def adres_klienta():
+    """Adres klienta - za zaufanym proxy (Render) wpis X-Forwarded-For dopisany przez to proxy.
+
+    Początek nagłówka ustawia sam klient, więc brany jest adres RATE_LIMIT_PROXY_HOPS
+    od końca; krótszy nagłówek oznacza, że nie przeszedł przez wszystkie proxy.
+    """
+    if RATE_LIMIT_TRUST_PROXY and RATE_LIMIT_PROXY_HOPS > 0:
+        adresy = [a.strip() for a in request.headers.get('X-Forwarded-For', '').split(',') if a.strip()]
+        if len(adresy) >= RATE_LIMIT_PROXY_HOPS:
+            return adresy[-RATE_LIMIT_PROXY_HOPS]
+    return request.remote_addr or 'unknown'
+
+
+def _odrzuc(powod, retry_after):
+    metrics.zwieksz('chat_rejected_total', reason=powod)
+    sekundy = max(math.ceil(retry_after), 1)
+    odpowiedz = jsonify({'error': 'Za dużo wiadomości naraz - spróbuj za chwilę', 'retry_after': sekundy})
+    odpowiedz.status_code = 429
+    odpowiedz.headers['Retry-After'] = str(sekundy)
+    return odpowiedz
+
+
+def ogranicz(widok):
+    """Dekorator widoku: limity klienta i globalny, potem miejsce w kolejce workera"""
+    @functools.wraps(widok)
+    def ograniczony(*args, **kwargs):
+        if not RATE_LIMIT_ENABLED:
+            return widok(*args, **kwargs)
+
+        try:
+            czekanie = pobierz_wszystkie([
+                (klient, 1, 0.0, adres_klienta()),
+                (globalny, 1, RATE_LIMIT_MAX_WAIT, ''),
+            ])
+        except LimitPrzekroczonyError as e:
+            return _odrzuc(e.kubelek, e.retry_after)
+        if czekanie:
+            time.sleep(czekanie)
+
+        try:
+            przyjmowanie.wejdz()
+        except LimitPrzekroczonyError as e:
+            return _odrzuc('queue', e.retry_after)
+
+        start = time.monotonic()
+        zwolnione = []
+
+        def zwolnij():
+            if not zwolnione:
+                zwolnione.append(True)
+                przyjmowanie.wyjdz(time.monotonic() - start)
+
+        try:
+            odpowiedz = current_app.make_response(widok(*args, **kwargs))
+        except BaseException:
+            zwolnij()
+            raise
+        if odpowiedz.is_streamed:
+            odpowiedz.call_on_close(zwolnij)
+        else:
+            zwolnij()
+        return odpowiedz
+    return ograniczony
+
+
+def tempo_gemini(tokeny):
+    """Czeka na miejsce w limitach RPM/TPM Gemini albo rzuca LimitPrzekroczonyError"""
+    czekanie = pobierz_wszystkie([
+        (gemini_rpm, 1, GEMINI_PACING_MAX_WAIT, ''),
+        (gemini_tpm, tokeny, GEMINI_PACING_MAX_WAIT, ''),
+    ])
+    if czekanie:
+        time.sleep(czekanie)
+
+
+def statystyki():
+    """Stan limitów do endpointu statusu"""
+    return {
+        'enabled': RATE_LIMIT_ENABLED,
+        'client_per_minute': RATE_LIMIT_CLIENT_PER_MINUTE,
+        'global_per_second': RATE_LIMIT_GLOBAL_PER_SECOND,
+        'global_shards': globalny.shardy,
+        'gemini_rpm': GEMINI_RPM,
+        'gemini_tpm': GEMINI_TPM,
+        'admission': przyjmowanie.statystyki(),
+    }
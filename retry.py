@@ -0,0 +1,176 @@
+"""Ponawianie wywołań Gemini/HF po przejściowych błędach (429, 5xx, zerwane połączenie).
+
+- odstęp rośnie wykładniczo z losowym rozrzutem (full jitter), do RETRY_MAX_DELAY
+- podpowiedź serwera ma pierwszeństwo: nagłówek Retry-After albo
+  `estimated_time` z odpowiedzi HF "model is loading"
+- budżet ponowień per dostawca: w oknie RETRY_BUDGET_WINDOW s ponowień może
+  być najwyżej RETRY_BUDGET_RATIO wywołań (min. RETRY_BUDGET_MIN), żeby
+  awaria dostawcy nie mnożyła ruchu
+- ponowienie, które nie zmieści się przed terminem zapytania (deadline.py),
+  nie jest wykonywane - od razu odpowiada kolejny dostawca
+- wywołanie anulowane przez dispatch (inny dostawca już odpowiedział) nie
+  jest ponawiane, a odstęp przed ponowieniem kończy się od razu
+"""
+import collections
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+import codec
+import deadline
+import logs
+import metrics
+import tracing
+from settings import env_int, env_float
+
+log = logs.get('retry')
+
+RETRY_MAX_ATTEMPTS = env_int('RETRY_MAX_ATTEMPTS', 3)
+RETRY_BASE_DELAY = env_float('RETRY_BASE_DELAY', 0.2)
+RETRY_MAX_DELAY = env_float('RETRY_MAX_DELAY', 2.0)
+RETRY_BUDGET_RATIO = env_float('RETRY_BUDGET_RATIO', 0.2)
+RETRY_BUDGET_MIN = env_int('RETRY_BUDGET_MIN', 3)
+RETRY_BUDGET_WINDOW = env_float('RETRY_BUDGET_WINDOW', 10.0)
+
+# Najkrótszy sensowny czas na kolejną próbę - krótszy zapas przed terminem to rezygnacja
+MIN_CZAS_PROBY = env_float('RETRY_MIN_ATTEMPT_SECONDS', 1.0)
+
+STATUSY_PONAWIANE = {429, 500, 502, 503, 504}
+
+
+class BudzetPonowien:
+    """Ile ponowień wolno jeszcze wykonać w oknie czasu (per dostawca, per worker)"""
+
+    def __init__(self, udzial=RETRY_BUDGET_RATIO, minimum=RETRY_BUDGET_MIN, okno=RETRY_BUDGET_WINDOW):
+        self.udzial = udzial
+        self.minimum = minimum
+        self.okno = okno
+        self._lock = threading.Lock()
+        self._wywolania = collections.deque()
+        self._ponowienia = collections.deque()
+
+    def _przytnij(self, teraz):
+        for kolejka in (self._wywolania, self._ponowienia):
+            while kolejka and kolejka[0] < teraz - self.okno:
+                kolejka.popleft()
+
+    def wywolanie(self):
+        with self._lock:
+            teraz = time.monotonic()
+            self._przytnij(teraz)
+            self._wywolania.append(teraz)
+
+    def pozwol(self):
+        """Zużywa jedno ponowienie z budżetu - False, gdy budżet się wyczerpał"""
+        with self._lock:
+            teraz = time.monotonic()
+            self._przytnij(teraz)
+            if len(self._ponowienia) >= max(self.minimum, self.udzial * len(self._wywolania)):
+                return False
+            self._ponowienia.append(teraz)
+            return True
+
+    def stan(self):
+        with self._lock:
+            self._przytnij(time.monotonic())
+            return {'calls': len(self._wywolania), 'retries': len(self._ponowienia)}
+
+
+_budzety = {}
+_budzety_lock = threading.Lock()
+
+
+def budzet(nazwa):
+    with _budzety_lock:
+        if nazwa not in _budzety:
+            _budzety[nazwa] = BudzetPonowien()
+        return _budzety[nazwa]
+
+
+def podpowiedz_serwera(response):
+    """Sugerowany przez serwer czas do ponowienia w sekundach albo None"""
+    naglowek = response.headers.get('Retry-After')
+    if naglowek:
+        try:
+            return max(float(naglowek), 0.0)
+        except ValueError:
+            try:
+                data = email.utils.parsedate_to_datetime(naglowek)
+                return max(data.timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    if response.status_code == 503:
+        # HF: {"error": "Model ... is currently loading", "estimated_time": 20.0}
+        try:
+            szacowany = codec.loads(response.content).get('estimated_time')
+            if szacowany is not None:
+                return float(szacowany)
+        except (ValueError, AttributeError):
+            pass
+    return None
+
+
+def odstep(proba, podpowiedz=None):
+    """Czas do kolejnej próby: podpowiedź serwera albo wykładniczy z pełnym rozrzutem"""
+    if podpowiedz is not None:
+        return podpowiedz + random.uniform(0, RETRY_BASE_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** proba))
+
+
+def ponawiaj(nazwa, wyslij, maks_prob=RETRY_MAX_ATTEMPTS):
+    """Wywołuje `wyslij()` (zwraca requests.Response) z ponowieniami po przejściowych błędach.
+
+    Zwraca ostatnią odpowiedź - także nieudaną, jeśli ponowienie nie miało sensu;
+    błąd połączenia z ostatniej próby jest rzucany dalej.
+    """
+    budzet_dostawcy = budzet(nazwa)
+    budzet_dostawcy.wywolanie()
+    proba = 0
+    while True:
+        proba += 1
+        try:
+            response = wyslij()
+        except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+            # Zerwane lub nienawiązane połączenie - serwer nie zaczął pracy, można ponowić
+            if not _czy_ponowic(nazwa, proba, maks_prob, odstep(proba), type(e).__name__):
+                raise
+            continue
+
+        if response.status_code not in STATUSY_PONAWIANE:
+            return response
+        podpowiedz = podpowiedz_serwera(response)
+        if not _czy_ponowic(nazwa, proba, maks_prob, odstep(proba, podpowiedz), str(response.status_code)):
+            return response
+        response.close()
+
+
+def _czy_ponowic(nazwa, proba, maks_prob, czekanie, powod):
+    """Decyzja o ponowieniu; jeśli tak - odczekuje odstęp"""
+    if proba >= maks_prob or deadline.anulowane():
+        return False
+    zostalo = deadline.pozostalo()
+    if zostalo is not None and czekanie + MIN_CZAS_PROBY > zostalo:
+        log.info("Ponowienie nie zmieści się przed terminem",
+                 extra={"provider": nazwa, "reason": powod, "wait": round(czekanie, 2), "left": round(zostalo, 2)})
+        return False
+    if not budzet(nazwa).pozwol():
+        log.warning("Budżet ponowień wyczerpany", extra={"provider": nazwa, "reason": powod})
+        return False
+
+    metrics.zwieksz('chat_retries_total', provider=nazwa, reason=powod)
+    log.info("Ponawiam wywołanie", extra={"provider": nazwa, "reason": powod, "attempt": proba + 1,
+                                          "wait": round(czekanie, 2)})
+    with tracing.span('retry.backoff', provider=nazwa, reason=powod, attempt=proba + 1):
+        if deadline.spij(czekanie):
+            return False
+    return True
+
+
+def statystyki():
+    """Stan budżetów ponowień do endpointu statusu"""
+    with _budzety_lock:
+        budzety = dict(_budzety)
+    return {nazwa: b.stan() for nazwa, b in budzety.items()}
@@ -0,0 +1,170 @@
+"""Wybór kolejności dostawców na podstawie zmierzonych czasów i skuteczności.
+
+Każdy kandydat (Gemini, model HF) ma w workerze kroczące średnie (EWMA)
+skuteczności i czasu udanej odpowiedzi. Przy każdym zapytaniu:
+- kandydaci z otwartym obwodem albo skutecznością poniżej ROUTING_MIN_SUCCESS
+  są niezdrowi i trafiają na koniec listy
+- spośród zdrowych wybierana jest grupa o najwyższym priorytecie
+  (ROUTING_PRIORITIES, np. "gemini=0,hf=1"; domyślnie wszyscy kandydaci
+  są w jednej grupie 0, więc o wyborze decydują pomiary)
+- w grupie pierwszy kandydat jest losowany z wagą waga × skuteczność / czas
+  (ROUTING_WEIGHTS, np. "hf:distilgpt2=0.5") spośród kandydatów, którzy mają
+  już pomiary, więc najszybszy dostaje najwięcej ruchu, a pozostali dość,
+  żeby ich pomiary były aktualne; bez pomiarów w grupie (świeży worker)
+  pierwszy jest kandydat z początku konfiguracji (Gemini)
+- reszta to zapas w kolejności priorytetu i wagi (dla dispatch); przy równych
+  wagach decyduje kolejność konfiguracji - kandydat bez pomiarów dostaje
+  pierwsze wywołania jako zapas
+
+Ruch sam odpływa od modelu, który zwalnia albo zaczyna zwracać błędy. Bez
+nowych wywołań skuteczność kandydata wraca do 1 (połowa ubytku co
+ROUTING_RECOVERY_SECONDS), więc odsunięty model po chwili znów jest sprawdzany.
+"""
+import random
+import threading
+import time
+
+import circuit_breaker
+import deadline
+import logs
+from settings import env_bool, env_str, env_float
+
+log = logs.get('routing')
+
+ROUTING_ENABLED = env_bool('ROUTING_ENABLED', True)
+ROUTING_PRIORITIES = env_str('ROUTING_PRIORITIES', '')
+ROUTING_WEIGHTS = env_str('ROUTING_WEIGHTS', '')
+ROUTING_MIN_SUCCESS = env_float('ROUTING_MIN_SUCCESS', 0.5)
+ROUTING_ALPHA = env_float('ROUTING_ALPHA', 0.2)
+ROUTING_RECOVERY_SECONDS = env_float('ROUTING_RECOVERY_SECONDS', 30.0)
+# Zakładany czas odpowiedzi kandydata bez pomiarów (jego miejsce wśród zapasowych)
+ROUTING_DEFAULT_LATENCY = env_float('ROUTING_DEFAULT_LATENCY', 2.0)
+
+
+def _pary(tekst, typ):
+    """'a=1,b=2' -> {'a': typ('1'), 'b': typ('2')} (błędne wpisy pomijane)"""
+    wynik = {}
+    for wpis in filter(None, (w.strip() for w in tekst.split(','))):
+        nazwa, _, wartosc = wpis.rpartition('=')
+        try:
+            wynik[nazwa.strip()] = typ(wartosc)
+        except ValueError:
+            log.warning("Błędny wpis konfiguracji routingu", extra={"entry": wpis})
+    return wynik
+
+
+class _Pomiary:
+    """Kroczące średnie jednego kandydata"""
+
+    def __init__(self):
+        self._skutecznosc = 1.0
+        self.czas = ROUTING_DEFAULT_LATENCY
+        self.ostatnio = time.monotonic()
+        self.wywolania = 0
+        self.wybrany = 0
+
+    @property
+    def skutecznosc(self):
+        if ROUTING_RECOVERY_SECONDS <= 0:
+            return self._skutecznosc
+        powrot = 0.5 ** ((time.monotonic() - self.ostatnio) / ROUTING_RECOVERY_SECONDS)
+        return 1.0 - (1.0 - self._skutecznosc) * powrot
+
+    def zapisz(self, sukces, czas, alfa):
+        self.wywolania += 1
+        self._skutecznosc = self.skutecznosc + alfa * ((1.0 if sukces else 0.0) - self.skutecznosc)
+        self.ostatnio = time.monotonic()
+        if sukces:
+            self.czas += alfa * (czas - self.czas)
+
+
+class Router:
+    def __init__(self, priorytety=ROUTING_PRIORITIES, wagi=ROUTING_WEIGHTS, alfa=ROUTING_ALPHA,
+                 min_skutecznosc=ROUTING_MIN_SUCCESS):
+        self.priorytety = _pary(priorytety, int)
+        self.wagi = _pary(wagi, float)
+        self.alfa = alfa
+        self.min_skutecznosc = min_skutecznosc
+        self._lock = threading.Lock()
+        self._pomiary = {}
+
+    def _dla(self, nazwa):
+        if nazwa not in self._pomiary:
+            self._pomiary[nazwa] = _Pomiary()
+        return self._pomiary[nazwa]
+
+    def zapisz(self, nazwa, sukces, czas):
+        with self._lock:
+            self._dla(nazwa).zapisz(sukces, czas, self.alfa)
+
+    def mierz(self, nazwa, funkcja):
+        """Opakowuje funkcję dostawcy zapisem czasu i wyniku dla routingu"""
+        def mierzona(*args, **kwargs):
+            stoper = logs.Stoper()
+            try:
+                wynik = funkcja(*args, **kwargs)
+            except Exception:
+                # Anulowany przegrany wyścigu nie jest błędem kandydata
+                if not deadline.anulowane():
+                    self.zapisz(nazwa, False, stoper.ms / 1000)
+                raise
+            self.zapisz(nazwa, True, stoper.ms / 1000)
+            return wynik
+        return mierzona
+
+    def kolejnosc(self, dostawcy):
+        """Lista (nazwa, funkcja) w kolejności wywoływania dla bieżącego zapytania"""
+        if not ROUTING_ENABLED or len(dostawcy) < 2:
+            return list(dostawcy)
+
+        oceny = []
+        zmierzeni = set()
+        with self._lock:
+            for pozycja, (nazwa, funkcja) in enumerate(dostawcy):
+                pomiary = self._dla(nazwa)
+                if pomiary.wywolania:
+                    zmierzeni.add(nazwa)
+                skutecznosc = pomiary.skutecznosc
+                otwarty = circuit_breaker.get(nazwa).stan_skrocony()['state'] == circuit_breaker.OTWARTY
+                zdrowy = not otwarty and skutecznosc >= self.min_skutecznosc
+                waga = self.wagi.get(nazwa, 1.0) * skutecznosc / max(pomiary.czas, 0.05)
+                oceny.append((not zdrowy, self.priorytety.get(nazwa, 0), -waga, pozycja, nazwa, funkcja))
+        oceny.sort()
+
+        # Pierwszy - losowany z wagą spośród zmierzonych zdrowych o najwyższym
+        # priorytecie; domyślny czas bez pomiarów nie może odebrać ruchu Gemini
+        niezdrowy, priorytet = oceny[0][0], oceny[0][1]
+        if not niezdrowy:
+            grupa = [o for o in oceny if not o[0] and o[1] == priorytet]
+            zmierzona = [o for o in grupa if o[4] in zmierzeni]
+            if zmierzona:
+                pierwszy = random.choices(zmierzona, weights=[-o[2] for o in zmierzona])[0]
+            else:
+                pierwszy = min(grupa, key=lambda o: o[3])
+            oceny.remove(pierwszy)
+            oceny.insert(0, pierwszy)
+
+        with self._lock:
+            self._dla(oceny[0][4]).wybrany += 1
+        return [(o[4], o[5]) for o in oceny]
+
+    def statystyki(self):
+        """Pomiary kandydatów (bieżącego workera) do endpointu statusu"""
+        with self._lock:
+            return {
+                'enabled': ROUTING_ENABLED,
+                'candidates': {
+                    nazwa: {
+                        'priority': self.priorytety.get(nazwa, 0),
+                        'weight': self.wagi.get(nazwa, 1.0),
+                        'success_rate': round(p.skutecznosc, 3),
+                        'latency': round(p.czas, 3),
+                        'calls': p.wywolania,
+                        'chosen_first': p.wybrany,
+                    }
+                    for nazwa, p in self._pomiary.items()
+                },
+            }
+
+
+router = Router()
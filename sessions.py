@@ -0,0 +1,82 @@
+"""Pamięć rozmowy - historia poprzednich wymian w sesji.
+
+Każda sesja to krótka lista tur [rola, tekst] zapisana jako JSON we wspólnym
+magazynie (store.py), więc kolejne wiadomości mogą trafić do dowolnego workera.
+Dopisanie to jedno atomowe `update` magazynu - dwie równoczesne wiadomości tej
+samej sesji (np. dwie karty) nie nadpisują sobie wymian.
+Sesja wygasa po SESSION_IDLE_TTL sekundach bez aktywności, a historia jest
+przycinana do budżetu HISTORY_TOKEN_BUDGET tokenów - najstarsze wymiany
+wypadają pierwsze.
+"""
+import re
+import secrets
+
+import codec
+import store
+import logs
+from settings import env_int, env_float
+
+log = logs.get('sessions')
+
+SESSION_IDLE_TTL = env_float('SESSION_IDLE_TTL', 1800)
+HISTORY_TOKEN_BUDGET = env_int('HISTORY_TOKEN_BUDGET', 1000)
+HISTORY_MAX_TURNS = env_int('HISTORY_MAX_TURNS', 20)
+
+PREFIKS = 'sess:'
+UZYTKOWNIK = 'user'
+MODEL = 'model'
+
+_POPRAWNY_ID = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def nowy_id():
+    """Losowy identyfikator nowej sesji"""
+    return secrets.token_urlsafe(16)
+
+
+def poprawny_id(session_id):
+    """Zwraca identyfikator z żądania, jeśli ma poprawny format, w przeciwnym razie None"""
+    if isinstance(session_id, str) and _POPRAWNY_ID.match(session_id):
+        return session_id
+    return None
+
+
+def szacuj_tokeny(tekst):
+    """Przybliżona liczba tokenów (~4 znaki na token) - bez ładowania tokenizera"""
+    return len(tekst) // 4 + 1
+
+
+def przytnij(tury, budzet=HISTORY_TOKEN_BUDGET, max_tur=HISTORY_MAX_TURNS):
+    """Usuwa najstarsze wymiany (pytanie + odpowiedź), aż historia zmieści się w budżecie"""
+    tury = tury[-max_tur:] if max_tur else list(tury)
+    lacznie = sum(szacuj_tokeny(tekst) for _, tekst in tury)
+    while tury and lacznie > budzet:
+        lacznie -= szacuj_tokeny(tury.pop(0)[1])
+    # Historia zawsze zaczyna się od pytania użytkownika
+    while tury and tury[0][0] != UZYTKOWNIK:
+        tury.pop(0)
+    return tury
+
+
+def historia(session_id):
+    """Lista tur [rola, tekst] sesji (pusta dla nowej lub wygasłej sesji)"""
+    if not session_id:
+        return []
+    try:
+        wartosc = store.get_store().get(PREFIKS + session_id)
+    except Exception as e:
+        log.warning("Błąd odczytu sesji", extra={"error": str(e)})
+        return []
+    return codec.loads(wartosc) if wartosc else []
+
+
+def dopisz(session_id, pytanie, odpowiedz):
+    """Dopisuje wymianę do sesji i odświeża jej czas życia"""
+    def dopisana(stara):
+        tury = (codec.loads(stara) if stara else []) + [[UZYTKOWNIK, pytanie], [MODEL, odpowiedz]]
+        return codec.dumps(przytnij(tury)), None
+
+    try:
+        store.get_store().update(PREFIKS + session_id, dopisana, SESSION_IDLE_TTL)
+    except Exception as e:
+        log.warning("Błąd zapisu sesji", extra={"error": str(e)})
@@ -0,0 +1,37 @@
+import os
+from dotenv import load_dotenv
+
+# Załaduj zmienne środowiskowe z pliku .env (zanim moduły odczytają konfigurację)
+load_dotenv()
+
+
+def env_str(name, default=None):
+    """Zwraca zmienną środowiskową jako tekst (bez białych znaków)"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip()
+
+
+def env_int(name, default):
+    """Zwraca zmienną środowiskową jako liczbę całkowitą"""
+    try:
+        return int(os.getenv(name, default))
+    except (ValueError, TypeError):
+        return default  # Domyślna wartość jeśli zmienna nie jest liczbą
+
+
+def env_float(name, default):
+    """Zwraca zmienną środowiskową jako liczbę zmiennoprzecinkową"""
+    try:
+        return float(os.getenv(name, default))
+    except (ValueError, TypeError):
+        return default
+
+
+def env_bool(name, default):
+    """Zwraca zmienną środowiskową jako wartość logiczną (true/1/yes/tak)"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('true', '1', 'yes', 'tak')
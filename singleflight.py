@@ -0,0 +1,173 @@
+"""Łączenie identycznych zapytań w toku (single-flight).
+
+Gdy wiele osób naraz wyśle tę samą wiadomość, tylko pierwsze zapytanie
+(lider) woła Gemini/HF, a pozostałe czekają na jego wynik. W obrębie workera
+czekanie to zwykłe threading.Event. Przy SINGLEFLIGHT_SHARED=true lider
+zajmuje też krótką blokadę we wspólnym magazynie (store.add), a zapytania
+z innych workerów odczytują zapisany tam wynik.
+
+Jeśli lider nie skończy w SINGLEFLIGHT_WAIT sekund (najwyżej do terminu
+zapytania - deadline) albo zawiedzie między workerami, oczekujący wykonuje
+zapytanie sam. Gdy termin już minął, nie pyta dostawców - rzuca
+TerminMinalError, bo klient i tak nie czeka już na odpowiedź.
+"""
+import os
+import threading
+import time
+
+import codec
+import deadline
+import logs
+import store
+from settings import env_bool, env_float
+
+log = logs.get('singleflight')
+
+SINGLEFLIGHT_ENABLED = env_bool('SINGLEFLIGHT_ENABLED', True)
+SINGLEFLIGHT_SHARED = env_bool('SINGLEFLIGHT_SHARED', False)
+SINGLEFLIGHT_WAIT = env_float('SINGLEFLIGHT_WAIT', 20)
+SINGLEFLIGHT_POLL = env_float('SINGLEFLIGHT_POLL', 0.05)
+
+PREFIKS_BLOKADY = 'sf:lock:'
+PREFIKS_WYNIKU = 'sf:result:'
+
+# Jak długo wynik lidera czeka w magazynie na zapytania z innych workerów
+CZAS_WYNIKU = 5
+
+
+class TerminMinalError(TimeoutError):
+    """Termin zapytania minął w czasie czekania na lidera"""
+
+
+def _po_terminie():
+    zostalo = deadline.pozostalo()
+    return zostalo is not None and zostalo <= 0
+
+
+class _Lot:
+    """Jedno zapytanie w toku, na które czekają pozostałe"""
+
+    def __init__(self):
+        self.gotowe = threading.Event()
+        self.wynik = None
+        self.blad = None
+
+
+class SingleFlight:
+    def __init__(self, magazyn=None, wspolny=SINGLEFLIGHT_SHARED, czekaj=SINGLEFLIGHT_WAIT):
+        self._magazyn = magazyn
+        self.wspolny = wspolny
+        self.czekaj = czekaj
+
+        self._lock = threading.Lock()
+        self._w_toku = {}
+        self.polaczone = 0
+        self.polaczone_miedzy_workerami = 0
+        self.po_terminie = 0
+
+    @property
+    def magazyn(self):
+        return self._magazyn or store.get_store()
+
+    def wykonaj(self, klucz, funkcja):
+        """Zwraca (wynik funkcji, czy_wspoldzielony) - jedno wywołanie na klucz naraz.
+
+        Wynik musi dać się zapisać jako JSON, jeśli łączenie obejmuje workery.
+        """
+        with self._lock:
+            lot = self._w_toku.get(klucz)
+            lider = lot is None
+            if lider:
+                lot = self._w_toku[klucz] = _Lot()
+
+        if not lider:
+            if lot.gotowe.wait(deadline.przytnij(self.czekaj)):
+                if lot.blad is not None:
+                    raise lot.blad
+                with self._lock:
+                    self.polaczone += 1
+                return lot.wynik, True
+            return self._sam(funkcja), False
+
+        try:
+            if self.wspolny:
+                lot.wynik, wspoldzielony = self._miedzy_workerami(klucz, funkcja)
+            else:
+                lot.wynik, wspoldzielony = funkcja(), False
+            return lot.wynik, wspoldzielony
+        except Exception as e:
+            lot.blad = e
+            raise
+        finally:
+            with self._lock:
+                del self._w_toku[klucz]
+            lot.gotowe.set()
+
+    def _miedzy_workerami(self, klucz, funkcja):
+        try:
+            zajeta = self.magazyn.add(PREFIKS_BLOKADY + klucz, str(os.getpid()), self.czekaj)
+        except Exception as e:
+            log.warning("Błąd magazynu single-flight", extra={"error": str(e)})
+            return funkcja(), False
+
+        if zajeta:
+            try:
+                wynik = funkcja()
+                self._zapisz_wynik(klucz, wynik)
+                return wynik, False
+            finally:
+                self._zwolnij(klucz)
+
+        # Inny worker już pyta - czekamy na jego wynik w magazynie
+        koniec = time.monotonic() + deadline.przytnij(self.czekaj)
+        while time.monotonic() < koniec:
+            try:
+                wartosc = self.magazyn.get(PREFIKS_WYNIKU + klucz)
+                if wartosc is not None:
+                    with self._lock:
+                        self.polaczone_miedzy_workerami += 1
+                    return codec.loads(wartosc), True
+                if self.magazyn.get(PREFIKS_BLOKADY + klucz) is None:
+                    # Lider skończył bez wyniku (błąd) - pytamy sami
+                    break
+            except Exception as e:
+                log.warning("Błąd magazynu single-flight", extra={"error": str(e)})
+                break
+            time.sleep(SINGLEFLIGHT_POLL)
+        return self._sam(funkcja), False
+
+    def _sam(self, funkcja):
+        """Zapytanie bez lidera - chyba że termin już minął"""
+        if _po_terminie():
+            with self._lock:
+                self.po_terminie += 1
+            raise TerminMinalError("Termin zapytania minął w czasie czekania na lidera")
+        log.warning("Lider nie odpowiedział w czasie, pytam sam", extra={"wait": self.czekaj})
+        return funkcja()
+
+    def _zapisz_wynik(self, klucz, wynik):
+        try:
+            self.magazyn.set(PREFIKS_WYNIKU + klucz, codec.dumps(wynik), CZAS_WYNIKU)
+        except Exception as e:
+            log.warning("Błąd magazynu single-flight", extra={"error": str(e)})
+
+    def _zwolnij(self, klucz):
+        try:
+            self.magazyn.delete(PREFIKS_BLOKADY + klucz)
+        except Exception as e:
+            log.warning("Błąd magazynu single-flight", extra={"error": str(e)})
+
+    def statystyki(self):
+        """Liczniki połączonych zapytań (bieżącego workera) do endpointu statusu"""
+        with self._lock:
+            return {
+                'enabled': SINGLEFLIGHT_ENABLED,
+                'shared': self.wspolny,
+                'in_flight': len(self._w_toku),
+                'coalesced': self.polaczone,
+                'coalesced_across_workers': self.polaczone_miedzy_workerami,
+                'expired_waiting': self.po_terminie,
+            }
+
+
+zapytania = SingleFlight()
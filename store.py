@@ -0,0 +1,337 @@
+"""Wspólny magazyn klucz-wartość dla cache odpowiedzi i metadanych dostawców.
+
+Gunicorn uruchamia kilka workerów, a pamięć każdego z nich jest osobna i na
+starcie pusta. Magazyn pozwala wszystkim workerom dzielić te same dane:
+- memory - w pamięci procesu (LRU z limitem wpisów i bajtów), bez współdzielenia
+- sqlite - plik SQLite na dysku (tryb WAL), wspólny dla workerów na jednej maszynie
+  (LRU z limitem wpisów i bajtów)
+- redis - dowolny serwer zgodny z protokołem Redis (wymaga pakietu `redis`)
+
+Wartości to tekst; czas życia (ttl) podawany jest w sekundach. `add` zapisuje
+wartość tylko wtedy, gdy klucza jeszcze nie ma (atomowo - także między
+workerami), więc nadaje się na krótkie blokady. `update` atomowo zamienia
+wartość na wynik funkcji (np. stan kubełka tokenów limitu zapytań).
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import logs
+import threadpool
+from settings import env_str, env_int
+
+log = logs.get('store')
+
+STORE_BACKEND = env_str('STORE_BACKEND', 'sqlite').lower()
+STORE_SQLITE_PATH = env_str('STORE_SQLITE_PATH', '/tmp/chat_domi_store.sqlite3')
+STORE_REDIS_URL = env_str('STORE_REDIS_URL', 'redis://localhost:6379/0')
+# CACHE_MAX_* - nazwy limitów sprzed wspólnego magazynu (zgodność wsteczna)
+STORE_MAX_ENTRIES = env_int('STORE_MAX_ENTRIES', env_int('CACHE_MAX_ENTRIES', 10000))
+STORE_MAX_BYTES = env_int('STORE_MAX_BYTES', env_int('CACHE_MAX_BYTES', 20 * 1024 * 1024))
+
+
+class MemoryStore:
+    """Magazyn w pamięci procesu - LRU z limitem wpisów i bajtów"""
+
+    nazwa = 'memory'
+
+    def __init__(self, max_wpisow=STORE_MAX_ENTRIES, max_bajtow=STORE_MAX_BYTES):
+        self.max_wpisow = max_wpisow
+        self.max_bajtow = max_bajtow
+        self._lock = threading.Lock()
+        self._wpisy = OrderedDict()  # klucz -> (wygasa, wartość, rozmiar)
+        self._bajty = 0
+        self.usuniete = 0
+
+    def get(self, klucz):
+        with self._lock:
+            wpis = self._wpisy.get(klucz)
+            if wpis is None:
+                return None
+            if wpis[0] is not None and wpis[0] < time.time():
+                self._usun(klucz)
+                return None
+            self._wpisy.move_to_end(klucz)
+            return wpis[1]
+
+    def set(self, klucz, wartosc, ttl=None):
+        with self._lock:
+            self._zapisz(klucz, wartosc, ttl)
+
+    def add(self, klucz, wartosc, ttl=None):
+        with self._lock:
+            wpis = self._wpisy.get(klucz)
+            if wpis is not None and (wpis[0] is None or wpis[0] >= time.time()):
+                return False
+            self._zapisz(klucz, wartosc, ttl)
+            return True
+
+    def update(self, klucz, funkcja, ttl=None):
+        with self._lock:
+            wpis = self._wpisy.get(klucz)
+            stara = wpis[1] if wpis is not None and (wpis[0] is None or wpis[0] >= time.time()) else None
+            nowa, wynik = funkcja(stara)
+            self._zapisz(klucz, nowa, ttl)
+            return wynik
+
+    def _zapisz(self, klucz, wartosc, ttl):
+        rozmiar = len(klucz) + len(wartosc.encode('utf-8'))
+        wygasa = time.time() + ttl if ttl else None
+        if klucz in self._wpisy:
+            self._usun(klucz)
+        if rozmiar > self.max_bajtow:
+            return
+        self._wpisy[klucz] = (wygasa, wartosc, rozmiar)
+        self._bajty += rozmiar
+        while self._wpisy and (len(self._wpisy) > self.max_wpisow or self._bajty > self.max_bajtow):
+            self._usun(next(iter(self._wpisy)))
+            self.usuniete += 1
+
+    def delete(self, klucz):
+        with self._lock:
+            if klucz in self._wpisy:
+                self._usun(klucz)
+
+    def _usun(self, klucz):
+        wpis = self._wpisy.pop(klucz)
+        self._bajty -= wpis[2]
+
+    def statystyki(self):
+        with self._lock:
+            return {'backend': self.nazwa, 'entries': len(self._wpisy),
+                    'bytes': self._bajty, 'evictions': self.usuniete}
+
+
+class SQLiteStore:
+    """Magazyn w pliku SQLite - wspólny dla wszystkich workerów na maszynie.
+
+    Ponad limit wpisów lub bajtów usuwane są najdawniej używane wpisy (LRU
+    według czasu ostatniego odczytu lub zapisu). Pod gevent zapytania idą do
+    puli wątków (threadpool), więc czekanie na blokadę pliku nie zatrzymuje workera.
+    """
+
+    nazwa = 'sqlite'
+
+    # Co ile zapisów usuwać wygasłe i nadmiarowe wpisy
+    SPRZATANIE_CO = 200
+    # Odczyt odświeża czas użycia wpisu najwyżej raz na tyle sekund (mniej zapisów)
+    DOKLADNOSC_LRU = 5.0
+
+    def __init__(self, sciezka=STORE_SQLITE_PATH, max_wpisow=STORE_MAX_ENTRIES, max_bajtow=STORE_MAX_BYTES):
+        self.sciezka = sciezka
+        self.max_wpisow = max_wpisow
+        self.max_bajtow = max_bajtow
+        self._lock = threading.Lock()
+        self._polaczenie = None
+        self._pid = None
+        self._zapisy = 0
+        self.usuniete = 0
+        self._wykonaj(self._db)  # Sprawdź od razu, czy plik da się otworzyć
+
+    def _wykonaj(self, funkcja, *args):
+        # Blokada w bieżącym wątku (greenlecie), samo SQLite - w puli wątków pod gevent
+        with self._lock:
+            return threadpool.uruchom(funkcja, *args)
+
+    def _db(self):
+        # Osobne połączenie w każdym procesie (połączenia SQLite nie przeżywają forka)
+        if self._polaczenie is None or self._pid != os.getpid():
+            polaczenie = sqlite3.connect(self.sciezka, timeout=5, isolation_level=None,
+                                         check_same_thread=False)
+            polaczenie.execute('PRAGMA journal_mode=WAL')
+            polaczenie.execute('PRAGMA synchronous=NORMAL')
+            polaczenie.execute(
+                'CREATE TABLE IF NOT EXISTS kv ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, accessed REAL)'
+            )
+            kolumny = {w[1] for w in polaczenie.execute('PRAGMA table_info(kv)')}
+            if 'accessed' not in kolumny:
+                # Plik z wersji bez LRU
+                polaczenie.execute('ALTER TABLE kv ADD COLUMN accessed REAL')
+            polaczenie.execute('CREATE INDEX IF NOT EXISTS kv_expires ON kv(expires)')
+            polaczenie.execute('CREATE INDEX IF NOT EXISTS kv_accessed ON kv(accessed)')
+            self._polaczenie = polaczenie
+            self._pid = os.getpid()
+        return self._polaczenie
+
+    def get(self, klucz):
+        return self._wykonaj(self._get, klucz)
+
+    def _get(self, klucz):
+        db = self._db()
+        teraz = time.time()
+        wiersz = db.execute(
+            'SELECT value, accessed FROM kv WHERE key = ? AND (expires IS NULL OR expires >= ?)',
+            (klucz, teraz)
+        ).fetchone()
+        if wiersz is None:
+            return None
+        if wiersz[1] is None or teraz - wiersz[1] > self.DOKLADNOSC_LRU:
+            db.execute('UPDATE kv SET accessed = ? WHERE key = ?', (teraz, klucz))
+        return wiersz[0]
+
+    def set(self, klucz, wartosc, ttl=None):
+        self._wykonaj(self._set, klucz, wartosc, ttl)
+
+    def _set(self, klucz, wartosc, ttl):
+        teraz = time.time()
+        db = self._db()
+        db.execute('INSERT OR REPLACE INTO kv (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                   (klucz, wartosc, teraz + ttl if ttl else None, teraz))
+        self._po_zapisie(db)
+
+    def add(self, klucz, wartosc, ttl=None):
+        return self._wykonaj(self._add, klucz, wartosc, ttl)
+
+    def _add(self, klucz, wartosc, ttl):
+        teraz = time.time()
+        db = self._db()
+        # Wygasły wpis nie blokuje - INSERT OR IGNORE rozstrzyga wyścig między procesami
+        db.execute('DELETE FROM kv WHERE key = ? AND expires < ?', (klucz, teraz))
+        kursor = db.execute('INSERT OR IGNORE INTO kv (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                            (klucz, wartosc, teraz + ttl if ttl else None, teraz))
+        if kursor.rowcount == 1:
+            self._po_zapisie(db)
+        return kursor.rowcount == 1
+
+    def update(self, klucz, funkcja, ttl=None):
+        return self._wykonaj(self._update, klucz, funkcja, ttl)
+
+    def _update(self, klucz, funkcja, ttl):
+        db = self._db()
+        # BEGIN IMMEDIATE blokuje zapis innym procesom do końca transakcji
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            teraz = time.time()
+            wiersz = db.execute(
+                'SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires >= ?)',
+                (klucz, teraz)
+            ).fetchone()
+            nowa, wynik = funkcja(wiersz[0] if wiersz else None)
+            db.execute('INSERT OR REPLACE INTO kv (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                       (klucz, nowa, teraz + ttl if ttl else None, teraz))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        self._po_zapisie(db)
+        return wynik
+
+    def delete(self, klucz):
+        self._wykonaj(lambda: self._db().execute('DELETE FROM kv WHERE key = ?', (klucz,)))
+
+    def _po_zapisie(self, db):
+        self._zapisy += 1
+        if self._zapisy % self.SPRZATANIE_CO == 0:
+            self._sprzataj(db)
+
+    def _sprzataj(self, db):
+        """Usuwa wygasłe wpisy, a ponad limit wpisów lub bajtów - najdawniej używane"""
+        db.execute('DELETE FROM kv WHERE expires < ?', (time.time(),))
+        wpisy, bajty = db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(length(key) + length(CAST(value AS BLOB))), 0) FROM kv'
+        ).fetchone()
+        if wpisy <= self.max_wpisow and bajty <= self.max_bajtow:
+            return
+        # Wpisy bez czasu życia (np. blokady) nie są usuwane
+        do_usuniecia = []
+        for klucz, rozmiar in db.execute(
+                'SELECT key, length(key) + length(CAST(value AS BLOB)) FROM kv '
+                'WHERE expires IS NOT NULL ORDER BY accessed'):
+            if wpisy <= self.max_wpisow and bajty <= self.max_bajtow:
+                break
+            do_usuniecia.append((klucz,))
+            wpisy -= 1
+            bajty -= rozmiar
+        db.executemany('DELETE FROM kv WHERE key = ?', do_usuniecia)
+        self.usuniete += len(do_usuniecia)
+
+    def statystyki(self):
+        wpisy, bajty = self._wykonaj(lambda: self._db().execute(
+            'SELECT COUNT(*), COALESCE(SUM(length(key) + length(CAST(value AS BLOB))), 0) FROM kv'
+        ).fetchone())
+        return {'backend': self.nazwa, 'path': self.sciezka, 'entries': wpisy,
+                'bytes': bajty, 'evictions': self.usuniete}
+
+
+class RedisStore:
+    """Magazyn na serwerze zgodnym z Redis (wygaszanie i LRU po stronie serwera)"""
+
+    nazwa = 'redis'
+
+    def __init__(self, url=STORE_REDIS_URL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STORE_BACKEND=redis wymaga pakietu 'redis' (pip install redis)")
+        self.url = url
+        self._redis = redis.Redis.from_url(url, decode_responses=True,
+                                           socket_timeout=1, socket_connect_timeout=1)
+
+    def get(self, klucz):
+        return self._redis.get(klucz)
+
+    def set(self, klucz, wartosc, ttl=None):
+        if ttl:
+            self._redis.set(klucz, wartosc, px=int(ttl * 1000))
+        else:
+            self._redis.set(klucz, wartosc)
+
+    def add(self, klucz, wartosc, ttl=None):
+        return bool(self._redis.set(klucz, wartosc, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def update(self, klucz, funkcja, ttl=None):
+        import redis
+        with self._redis.pipeline() as potok:
+            while True:
+                try:
+                    # Optymistycznie: zapis się nie uda, jeśli ktoś zmienił klucz po WATCH
+                    potok.watch(klucz)
+                    nowa, wynik = funkcja(potok.get(klucz))
+                    potok.multi()
+                    potok.set(klucz, nowa, px=int(ttl * 1000) if ttl else None)
+                    potok.execute()
+                    return wynik
+                except redis.WatchError:
+                    continue
+
+    def delete(self, klucz):
+        self._redis.delete(klucz)
+
+    def statystyki(self):
+        return {'backend': self.nazwa, 'entries': self._redis.dbsize()}
+
+
+BACKENDY = {
+    'memory': MemoryStore,
+    'sqlite': SQLiteStore,
+    'redis': RedisStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def utworz(backend=None):
+    """Tworzy magazyn wskazanego typu (domyślnie STORE_BACKEND)"""
+    backend = backend or STORE_BACKEND
+    if backend not in BACKENDY:
+        log.warning("Nieznany STORE_BACKEND, używam memory", extra={"backend": backend})
+        backend = 'memory'
+    return BACKENDY[backend]()
+
+
+def get_store():
+    """Wspólny magazyn aplikacji; przy błędzie konfiguracji - pamięć procesu"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = utworz()
+                except Exception as e:
+                    log.warning("Magazyn niedostępny, używam memory", extra={"backend": STORE_BACKEND, "error": str(e)})
+                    _store = MemoryStore()
+    return _store
@@ -0,0 +1,45 @@
+"""Wspólne ustawienia testów: magazyn w pamięci, bez metryk w plikach i bez prawdziwych API."""
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.mock_upstream import Konfiguracja, MockUpstream, Profil
+
+# Mock Gemini i HF z benchmarku zamiast prawdziwych API, bez opóźnień
+_mock = MockUpstream(Konfiguracja(gemini=Profil(latency_ms=0), hf=Profil(latency_ms=0),
+                                  chunk_delay_ms=0, seed=1)).__enter__()
+
+# Przed importem modułów aplikacji - konfiguracja czytana jest przy imporcie
+os.environ.update({
+    'STORE_BACKEND': 'memory',
+    'METRICS_ENABLED': 'false',
+    'LOG_LEVEL': 'ERROR',
+    'RATE_LIMIT_ENABLED': 'false',
+    'WARMUP_ENABLED': 'false',
+    'PROBE_REFRESH_SECONDS': '0',
+    'RETRY_MAX_ATTEMPTS': '1',
+    'GEMINI_API_KEY': 'test',
+    'GEMINI_API_BASE': _mock.url + '/v1beta',
+    'HF_TOKEN': 'test',
+    'HF_API_URL': _mock.url + '/models/openai-community/gpt2',
+})
+
+
+@pytest.fixture
+def upstream():
+    """Mock dostawców - zmiany konfiguracji w teście są cofane po nim, razem ze
+    stanem breakerów i pomiarami routingu, które te zmiany wywołały"""
+    import circuit_breaker
+    import routing
+
+    stan = copy.deepcopy(vars(_mock.konfiguracja))
+    yield _mock
+    vars(_mock.konfiguracja).update(stan)
+    with circuit_breaker._breakers_lock:
+        circuit_breaker._breakers.clear()
+    with routing.router._lock:
+        routing.router._pomiary.clear()
@@ -0,0 +1,92 @@
+"""Ramki SSE endpointu /chat-stream: fragmenty `data:`, `event: done` i `event: error`."""
+import json
+
+import pytest
+
+import app
+from benchmark.mock_upstream import ODPOWIEDZ
+
+
+@pytest.fixture
+def klient():
+    return app.app.test_client()
+
+
+def _zdarzenia(odpowiedz):
+    """Lista (nazwa, dane) - tak jak readStream w templates/index.html"""
+    assert odpowiedz.mimetype == 'text/event-stream'
+    tresc = odpowiedz.get_data(as_text=True)
+    assert tresc.endswith('\n\n')
+    zdarzenia = []
+    for ramka in tresc[:-2].split('\n\n'):
+        nazwa, dane = 'message', ''
+        for linia in ramka.split('\n'):
+            if linia.startswith('event:'):
+                nazwa = linia[6:].strip()
+            elif linia.startswith('data:'):
+                dane += linia[5:].strip()
+            else:
+                pytest.fail(f"Nieoczekiwana linia SSE: {linia!r}")
+        zdarzenia.append((nazwa, json.loads(dane)))
+    return zdarzenia
+
+
+def _tekst(zdarzenia):
+    return ''.join(dane['text'] for nazwa, dane in zdarzenia if nazwa == 'message')
+
+
+def test_fragmenty_i_done(klient, upstream):
+    odpowiedz = klient.post('/chat-stream', json={'message': 'strumień fragmentami'})
+    assert odpowiedz.status_code == 200
+    assert odpowiedz.headers['Cache-Control'] == 'no-cache'
+
+    zdarzenia = _zdarzenia(odpowiedz)
+    fragmenty = [dane for nazwa, dane in zdarzenia if nazwa == 'message']
+    assert len(fragmenty) == upstream.konfiguracja.stream_chunks
+    assert _tekst(zdarzenia) == ODPOWIEDZ
+
+    nazwa, done = zdarzenia[-1]
+    assert nazwa == 'done'
+    assert set(done) == {'session_id', 'request_id', 'timestamp'}
+    assert done['request_id'] == odpowiedz.headers['X-Request-ID']
+
+
+def test_sesja_z_done_kontynuuje_rozmowe(klient, upstream):
+    pierwsza = _zdarzenia(klient.post('/chat-stream', json={'message': 'pierwsze pytanie'}))
+    session_id = pierwsza[-1][1]['session_id']
+
+    druga = _zdarzenia(klient.post('/chat-stream', json={'message': 'drugie pytanie',
+                                                         'session_id': session_id}))
+    assert druga[-1][0] == 'done'
+    assert druga[-1][1]['session_id'] == session_id
+    assert [tekst for _, tekst in app.sesje.historia(session_id)][:2] == ['pierwsze pytanie', ODPOWIEDZ.strip()]
+
+
+def test_blad_gemini_przed_fragmentami_idzie_do_hf(klient, upstream):
+    upstream.konfiguracja.gemini.error_rate = 1.0
+    hf_przed = upstream.liczniki.wartosci.get('hf', 0)
+
+    zdarzenia = _zdarzenia(klient.post('/chat-stream', json={'message': 'gemini nie działa'}))
+
+    assert [nazwa for nazwa, _ in zdarzenia] == ['message', 'done']
+    assert zdarzenia[0][1]['text']
+    assert upstream.liczniki.wartosci.get('hf', 0) == hf_przed + 1
+
+
+def test_przerwany_strumien_konczy_sie_error_i_done(klient, upstream):
+    upstream.konfiguracja.stream_break_rate = 1.0
+    hf_przed = upstream.liczniki.wartosci.get('hf', 0)
+
+    zdarzenia = _zdarzenia(klient.post('/chat-stream', json={'message': 'urwany strumień'}))
+
+    assert [nazwa for nazwa, _ in zdarzenia] == ['message', 'error', 'done']
+    assert ODPOWIEDZ.startswith(zdarzenia[0][1]['text'])
+    assert zdarzenia[1][1] == {'error': 'Przerwany strumień'}
+    # Część odpowiedzi już dotarła - bez drugiej odpowiedzi z HF
+    assert upstream.liczniki.wartosci.get('hf', 0) == hf_przed
+
+
+def test_pusta_wiadomosc(klient):
+    odpowiedz = klient.post('/chat-stream', json={'message': '  '})
+    assert odpowiedz.status_code == 400
+    assert odpowiedz.get_json() == {'error': 'Pusta wiadomość'}
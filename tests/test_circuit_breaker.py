@@ -0,0 +1,142 @@
+"""Circuit breaker: otwarcie po błędach i wolnych wywołaniach, próba half-open, zamknięcie."""
+import pytest
+
+import app
+import circuit_breaker
+
+
+class Zegar:
+    """Podstawiany moduł time - ręcznie przesuwany czas breakera"""
+
+    def __init__(self):
+        self.teraz = 1000.0
+
+    def monotonic(self):
+        return self.teraz
+
+    def time(self):
+        return self.teraz
+
+
+@pytest.fixture
+def zegar(monkeypatch):
+    zegar = Zegar()
+    monkeypatch.setattr(circuit_breaker, 'time', zegar)
+    return zegar
+
+
+def _breaker(**opcje):
+    ustawienia = dict(okno=60, min_wywolan=4, prog_bledow=0.5, wolne_wywolanie=2.0, czas_otwarcia=30)
+    ustawienia.update(opcje)
+    return circuit_breaker.CircuitBreaker('test', **ustawienia)
+
+
+def _otwarty(zegar):
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.zapisz(False, 0.1)
+    assert breaker.stan()['state'] == circuit_breaker.OTWARTY
+    return breaker
+
+
+def test_otwiera_sie_po_progu_bledow(zegar):
+    breaker = _breaker()
+    breaker.zapisz(True, 0.1)
+    breaker.zapisz(False, 0.1)
+    breaker.zapisz(False, 0.1)
+    # Poniżej min_wywolan obwód zostaje zamknięty mimo 2/3 błędów
+    assert breaker.stan()['state'] == circuit_breaker.ZAMKNIETY
+    breaker.zapisz(True, 0.1)
+    assert breaker.stan()['state'] == circuit_breaker.OTWARTY
+    assert not breaker.pozwol()
+
+
+def test_ponizej_progu_zostaje_zamkniety(zegar):
+    breaker = _breaker()
+    for sukces in (True, True, True, False, True, False):
+        breaker.zapisz(sukces, 0.1)
+    assert breaker.stan()['state'] == circuit_breaker.ZAMKNIETY
+    assert breaker.pozwol()
+
+
+def test_wolne_wywolania_licza_sie_jak_bledy(zegar):
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.zapisz(True, 2.5)
+    assert breaker.stan()['state'] == circuit_breaker.OTWARTY
+
+
+def test_stare_wywolania_wypadaja_z_okna(zegar):
+    breaker = _breaker()
+    for _ in range(3):
+        breaker.zapisz(False, 0.1)
+    zegar.teraz += 61
+    breaker.zapisz(False, 0.1)
+    assert breaker.stan()['calls'] == 1
+    assert breaker.stan()['state'] == circuit_breaker.ZAMKNIETY
+
+
+def test_polotwarty_przepuszcza_jedna_probe(zegar):
+    breaker = _otwarty(zegar)
+    zegar.teraz += 29
+    assert not breaker.pozwol()
+    zegar.teraz += 1
+    assert breaker.pozwol()
+    assert breaker.stan()['state'] == circuit_breaker.POLOTWARTY
+    assert not breaker.pozwol()
+
+
+def test_udana_proba_zamyka(zegar):
+    breaker = _otwarty(zegar)
+    zegar.teraz += 30
+    assert breaker.pozwol()
+    breaker.zapisz(True, 0.1)
+    assert breaker.stan()['state'] == circuit_breaker.ZAMKNIETY
+    assert breaker.stan()['calls'] == 0
+    assert breaker.pozwol()
+
+
+@pytest.mark.parametrize('sukces, opoznienie', [(False, 0.1), (True, 2.5)])
+def test_nieudana_albo_wolna_proba_otwiera_ponownie(zegar, sukces, opoznienie):
+    breaker = _otwarty(zegar)
+    zegar.teraz += 30
+    assert breaker.pozwol()
+    breaker.zapisz(sukces, opoznienie)
+    assert breaker.stan()['state'] == circuit_breaker.OTWARTY
+    assert breaker.stan()['open_for'] == 30
+    assert not breaker.pozwol()
+
+
+def test_proba_bez_wyniku_wygasa(zegar):
+    breaker = _otwarty(zegar)
+    zegar.teraz += 30
+    assert breaker.pozwol()
+    zegar.teraz += 29
+    assert not breaker.pozwol()
+    zegar.teraz += 1
+    assert breaker.pozwol()
+
+
+def test_anulowana_proba_zwalnia_miejsce(zegar):
+    breaker = _otwarty(zegar)
+    zegar.teraz += 30
+    assert breaker.pozwol()
+    breaker.pomin()
+    assert breaker.stan()['state'] == circuit_breaker.POLOTWARTY
+    assert breaker.pozwol()
+
+
+def test_chron_pomija_dostawce_przy_otwartym_obwodzie(upstream):
+    upstream.konfiguracja.gemini.error_rate = 1.0
+    gemini = dict(app.dostawcy_odpowiedzi())['gemini']
+    bledy_przed = upstream.liczniki.wartosci.get('gemini_500', 0)
+
+    for _ in range(circuit_breaker.CB_MIN_CALLS):
+        with pytest.raises(Exception) as e:
+            gemini('obwód')
+        assert not isinstance(e.value, circuit_breaker.ObwodOtwartyError)
+    assert circuit_breaker.get('gemini').stan()['state'] == circuit_breaker.OTWARTY
+
+    with pytest.raises(circuit_breaker.ObwodOtwartyError):
+        gemini('obwód')
+    assert upstream.liczniki.wartosci.get('gemini_500', 0) == bledy_przed + circuit_breaker.CB_MIN_CALLS
@@ -0,0 +1,106 @@
+"""Dispatch: kolejno, hedge i race - wybór zwycięzcy, zapas po błędzie, anulowanie przegranych."""
+import threading
+import time
+
+import pytest
+
+import app
+import circuit_breaker
+import deadline
+import dispatch
+import routing
+
+
+class Dostawca:
+    """Dostawca testowy: odpowiada po `czas` s albo rzuca wyjątek; zapisuje, czy go anulowano"""
+
+    def __init__(self, odpowiedz='ok', czas=0.0, blad=None):
+        self.odpowiedz = odpowiedz
+        self.czas = czas
+        self.blad = blad
+        self.wywolania = 0
+        self.anulowany = threading.Event()
+        self.start = None
+
+    def __call__(self, pytanie):
+        self.wywolania += 1
+        self.start = time.monotonic()
+        if deadline.spij(self.czas):
+            self.anulowany.set()
+            raise deadline.AnulowanoError('anulowano')
+        if self.blad:
+            raise self.blad
+        return f"{self.odpowiedz}: {pytanie}"
+
+
+def test_kolejno_zapas_po_bledzie():
+    pierwszy, drugi = Dostawca(blad=ValueError('nie')), Dostawca('drugi')
+    assert dispatch.uruchom([('a', pierwszy), ('b', drugi)], 'p', tryb='sequential') == ('b', 'drugi: p')
+
+    with pytest.raises(dispatch.BrakOdpowiedziError) as e:
+        dispatch.uruchom([('a', pierwszy), ('c', Dostawca(blad=RuntimeError('też nie')))], 'p',
+                         tryb='sequential')
+    assert 'a: nie' in str(e.value) and 'c: też nie' in str(e.value)
+
+
+def test_kolejno_pomija_po_terminie():
+    drugi = Dostawca('drugi')
+    with deadline.termin(0.05):
+        with pytest.raises(dispatch.BrakOdpowiedziError) as e:
+            dispatch.uruchom([('a', Dostawca(czas=0.1, blad=ValueError('wolny błąd'))), ('b', drugi)], 'p',
+                             tryb='sequential')
+    assert e.value.przekroczono_limit
+    assert drugi.wywolania == 0
+
+
+def test_race_wygrywa_najszybszy_a_reszta_anulowana():
+    wolny, szybki = Dostawca('wolny', czas=5.0), Dostawca('szybki', czas=0.02)
+    start = time.monotonic()
+    assert dispatch.uruchom([('wolny', wolny), ('szybki', szybki)], 'p', tryb='race') == ('szybki', 'szybki: p')
+    assert time.monotonic() - start < 1.0
+    assert wolny.anulowany.wait(1.0)
+    assert not szybki.anulowany.is_set()
+
+
+def test_hedge_drugi_startuje_po_opoznieniu():
+    pierwszy, drugi = Dostawca('pierwszy', czas=5.0), Dostawca('drugi')
+    start = time.monotonic()
+    assert dispatch.uruchom([('a', pierwszy), ('b', drugi)], 'p', tryb='hedge', opoznienie=0.1)[0] == 'b'
+    assert drugi.start - start == pytest.approx(0.1, abs=0.08)
+    assert pierwszy.anulowany.wait(1.0)
+
+
+def test_hedge_szybka_odpowiedz_bez_drugiego_wywolania():
+    pierwszy, drugi = Dostawca('pierwszy', czas=0.01), Dostawca('drugi')
+    assert dispatch.uruchom([('a', pierwszy), ('b', drugi)], 'p', tryb='hedge', opoznienie=0.5)[0] == 'a'
+    assert drugi.wywolania == 0
+
+
+def test_hedge_blad_uruchamia_zapas_od_razu():
+    pierwszy, drugi = Dostawca(blad=ValueError('nie')), Dostawca('drugi')
+    start = time.monotonic()
+    assert dispatch.uruchom([('a', pierwszy), ('b', drugi)], 'p', tryb='hedge', opoznienie=2.0)[0] == 'b'
+    assert time.monotonic() - start < 0.5
+
+
+def test_limit_anuluje_wszystkie():
+    pierwszy, drugi = Dostawca(czas=5.0), Dostawca(czas=5.0)
+    with pytest.raises(dispatch.BrakOdpowiedziError) as e:
+        dispatch.uruchom([('a', pierwszy), ('b', drugi)], 'p', tryb='race', limit=0.1)
+    assert e.value.przekroczono_limit
+    assert pierwszy.anulowany.wait(1.0) and drugi.anulowany.wait(1.0)
+
+
+def test_race_z_mockiem_przegrany_nie_jest_bledem(upstream):
+    # Gemini wolniejsze od HF: wygrywa HF, a anulowane Gemini nie obciąża breakera ani routingu
+    upstream.konfiguracja.gemini.latency_ms = 300
+    upstream.konfiguracja.gemini.sigma = 0
+    gemini_przed = upstream.liczniki.wartosci.get('gemini', 0)
+
+    nazwa, odpowiedz = dispatch.uruchom(app.dostawcy_odpowiedzi(), 'race z mockiem', tryb='race')
+    assert nazwa.startswith('hf') and odpowiedz
+
+    time.sleep(0.5)  # przegrane wywołanie Gemini kończy się w tle
+    assert upstream.liczniki.wartosci.get('gemini', 0) == gemini_przed + 1
+    assert circuit_breaker.get('gemini').stan()['calls'] == 0
+    assert routing.router.statystyki()['candidates']['gemini']['calls'] == 0
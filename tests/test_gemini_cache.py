@@ -0,0 +1,74 @@
+"""Cache kontekstu Gemini: jeden cachedContents dla wszystkich workerów."""
+import time
+
+import pytest
+
+import gemini_cache
+import store
+
+
+@pytest.fixture
+def magazyn(monkeypatch, tmp_path):
+    # Wspólny plik SQLite jak w kilku workerach gunicorna
+    wspolny = store.SQLiteStore(str(tmp_path / 'store.sqlite3'))
+    monkeypatch.setattr(store, 'get_store', lambda: wspolny)
+    monkeypatch.setattr(gemini_cache, 'CZEKANIE_CO', 0.02)
+    return wspolny
+
+
+def _workery(upstream, n):
+    return [gemini_cache.CacheKontekstu(upstream.url + '/v1beta', 'gemini-test', 'klucz', wlaczony=True)
+            for _ in range(n)]
+
+
+def _czekaj_na_nazwy(workery, wersja, limit=3.0):
+    koniec = time.monotonic() + limit
+    while time.monotonic() < koniec:
+        nazwy = [w.nazwa('persona', wersja) for w in workery]
+        if all(nazwy) and not any(w._w_toku for w in workery):
+            return nazwy
+        time.sleep(0.02)
+    pytest.fail(f"Workery nie dostały nazwy cache: {nazwy}")
+
+
+def test_jeden_cache_dla_wszystkich_workerow(upstream, magazyn):
+    upstream.konfiguracja.gemini.latency_ms = 100
+    upstream.konfiguracja.gemini.sigma = 0
+    przed = upstream.liczniki.wartosci.get('cached_contents', 0)
+    workery = _workery(upstream, 4)
+
+    # Pierwsze zapytanie w każdym workerze - bez cache, tworzenie w tle
+    assert [w.nazwa('persona', 'v1') for w in workery] == [None] * 4
+
+    nazwy = _czekaj_na_nazwy(workery, 'v1')
+    assert len(set(nazwy)) == 1
+    assert upstream.liczniki.wartosci.get('cached_contents', 0) == przed + 1
+    assert magazyn.get(gemini_cache.BLOKADA + 'v1') is None
+
+
+def test_nowy_worker_czyta_nazwe_z_magazynu(upstream, magazyn):
+    pierwszy, = _workery(upstream, 1)
+    pierwszy.nazwa('persona', 'v2')
+    nazwa, = _czekaj_na_nazwy([pierwszy], 'v2')
+    przed = upstream.liczniki.wartosci.get('cached_contents', 0)
+
+    drugi, = _workery(upstream, 1)
+    assert drugi.nazwa('persona', 'v2') == nazwa
+    assert upstream.liczniki.wartosci.get('cached_contents', 0) == przed
+
+
+def test_blad_tworzenia_bez_wyscigu_workerow(upstream, magazyn):
+    upstream.konfiguracja.gemini.error_rate = 1.0
+    przed = upstream.liczniki.wartosci.get('cached_contents_500', 0)
+    workery = _workery(upstream, 3)
+    for w in workery:
+        w.nazwa('persona', 'v3')
+
+    koniec = time.monotonic() + 3.0
+    while any(w._w_toku for w in workery) and time.monotonic() < koniec:
+        time.sleep(0.02)
+    assert not any(w._w_toku for w in workery)
+    # Próbuje jeden worker, pozostałe odkładają kolejną próbę
+    assert upstream.liczniki.wartosci.get('cached_contents_500', 0) == przed + 1
+    assert all(w._niedostepny_do > time.time() for w in workery)
+    assert [w.nazwa('persona', 'v3') for w in workery] == [None] * 3
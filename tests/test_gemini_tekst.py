@@ -0,0 +1,60 @@
+"""Szybkie wyciąganie tekstu z odpowiedzi Gemini musi dawać to samo co pełne dekodowanie."""
+import json
+
+import pytest
+
+import app
+
+
+def _odpowiedz(*kandydaci, **pola):
+    return {'candidates': list(kandydaci), **pola}
+
+
+def _kandydat(*czesci, role='model'):
+    return {'content': {'parts': list(czesci), 'role': role}, 'finishReason': 'STOP', 'index': 0}
+
+
+def _warianty(dane):
+    # Kompaktowo, z wcięciami i z polskimi znakami bez escapowania
+    yield json.dumps(dane).encode()
+    yield json.dumps(dane, indent=2).encode()
+    yield json.dumps(dane, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _pelne(dane):
+    return app.wyciagnij_tekst_gemini(dane)
+
+
+@pytest.mark.parametrize('tekst', [
+    'prosty tekst',
+    'z "cudzysłowem" i \\ ukośnikiem \\',
+    'emoji 💃 ąę\nnowa linia',
+    'kończy się ukośnikiem\\\\',
+    '',
+])
+def test_tekst_pierwszego_kandydata(tekst):
+    dane = _odpowiedz(_kandydat({'text': tekst}))
+    for cialo in _warianty(dane):
+        assert app.tekst_odpowiedzi_gemini(cialo) == tekst
+
+
+@pytest.mark.parametrize('dane', [
+    # Zablokowany pierwszy kandydat (bez content), drugi z tekstem
+    _odpowiedz({'finishReason': 'SAFETY', 'index': 0},
+               _kandydat({'text': 'drugi kandydat'})),
+    # Pierwszy kandydat z pustą listą parts
+    _odpowiedz({'content': {'parts': [], 'role': 'model'}, 'finishReason': 'STOP'},
+               _kandydat({'text': 'drugi kandydat'})),
+    # Pierwsza część bez tekstu
+    _odpowiedz(_kandydat({'inlineData': {'mimeType': 'image/png', 'data': ''}}, {'text': 'druga część'})),
+    # Odpowiedź zablokowana na etapie promptu
+    {'promptFeedback': {'blockReason': 'SAFETY'}},
+    # Ostatni fragment strumienia - same metadane
+    {'usageMetadata': {'promptTokenCount': 3}},
+    # Inna kolejność kluczy - tekst nadal z pierwszego kandydata
+    _odpowiedz({'finishReason': 'STOP', 'content': {'role': 'model', 'parts': [{'text': 'po finishReason'}]}},
+               _kandydat({'text': 'drugi kandydat'})),
+])
+def test_inne_ksztalty_jak_pelne_dekodowanie(dane):
+    for cialo in _warianty(dane):
+        assert app.tekst_odpowiedzi_gemini(cialo) == _pelne(dane)
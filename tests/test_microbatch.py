@@ -0,0 +1,163 @@
+"""Mikropaczki: wysłanie po zapełnieniu albo po oknie, błędy elementów, kolejka, termin i anulowanie."""
+import threading
+import time
+
+import pytest
+
+import app
+import deadline
+import microbatch
+
+
+class Wykonanie:
+    """`wykonaj` dla mikropaczek - zapisuje paczki, opcjonalnie czeka na `puszczone`"""
+
+    def __init__(self, czekaj=False, wyniki=None):
+        self.paczki = []
+        self.wyniki = wyniki
+        self.rozpoczete = threading.Event()
+        self.puszczone = threading.Event()
+        if not czekaj:
+            self.puszczone.set()
+
+    def __call__(self, elementy):
+        self.paczki.append(list(elementy))
+        self.rozpoczete.set()
+        self.puszczone.wait(5)
+        if self.wyniki is not None:
+            return self.wyniki(elementy)
+        return [f"wynik {e}" for e in elementy]
+
+
+def _rownolegle(funkcja, wartosci):
+    """Wyniki (albo wyjątki) funkcja(wartość) z osobnych wątków, startujących razem"""
+    wyniki = [None] * len(wartosci)
+    start = threading.Barrier(len(wartosci))
+
+    def watek(i):
+        start.wait()
+        try:
+            wyniki[i] = funkcja(wartosci[i])
+        except Exception as e:
+            wyniki[i] = e
+
+    watki = [threading.Thread(target=watek, args=(i,)) for i in range(len(wartosci))]
+    for w in watki:
+        w.start()
+    for w in watki:
+        w.join()
+    return wyniki
+
+
+def test_pelna_paczka_idzie_bez_czekania_na_okno():
+    wykonaj = Wykonanie()
+    paczki = microbatch.Mikropaczki('test', wykonaj, maks=3, okno_ms=5000)
+    start = time.monotonic()
+    assert _rownolegle(paczki.dodaj, ['a', 'b', 'c']) == ['wynik a', 'wynik b', 'wynik c']
+    assert time.monotonic() - start < 1.0
+    assert [sorted(p) for p in wykonaj.paczki] == [['a', 'b', 'c']]
+    assert paczki.statystyki()['largest'] == 3
+
+
+def test_niepelna_paczka_idzie_po_oknie():
+    wykonaj = Wykonanie()
+    paczki = microbatch.Mikropaczki('test', wykonaj, maks=10, okno_ms=100)
+    start = time.monotonic()
+    assert _rownolegle(paczki.dodaj, ['a', 'b']) == ['wynik a', 'wynik b']
+    assert time.monotonic() - start == pytest.approx(0.1, abs=0.08)
+    assert [sorted(p) for p in wykonaj.paczki] == [['a', 'b']]
+    assert paczki.statystyki()['batches'] == 1
+
+
+def test_blad_na_liscie_trafia_tylko_do_swojego_elementu():
+    def wyniki(elementy):
+        return [ValueError(f"zły {e}") if e == 'zły' else f"wynik {e}" for e in elementy]
+
+    paczki = microbatch.Mikropaczki('test', Wykonanie(wyniki=wyniki), maks=2, okno_ms=1000)
+    dobry, zly = _rownolegle(paczki.dodaj, ['dobry', 'zły'])
+    assert dobry == 'wynik dobry'
+    assert isinstance(zly, ValueError) and str(zly) == 'zły zły'
+
+
+@pytest.mark.parametrize('wyniki, blad', [
+    (lambda elementy: 1 / 0, ZeroDivisionError),
+    (lambda elementy: ['tylko jeden'], ValueError),
+])
+def test_rzucony_blad_albo_zla_dlugosc_trafia_do_wszystkich(wyniki, blad):
+    paczki = microbatch.Mikropaczki('test', Wykonanie(wyniki=wyniki), maks=2, okno_ms=1000)
+    assert all(isinstance(w, blad) for w in _rownolegle(paczki.dodaj, ['a', 'b']))
+
+
+def test_pelna_kolejka_odrzuca():
+    wykonaj = Wykonanie(czekaj=True)
+    paczki = microbatch.Mikropaczki('test', wykonaj, maks=1, okno_ms=0, rownolegle=1, kolejka=1)
+    w_tle = [threading.Thread(target=paczki.dodaj, args=(w,)) for w in ('pierwszy', 'drugi', 'trzeci')]
+    # Pierwszy w paczce w toku, drugi w pętli czeka na wolne miejsce, trzeci w kolejce
+    for w in w_tle:
+        w.start()
+        time.sleep(0.05)
+    with pytest.raises(microbatch.KolejkaPelnaError):
+        paczki.dodaj('czwarty')
+    assert paczki.statystyki()['rejected'] == 1
+
+    wykonaj.puszczone.set()
+    for w in w_tle:
+        w.join()
+    assert wykonaj.paczki == [['pierwszy'], ['drugi'], ['trzeci']]
+
+
+def test_czekanie_w_granicy_terminu():
+    wykonaj = Wykonanie(czekaj=True)
+    paczki = microbatch.Mikropaczki('test', wykonaj, maks=1, okno_ms=0)
+    start = time.monotonic()
+    with deadline.termin(0.1):
+        with pytest.raises(TimeoutError):
+            paczki.dodaj('wolny', limit=10)
+    assert time.monotonic() - start < 0.5
+    wykonaj.puszczone.set()
+
+
+def test_anulowany_element_nie_trafia_do_paczki():
+    wykonaj = Wykonanie(czekaj=True)
+    paczki = microbatch.Mikropaczki('test', wykonaj, maks=1, okno_ms=0, rownolegle=1)
+    w_toku = threading.Thread(target=paczki.dodaj, args=('w toku',))
+    w_toku.start()
+    assert wykonaj.rozpoczete.wait(1)
+
+    sygnal = deadline.Anulowanie()
+    wynik = []
+
+    def anulowany():
+        with deadline.anulowanie(sygnal):
+            try:
+                paczki.dodaj('anulowany')
+            except deadline.AnulowanoError as e:
+                wynik.append(e)
+
+    watek = threading.Thread(target=anulowany)
+    watek.start()
+    time.sleep(0.05)
+    sygnal.anuluj()
+    watek.join(1)
+    assert not watek.is_alive()
+    assert isinstance(wynik[0], deadline.AnulowanoError)
+
+    wykonaj.puszczone.set()
+    w_toku.join()
+    time.sleep(0.05)
+    assert wykonaj.paczki == [['w toku']]
+    assert paczki.statystyki()['items'] == 1
+
+
+def test_rownoczesne_prompty_hf_w_jednym_wywolaniu(upstream, monkeypatch):
+    paczki = microbatch.get('hf:' + app.API_URL, lambda prompty: app.generuj_paczke_hf(prompty, app.API_URL))
+    monkeypatch.setattr(paczki, 'okno', 0.1)
+    hf_przed = upstream.liczniki.wartosci.get('hf', 0)
+    paczki_przed = paczki.statystyki()['batches']
+
+    pytania = [f"pytanie {i}" for i in range(4)]
+    odpowiedzi = _rownolegle(app.generuj_odpowiedz_hf_api, pytania)
+
+    assert all(isinstance(o, str) and o for o in odpowiedzi)
+    assert upstream.liczniki.wartosci.get('hf', 0) == hf_przed + 1
+    assert paczki.statystyki()['batches'] == paczki_przed + 1
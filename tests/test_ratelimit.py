@@ -0,0 +1,169 @@
+"""Limity zapytań: uzupełnianie kubełka, shardy, zwrot tokenów, kolejka przyjmowania."""
+import threading
+import time
+
+import pytest
+
+import app
+import ratelimit
+import store
+
+
+class Zegar:
+    """Podstawiany moduł time - ręcznie przesuwany czas kubełków"""
+
+    def __init__(self):
+        self.teraz = 1000.0
+
+    def time(self):
+        return self.teraz
+
+    def sleep(self, sekundy):
+        self.teraz += sekundy
+
+
+@pytest.fixture
+def zegar(monkeypatch):
+    zegar = Zegar()
+    monkeypatch.setattr(ratelimit, 'time', zegar)
+    return zegar
+
+
+def _kubelek(na_sekunde=1.0, pojemnosc=3, **opcje):
+    return ratelimit.KubelekTokenow('test', na_sekunde, pojemnosc, magazyn=store.MemoryStore(), **opcje)
+
+
+def test_seria_do_pojemnosci_potem_odmowa(zegar):
+    kubelek = _kubelek()
+    assert [kubelek.pobierz() for _ in range(3)] == [0.0, 0.0, 0.0]
+    with pytest.raises(ratelimit.LimitPrzekroczonyError) as e:
+        kubelek.pobierz()
+    assert e.value.retry_after == pytest.approx(1.0)
+
+
+def test_uzupelnianie_w_czasie(zegar):
+    kubelek = _kubelek()
+    for _ in range(3):
+        kubelek.pobierz()
+    zegar.teraz += 2.0
+    kubelek.pobierz()
+    kubelek.pobierz()
+    with pytest.raises(ratelimit.LimitPrzekroczonyError):
+        kubelek.pobierz()
+    # Przerwa nie daje więcej niż pojemność
+    zegar.teraz += 60
+    for _ in range(3):
+        kubelek.pobierz()
+    with pytest.raises(ratelimit.LimitPrzekroczonyError):
+        kubelek.pobierz()
+
+
+def test_czekanie_na_token_w_granicy(zegar):
+    kubelek = _kubelek(na_sekunde=2.0, pojemnosc=1)
+    assert kubelek.pobierz(maks_czekanie=1.0) == 0.0
+    assert kubelek.pobierz(maks_czekanie=1.0) == pytest.approx(0.5)
+    assert kubelek.pobierz(maks_czekanie=1.0) == pytest.approx(1.0)
+    with pytest.raises(ratelimit.LimitPrzekroczonyError):
+        kubelek.pobierz(maks_czekanie=1.0)
+
+
+def test_klucze_klientow_osobno(zegar):
+    kubelek = _kubelek(pojemnosc=1)
+    kubelek.pobierz(klucz='1.1.1.1')
+    kubelek.pobierz(klucz='2.2.2.2')
+    with pytest.raises(ratelimit.LimitPrzekroczonyError):
+        kubelek.pobierz(klucz='1.1.1.1')
+
+
+def test_shardy_zachowuja_laczny_limit(zegar):
+    kubelek = _kubelek(na_sekunde=8.0, pojemnosc=8, shardy=4)
+    przyjete = 0
+    for _ in range(40):
+        try:
+            kubelek.pobierz()
+            przyjete += 1
+        except ratelimit.LimitPrzekroczonyError:
+            pass
+    # Losowy shard i drugi przy odmowie - nie więcej niż łączna pojemność
+    assert 6 <= przyjete <= 8
+    klucze = {k for k in kubelek.magazyn._wpisy if k.startswith(ratelimit.PREFIKS + 'test:')}
+    assert len(klucze) == 4
+
+
+def test_wszystkie_albo_zaden(zegar):
+    pierwszy = _kubelek(pojemnosc=2)
+    drugi = _kubelek(pojemnosc=1)
+    drugi.nazwa = 'drugi'
+    ratelimit.pobierz_wszystkie([(pierwszy, 1, 0.0, ''), (drugi, 1, 0.0, '')])
+    with pytest.raises(ratelimit.LimitPrzekroczonyError) as e:
+        ratelimit.pobierz_wszystkie([(pierwszy, 1, 0.0, ''), (drugi, 1, 0.0, '')])
+    assert e.value.kubelek == 'drugi'
+    # Token pierwszego kubełka został oddany po odmowie drugiego
+    pierwszy.pobierz()
+    with pytest.raises(ratelimit.LimitPrzekroczonyError):
+        pierwszy.pobierz()
+
+
+def test_przyjmowanie_kolejka_i_odmowa():
+    przyjmowanie = ratelimit.Przyjmowanie(maks_rownoczesnie=1, maks_kolejka=1, maks_czekanie=2.0)
+    przyjmowanie.sredni_czas = 0.1
+    przyjmowanie.wejdz()
+
+    wpuszczony = threading.Event()
+
+    def czekajacy():
+        przyjmowanie.wejdz()
+        wpuszczony.set()
+
+    watek = threading.Thread(target=czekajacy)
+    watek.start()
+    while przyjmowanie.statystyki()['queued'] != 1:
+        time.sleep(0.001)
+
+    # Kolejka pełna - od razu odmowa z szacowanym czasem
+    with pytest.raises(ratelimit.LimitPrzekroczonyError):
+        przyjmowanie.wejdz()
+
+    przyjmowanie.wyjdz(0.1)
+    assert wpuszczony.wait(1)
+    watek.join()
+    assert przyjmowanie.statystyki() == {'in_flight': 1, 'queued': 0, 'rejected': 1,
+                                         'avg_service_seconds': pytest.approx(0.1)}
+
+
+def test_przyjmowanie_odmawia_gdy_nie_zdazy():
+    przyjmowanie = ratelimit.Przyjmowanie(maks_rownoczesnie=1, maks_kolejka=10, maks_czekanie=0.5)
+    przyjmowanie.sredni_czas = 2.0
+    przyjmowanie.wejdz()
+    start = time.monotonic()
+    with pytest.raises(ratelimit.LimitPrzekroczonyError):
+        przyjmowanie.wejdz()
+    assert time.monotonic() - start < 0.1
+
+
+@pytest.mark.parametrize('zaufane, hops, naglowek, adres', [
+    (False, 1, '6.6.6.6, 1.2.3.4', '127.0.0.1'),
+    (True, 1, '6.6.6.6, 1.2.3.4', '1.2.3.4'),
+    (True, 2, '6.6.6.6, 1.2.3.4, 10.0.0.1', '1.2.3.4'),
+    (True, 2, '1.2.3.4', '127.0.0.1'),
+])
+def test_adres_klienta(monkeypatch, zaufane, hops, naglowek, adres):
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_TRUST_PROXY', zaufane)
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_PROXY_HOPS', hops)
+    with app.app.test_request_context('/chat', headers={'X-Forwarded-For': naglowek},
+                                      environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+        assert ratelimit.adres_klienta() == adres
+
+
+def test_limit_klienta_na_endpoincie(monkeypatch, upstream):
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(ratelimit, 'klient', ratelimit.KubelekTokenow('client', 1 / 60, 2, magazyn=store.MemoryStore()))
+    monkeypatch.setattr(ratelimit, 'globalny', ratelimit.KubelekTokenow('global', 100, 100, magazyn=store.MemoryStore()))
+    klient = app.app.test_client()
+
+    kody = [klient.post('/chat', json={'message': f'limit {i}'}).status_code for i in range(3)]
+    assert kody == [200, 200, 429]
+    odpowiedz = klient.post('/chat', json={'message': 'limit 3'})
+    assert odpowiedz.status_code == 429
+    assert int(odpowiedz.headers['Retry-After']) >= 1
+    assert ratelimit.przyjmowanie.statystyki()['in_flight'] == 0
@@ -0,0 +1,175 @@
+"""Ponawianie: rozrzut odstępów, podpowiedzi serwera, budżet ponowień, termin i anulowanie."""
+import threading
+import time
+
+import pytest
+import requests
+
+import deadline
+import http_client
+import retry
+
+
+class Zegar:
+    """Podstawiany moduł time - ręcznie przesuwany czas okna budżetu"""
+
+    def __init__(self):
+        self.teraz = 1000.0
+
+    def monotonic(self):
+        return self.teraz
+
+
+@pytest.fixture
+def budzety(monkeypatch):
+    """Świeże budżety ponowień i krótkie odstępy"""
+    monkeypatch.setattr(retry, '_budzety', {})
+    monkeypatch.setattr(retry, 'RETRY_BASE_DELAY', 0.01)
+    monkeypatch.setattr(retry, 'MIN_CZAS_PROBY', 0.1)
+    return retry._budzety
+
+
+def _odpowiedz(status, tresc=b'{}', naglowki=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = tresc
+    response._content_consumed = True
+    response.headers.update(naglowki or {})
+    return response
+
+
+class Serwer:
+    """`wyslij` dla ponawiaj - kolejne statusy z listy, potem ostatni"""
+
+    def __init__(self, *statusy):
+        self.statusy = list(statusy)
+        self.wywolania = 0
+
+    def __call__(self):
+        status = self.statusy[min(self.wywolania, len(self.statusy) - 1)]
+        self.wywolania += 1
+        if isinstance(status, Exception):
+            raise status
+        return _odpowiedz(status, naglowki={'Retry-After': '0'})
+
+
+@pytest.mark.parametrize('proba', [1, 2, 3, 6])
+def test_odstep_w_granicach_pelnego_rozrzutu(monkeypatch, proba):
+    monkeypatch.setattr(retry, 'RETRY_BASE_DELAY', 0.2)
+    monkeypatch.setattr(retry, 'RETRY_MAX_DELAY', 1.0)
+    gorna = min(1.0, 0.2 * 2 ** proba)
+    odstepy = [retry.odstep(proba) for _ in range(500)]
+    assert all(0 <= o <= gorna for o in odstepy)
+    # Pełny rozrzut - wartości z całego przedziału, nie skupione przy górnej granicy
+    assert min(odstepy) < gorna * 0.1 and max(odstepy) > gorna * 0.9
+
+
+def test_odstep_z_podpowiedzia_serwera(monkeypatch):
+    monkeypatch.setattr(retry, 'RETRY_BASE_DELAY', 0.2)
+    odstepy = [retry.odstep(1, podpowiedz=3.0) for _ in range(200)]
+    assert all(3.0 <= o <= 3.2 for o in odstepy)
+
+
+@pytest.mark.parametrize('odpowiedz, oczekiwana', [
+    (_odpowiedz(429, naglowki={'Retry-After': '7'}), 7.0),
+    (_odpowiedz(429, naglowki={'Retry-After': '-1'}), 0.0),
+    (_odpowiedz(503, b'{"error": "Model is currently loading", "estimated_time": 20.5}'), 20.5),
+    (_odpowiedz(503, b'<html>Service Unavailable</html>'), None),
+    (_odpowiedz(500), None),
+])
+def test_podpowiedz_serwera(odpowiedz, oczekiwana):
+    assert retry.podpowiedz_serwera(odpowiedz) == oczekiwana
+
+
+def test_podpowiedz_serwera_jako_data():
+    data = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 30))
+    assert retry.podpowiedz_serwera(_odpowiedz(429, naglowki={'Retry-After': data})) == pytest.approx(30, abs=2)
+
+
+def test_budzet_minimum_i_udzial(monkeypatch):
+    zegar = Zegar()
+    monkeypatch.setattr(retry, 'time', zegar)
+    budzet = retry.BudzetPonowien(udzial=0.2, minimum=3, okno=10)
+    for _ in range(10):
+        budzet.wywolanie()
+    assert [budzet.pozwol() for _ in range(4)] == [True, True, True, False]
+
+    # Więcej wywołań w oknie - większy budżet (20% z 25)
+    for _ in range(15):
+        budzet.wywolanie()
+    assert [budzet.pozwol() for _ in range(3)] == [True, True, False]
+    assert budzet.stan() == {'calls': 25, 'retries': 5}
+
+    # Po oknie liczniki zaczynają od zera
+    zegar.teraz += 11
+    assert budzet.stan() == {'calls': 0, 'retries': 0}
+    assert budzet.pozwol()
+
+
+def test_ponawia_do_sukcesu(budzety):
+    serwer = Serwer(503, 429, 200)
+    assert retry.ponawiaj('test', serwer, maks_prob=3).status_code == 200
+    assert serwer.wywolania == 3
+
+
+def test_bez_ponowien_dla_innych_statusow(budzety):
+    serwer = Serwer(400)
+    assert retry.ponawiaj('test', serwer, maks_prob=3).status_code == 400
+    assert serwer.wywolania == 1
+
+
+def test_ostatnia_proba_oddaje_odpowiedz_albo_blad(budzety):
+    assert retry.ponawiaj('test', Serwer(500), maks_prob=2).status_code == 500
+    with pytest.raises(requests.exceptions.ConnectionError):
+        retry.ponawiaj('test', Serwer(requests.exceptions.ConnectionError('zerwane')), maks_prob=2)
+
+
+def test_wyczerpany_budzet_konczy_ponowienia(budzety):
+    # Awaria dostawcy: minimum 3 ponowienia w oknie, potem pojedyncze wywołania
+    serwery = [Serwer(503) for _ in range(3)]
+    for serwer in serwery:
+        assert retry.ponawiaj('test', serwer, maks_prob=3).status_code == 503
+    assert [s.wywolania for s in serwery] == [3, 2, 1]
+    assert retry.statystyki()['test'] == {'calls': 3, 'retries': 3}
+
+
+def test_ponowienie_nie_miesci_sie_przed_terminem(budzety):
+    serwer = Serwer(503)
+    with deadline.termin(0.05):
+        assert retry.ponawiaj('test', serwer, maks_prob=3).status_code == 503
+    assert serwer.wywolania == 1
+
+
+def test_anulowane_wywolanie_nie_jest_ponawiane(budzety, monkeypatch):
+    monkeypatch.setattr(retry, 'odstep', lambda proba, podpowiedz=None: 5.0)
+    sygnal = deadline.Anulowanie()
+    serwer = Serwer(503)
+    wynik = []
+
+    def wywolanie():
+        with deadline.anulowanie(sygnal):
+            wynik.append(retry.ponawiaj('test', serwer, maks_prob=3))
+
+    watek = threading.Thread(target=wywolanie)
+    start = time.monotonic()
+    watek.start()
+    # Pierwsza odpowiedź przyszła, ponowienie czeka 5 s - anulowanie kończy odstęp od razu
+    time.sleep(0.1)
+    sygnal.anuluj()
+    watek.join(1)
+    assert not watek.is_alive()
+    assert time.monotonic() - start < 1.0
+    assert serwer.wywolania == 1
+    assert wynik[0].status_code == 503
+
+
+def test_ponawia_429_z_mocka(upstream, budzety):
+    upstream.konfiguracja.gemini.rate_429 = 1.0
+    upstream.konfiguracja.gemini.retry_after = 0
+    przed = upstream.liczniki.wartosci.get('gemini_429', 0)
+    url = f"{upstream.url}/v1beta/models/gemini-test:generateContent"
+
+    response = retry.ponawiaj('test', lambda: http_client.post(url, json={}, timeout=5), maks_prob=3)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '0'
+    assert upstream.liczniki.wartosci.get('gemini_429', 0) == przed + 3
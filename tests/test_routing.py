@@ -0,0 +1,98 @@
+"""Routing: kolejność według EWMA czasu i skuteczności, priorytety i start bez pomiarów."""
+import collections
+import random
+
+import pytest
+
+import app
+import circuit_breaker
+import routing
+
+DOSTAWCY = [('gemini', None), ('hf', None), ('hf:distilgpt2', None)]
+
+
+@pytest.fixture
+def router(upstream):
+    # upstream - po teście czyści breakery, których routing używa do oceny zdrowia
+    random.seed(1)
+    return routing.Router()
+
+
+def _pierwsi(router, n=400):
+    return collections.Counter(router.kolejnosc(DOSTAWCY)[0][0] for _ in range(n))
+
+
+def test_bez_pomiarow_kolejnosc_konfiguracji(router):
+    assert _pierwsi(router) == {'gemini': 400}
+    assert [nazwa for nazwa, _ in router.kolejnosc(DOSTAWCY)] == ['gemini', 'hf', 'hf:distilgpt2']
+
+
+def test_niezmierzony_kandydat_nie_odbiera_ruchu(router):
+    # Wolne Gemini z pomiarem nadal wygrywa z domyślnym czasem HF
+    router.zapisz('gemini', True, 5.0)
+    assert _pierwsi(router) == {'gemini': 400}
+    assert [nazwa for nazwa, _ in router.kolejnosc(DOSTAWCY)][1:] == ['hf', 'hf:distilgpt2']
+
+
+def test_najszybszy_dostaje_najwiecej_ruchu(router):
+    for _ in range(20):
+        router.zapisz('gemini', True, 1.0)
+        router.zapisz('hf', True, 0.1)
+    pierwsi = _pierwsi(router)
+    assert pierwsi['hf'] > 300
+    assert pierwsi['gemini'] > 0
+    assert 'hf:distilgpt2' not in pierwsi
+
+
+def test_ewma_czasu_i_skutecznosci(router):
+    router.zapisz('hf', True, 1.0)
+    pomiary = router._pomiary['hf']
+    assert pomiary.czas == pytest.approx(routing.ROUTING_DEFAULT_LATENCY + router.alfa * (1.0 - routing.ROUTING_DEFAULT_LATENCY))
+    router.zapisz('hf', False, 9.0)
+    # Błąd obniża skuteczność, ale nie zmienia średniego czasu udanej odpowiedzi
+    assert pomiary.czas == pytest.approx(routing.ROUTING_DEFAULT_LATENCY + router.alfa * (1.0 - routing.ROUTING_DEFAULT_LATENCY))
+    assert pomiary.skutecznosc == pytest.approx(1 - router.alfa, abs=0.01)
+
+
+def test_niezdrowy_na_koncu_i_powrot_skutecznosci(router):
+    router.zapisz('gemini', True, 0.1)
+    for _ in range(10):
+        router.zapisz('gemini', False, 0.1)
+    assert router.kolejnosc(DOSTAWCY)[-1][0] == 'gemini'
+
+    # Bez nowych wywołań skuteczność wraca do 1
+    router._pomiary['gemini'].ostatnio -= 10 * routing.ROUTING_RECOVERY_SECONDS
+    assert router.kolejnosc(DOSTAWCY)[0][0] == 'gemini'
+
+
+def test_otwarty_obwod_na_koncu(router):
+    breaker = circuit_breaker.get('gemini')
+    for _ in range(breaker.min_wywolan):
+        breaker.zapisz(False, 0.1)
+    assert [nazwa for nazwa, _ in router.kolejnosc(DOSTAWCY)] == ['hf', 'hf:distilgpt2', 'gemini']
+
+
+def test_priorytety_i_wagi(upstream):
+    router = routing.Router(priorytety='gemini=0,hf=1,hf:distilgpt2=1', wagi='hf=0')
+    for _ in range(20):
+        router.zapisz('gemini', True, 2.0)
+        router.zapisz('hf', True, 0.1)
+        router.zapisz('hf:distilgpt2', True, 1.0)
+    assert _pierwsi(router) == {'gemini': 400}
+    # W grupie zapasowej waga 0 spycha hf za wolniejszy model
+    assert [nazwa for nazwa, _ in router.kolejnosc(DOSTAWCY)] == ['gemini', 'hf:distilgpt2', 'hf']
+
+
+def test_ruch_odplywa_od_bledow_gemini(upstream):
+    random.seed(1)
+    klient = app.app.test_client()
+    upstream.konfiguracja.gemini.error_rate = 1.0
+    hf_przed = upstream.liczniki.wartosci.get('hf', 0)
+    for i in range(12):
+        assert klient.post('/chat', json={'message': f'routing błędy {i}'}).status_code == 200
+
+    # Każda odpowiedź z HF, a Gemini po pierwszych błędach rzadko jest pierwsze
+    assert upstream.liczniki.wartosci.get('hf', 0) - hf_przed == 12
+    kandydaci = routing.router.statystyki()['candidates']
+    assert kandydaci['gemini']['calls'] <= 6
+    assert kandydaci['hf']['chosen_first'] >= 6
@@ -0,0 +1,58 @@
+"""Sesje: dopisywanie wymian, przycinanie historii i równoczesne wiadomości."""
+import threading
+import time
+
+import pytest
+
+import sessions
+import store
+
+
+class WolnyOdczyt(store.MemoryStore):
+    """Magazyn z opóźnionym odczytem - szersze okno wyścigu odczyt-zapis"""
+
+    def get(self, klucz):
+        wartosc = super().get(klucz)
+        time.sleep(0.01)
+        return wartosc
+
+
+@pytest.fixture
+def magazyn(monkeypatch):
+    magazyn = WolnyOdczyt()
+    monkeypatch.setattr(store, 'get_store', lambda: magazyn)
+    return magazyn
+
+
+def test_dopisz_i_historia(magazyn):
+    session_id = sessions.nowy_id()
+    assert sessions.historia(session_id) == []
+    sessions.dopisz(session_id, 'pytanie', 'odpowiedź')
+    sessions.dopisz(session_id, 'drugie', 'druga')
+    assert sessions.historia(session_id) == [['user', 'pytanie'], ['model', 'odpowiedź'],
+                                             ['user', 'drugie'], ['model', 'druga']]
+
+
+def test_przytnij_usuwa_najstarsze_wymiany():
+    tury = [['user', 'a' * 40], ['model', 'b' * 40], ['user', 'c'], ['model', 'd']]
+    assert sessions.przytnij(tury, budzet=15) == [['user', 'c'], ['model', 'd']]
+    assert sessions.przytnij(tury, budzet=1000, max_tur=3) == [['user', 'c'], ['model', 'd']]
+
+
+def test_rownoczesne_dopisywanie_nie_gubi_wymian(magazyn):
+    session_id = sessions.nowy_id()
+    start = threading.Barrier(2)
+
+    def karta(nazwa):
+        start.wait()
+        for i in range(5):
+            sessions.dopisz(session_id, f"{nazwa} {i}", 'ok')
+
+    watki = [threading.Thread(target=karta, args=(nazwa,)) for nazwa in ('pierwsza', 'druga')]
+    for w in watki:
+        w.start()
+    for w in watki:
+        w.join()
+
+    pytania = [tekst for rola, tekst in sessions.historia(session_id) if rola == sessions.UZYTKOWNIK]
+    assert sorted(pytania) == sorted(f"{nazwa} {i}" for nazwa in ('pierwsza', 'druga') for i in range(5))
@@ -0,0 +1,157 @@
+"""Single-flight: lider i oczekujący, błędy lidera, czekanie w granicy terminu, łączenie między workerami."""
+import threading
+import time
+
+import pytest
+
+import app
+import deadline
+import singleflight
+import store
+
+
+class Wywolanie:
+    """Funkcja lidera: czeka na `puszczone`, liczy wywołania"""
+
+    def __init__(self, wynik='odpowiedź', blad=None):
+        self.wynik = wynik
+        self.blad = blad
+        self.wywolania = 0
+        self.rozpoczete = threading.Event()
+        self.puszczone = threading.Event()
+
+    def __call__(self):
+        self.wywolania += 1
+        self.rozpoczete.set()
+        self.puszczone.wait(5)
+        if self.blad:
+            raise self.blad
+        return self.wynik
+
+
+def _rownolegle(funkcja, n):
+    """Wyniki (albo wyjątki) `funkcja()` z n wątków"""
+    wyniki = [None] * n
+
+    def watek(i):
+        try:
+            wyniki[i] = funkcja()
+        except Exception as e:
+            wyniki[i] = e
+
+    watki = [threading.Thread(target=watek, args=(i,)) for i in range(n)]
+    for w in watki:
+        w.start()
+    return watki, wyniki
+
+
+def _czekaj_na_oczekujacych():
+    # Oczekujący nie mają własnego licznika - chwila na dołączenie do lotu lidera
+    time.sleep(0.05)
+
+
+def test_oczekujacy_dostaja_wynik_lidera():
+    lot = singleflight.SingleFlight(wspolny=False, czekaj=5)
+    funkcja = Wywolanie()
+    watki, wyniki = _rownolegle(lambda: lot.wykonaj('k', funkcja), 5)
+    assert funkcja.rozpoczete.wait(1)
+    _czekaj_na_oczekujacych()
+    funkcja.puszczone.set()
+    for w in watki:
+        w.join()
+
+    assert funkcja.wywolania == 1
+    assert sorted(wyniki, key=lambda w: w[1]) == [('odpowiedź', False)] + [('odpowiedź', True)] * 4
+    assert lot.statystyki()['coalesced'] == 4
+    assert lot.statystyki()['in_flight'] == 0
+
+
+def test_blad_lidera_trafia_do_oczekujacych():
+    lot = singleflight.SingleFlight(wspolny=False, czekaj=5)
+    funkcja = Wywolanie(blad=ValueError('dostawcy nie odpowiedzieli'))
+    watki, wyniki = _rownolegle(lambda: lot.wykonaj('k', funkcja), 3)
+    assert funkcja.rozpoczete.wait(1)
+    _czekaj_na_oczekujacych()
+    funkcja.puszczone.set()
+    for w in watki:
+        w.join()
+
+    assert funkcja.wywolania == 1
+    assert all(isinstance(w, ValueError) for w in wyniki)
+    # Następne zapytanie po błędzie jest nowym liderem
+    assert lot.wykonaj('k', lambda: 'znowu') == ('znowu', False)
+
+
+def test_oczekujacy_pyta_sam_po_czasie_czekania():
+    lot = singleflight.SingleFlight(wspolny=False, czekaj=0.1)
+    lider = Wywolanie('lider')
+    watki, _ = _rownolegle(lambda: lot.wykonaj('k', lider), 1)
+    assert lider.rozpoczete.wait(1)
+
+    start = time.monotonic()
+    assert lot.wykonaj('k', lambda: 'sam') == ('sam', False)
+    assert time.monotonic() - start == pytest.approx(0.1, abs=0.08)
+    lider.puszczone.set()
+    watki[0].join()
+
+
+def test_czekanie_ograniczone_terminem_zapytania():
+    lot = singleflight.SingleFlight(wspolny=False, czekaj=20)
+    lider = Wywolanie('lider')
+    watki, _ = _rownolegle(lambda: lot.wykonaj('k', lider), 1)
+    assert lider.rozpoczete.wait(1)
+
+    wywolane = []
+    start = time.monotonic()
+    with deadline.termin(0.1):
+        with pytest.raises(singleflight.TerminMinalError):
+            lot.wykonaj('k', lambda: wywolane.append(1))
+    assert time.monotonic() - start < 0.5
+    # Po terminie oczekujący nie pyta już dostawców
+    assert wywolane == []
+    assert lot.statystyki()['expired_waiting'] == 1
+    lider.puszczone.set()
+    watki[0].join()
+
+
+def test_laczenie_miedzy_workerami(tmp_path, monkeypatch):
+    monkeypatch.setattr(singleflight, 'SINGLEFLIGHT_POLL', 0.01)
+    wspolny = store.SQLiteStore(str(tmp_path / 'store.sqlite3'))
+    pierwszy = singleflight.SingleFlight(magazyn=wspolny, wspolny=True, czekaj=5)
+    drugi = singleflight.SingleFlight(magazyn=wspolny, wspolny=True, czekaj=5)
+    lider = Wywolanie(['odpowiedź', 'gemini'])
+    watki, wyniki = _rownolegle(lambda: pierwszy.wykonaj('k', lider), 1)
+    assert lider.rozpoczete.wait(1)
+
+    inny = Wywolanie()
+    watki_drugiego, wyniki_drugiego = _rownolegle(lambda: drugi.wykonaj('k', inny), 1)
+    time.sleep(0.05)
+    lider.puszczone.set()
+    for w in watki + watki_drugiego:
+        w.join()
+
+    assert wyniki == [(['odpowiedź', 'gemini'], False)]
+    assert wyniki_drugiego == [(['odpowiedź', 'gemini'], True)]
+    assert inny.wywolania == 0
+    assert drugi.statystyki()['coalesced_across_workers'] == 1
+    assert wspolny.get(singleflight.PREFIKS_BLOKADY + 'k') is None
+
+
+def test_identyczne_wiadomosci_jedno_wywolanie_dostawcy(upstream, monkeypatch):
+    monkeypatch.setattr(app.cache, 'CACHE_ENABLED', False)
+    upstream.konfiguracja.gemini.latency_ms = 200
+    upstream.konfiguracja.gemini.sigma = 0
+    gemini_przed = upstream.liczniki.wartosci.get('gemini', 0)
+    polaczone_przed = singleflight.zapytania.statystyki()['coalesced']
+
+    def wyslij():
+        return app.app.test_client().post('/chat', json={'message': 'to samo pytanie naraz'})
+
+    watki, wyniki = _rownolegle(wyslij, 4)
+    for w in watki:
+        w.join()
+
+    assert [w.status_code for w in wyniki] == [200] * 4
+    assert len({w.get_json()['response'] for w in wyniki}) == 1
+    assert upstream.liczniki.wartosci.get('gemini', 0) == gemini_przed + 1
+    assert singleflight.zapytania.statystyki()['coalesced'] == polaczone_przed + 3
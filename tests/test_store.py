@@ -0,0 +1,159 @@
+"""Magazyny memory i sqlite: atomowe update, czas życia i usuwanie ponad limit (LRU)."""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import store
+
+
+def _sqlite(sciezka, **limity):
+    magazyn = store.SQLiteStore(str(sciezka), **limity)
+    # Sprzątanie po każdym zapisie i odświeżanie czasu użycia przy każdym odczycie
+    magazyn.SPRZATANIE_CO = 1
+    magazyn.DOKLADNOSC_LRU = 0
+    return magazyn
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def utworz(request, tmp_path):
+    """Fabryka magazynu wybranego backendu z podanymi limitami"""
+    def fabryka(**limity):
+        if request.param == 'memory':
+            return store.MemoryStore(**limity)
+        return _sqlite(tmp_path / 'store.sqlite3', **limity)
+    return fabryka
+
+
+def _dopisz(znak):
+    def funkcja(stara):
+        nowa = (stara or '') + znak
+        return nowa, len(nowa)
+    return funkcja
+
+
+def test_update_pustego_klucza(utworz):
+    magazyn = utworz()
+    assert magazyn.update('k', _dopisz('a')) == 1
+    assert magazyn.update('k', _dopisz('b')) == 2
+    assert magazyn.get('k') == 'ab'
+
+
+def test_update_wygaslej_wartosci_zaczyna_od_nowa(utworz):
+    magazyn = utworz()
+    magazyn.set('k', 'stare', ttl=0.01)
+    time.sleep(0.05)
+    assert magazyn.update('k', _dopisz('a'), ttl=60) == 1
+    assert magazyn.get('k') == 'a'
+
+
+def test_update_z_bledem_nie_zmienia_wartosci(utworz):
+    magazyn = utworz()
+    magazyn.set('k', 'bez zmian')
+
+    def blad(stara):
+        raise ValueError('nie')
+
+    with pytest.raises(ValueError):
+        magazyn.update('k', blad)
+    assert magazyn.get('k') == 'bez zmian'
+
+
+def test_update_atomowe_miedzy_watkami(utworz):
+    magazyn = utworz()
+
+    def zwieksz(stara):
+        nowa = int(stara or 0) + 1
+        return str(nowa), nowa
+
+    def watek():
+        for _ in range(50):
+            magazyn.update('licznik', zwieksz)
+
+    watki = [threading.Thread(target=watek) for _ in range(4)]
+    for w in watki:
+        w.start()
+    for w in watki:
+        w.join()
+    assert magazyn.get('licznik') == '200'
+
+
+def test_lru_zostawia_ostatnio_uzywany(utworz):
+    magazyn = utworz(max_wpisow=3)
+    for klucz in 'abc':
+        magazyn.set(klucz, klucz, ttl=60)
+        time.sleep(0.01)
+    assert magazyn.get('a') == 'a'
+    magazyn.set('d', 'd', ttl=60)
+
+    assert magazyn.get('b') is None
+    assert [magazyn.get(k) for k in 'acd'] == ['a', 'c', 'd']
+    assert magazyn.statystyki()['evictions'] == 1
+
+
+def test_lru_update_odswieza_uzycie(utworz):
+    magazyn = utworz(max_wpisow=2)
+    magazyn.set('sesja', '', ttl=60)
+    time.sleep(0.01)
+    magazyn.set('inna', 'x', ttl=60)
+    time.sleep(0.01)
+    magazyn.update('sesja', _dopisz('a'), ttl=60)
+    magazyn.set('nowa', 'y', ttl=60)
+
+    assert magazyn.get('inna') is None
+    assert magazyn.get('sesja') == 'a'
+
+
+def test_limit_bajtow(utworz):
+    magazyn = utworz(max_bajtow=100)
+    for klucz in 'abcd':
+        magazyn.set(klucz, 'x' * 30, ttl=60)
+        time.sleep(0.01)
+
+    statystyki = magazyn.statystyki()
+    assert statystyki['bytes'] <= 100
+    assert statystyki['entries'] == 3
+    assert magazyn.get('a') is None
+    assert magazyn.get('d') == 'x' * 30
+
+
+def test_sqlite_nie_usuwa_wpisow_bez_czasu_zycia(tmp_path):
+    magazyn = _sqlite(tmp_path / 'store.sqlite3', max_wpisow=2)
+    magazyn.set('blokada', '1')
+    for klucz in 'abc':
+        magazyn.set(klucz, klucz, ttl=60)
+        time.sleep(0.01)
+
+    assert magazyn.get('blokada') == '1'
+    assert magazyn.get('c') == 'c'
+
+
+def test_sqlite_wspolny_plik_dla_wielu_procesow(tmp_path):
+    # Dwa magazyny na jednym pliku zachowują się jak dwa workery
+    pierwszy = _sqlite(tmp_path / 'store.sqlite3')
+    drugi = _sqlite(tmp_path / 'store.sqlite3')
+    pierwszy.update('k', _dopisz('a'))
+    assert drugi.update('k', _dopisz('b')) == 2
+    assert pierwszy.get('k') == 'ab'
+    assert drugi.add('blokada', '1', ttl=60)
+    assert not pierwszy.add('blokada', '2', ttl=60)
+
+
+def test_sqlite_plik_bez_kolumny_accessed(tmp_path):
+    sciezka = tmp_path / 'stary.sqlite3'
+    db = sqlite3.connect(sciezka)
+    db.execute('CREATE TABLE kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+    db.executemany('INSERT INTO kv VALUES (?, ?, ?)',
+                   [('stary', 'wartość', time.time() + 60), ('drugi', 'x', time.time() + 60)])
+    db.commit()
+    db.close()
+
+    magazyn = _sqlite(sciezka, max_wpisow=2)
+    assert magazyn.get('stary') == 'wartość'
+    magazyn.set('nowy', 'y', ttl=60)
+
+    # Wpis bez czasu użycia jest najdawniej używany
+    assert magazyn.get('drugi') is None
+    assert magazyn.get('stary') == 'wartość'
+    assert magazyn.get('nowy') == 'y'
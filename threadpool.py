@@ -0,0 +1,23 @@
+"""Blokujące wywołania poza pętlą gevent.
+
+Pod workerem gevent gniazda są kooperacyjne, ale SQLite (czekanie na blokadę
+pliku) i obliczenia modelu blokują cały proces - wszystkie zapytania workera
+stoją. `uruchom` wykonuje taką funkcję w puli prawdziwych wątków huba gevent
+i czeka na wynik bez blokowania pętli; bez gevent woła funkcję bezpośrednio.
+"""
+
+
+def _gevent_aktywny():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def uruchom(funkcja, *args):
+    """Wynik `funkcja(*args)` - pod gevent z puli wątków huba, inaczej bezpośrednio"""
+    if _gevent_aktywny():
+        import gevent
+        return gevent.get_hub().threadpool.apply(funkcja, args)
+    return funkcja(*args)
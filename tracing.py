@@ -0,0 +1,227 @@
+"""Lekkie śledzenie zapytań (spany) od /chat przez dostawców do wywołań HTTP.
+
+Ślad zaczyna się w endpoincie czatu, który nadaje zapytaniu identyfikator
+(X-Request-ID). Kolejne spany - generowanie odpowiedzi, wywołanie dostawcy,
+budowanie treści, zapytanie HTTP, parsowanie JSON - dołączają się do bieżącego
+spanu przez contextvars, więc funkcje pośrednie nie muszą go przekazywać
+(dispatch przenosi kontekst do swoich wątków).
+
+Próbkowanie decyduje raz na zapytanie (TRACE_SAMPLE_RATE); dla
+niespróbkowanych zapytań span() zwraca wspólny pusty obiekt, więc koszt przy
+pełnym ruchu to jedno odczytanie contextvar. Zakończone spany trafiają do
+kolejki, a osobny wątek zapisuje je paczkami:
+- TRACE_EXPORT=file - linie JSON w TRACE_FILE
+- TRACE_EXPORT=otlp - OTLP/HTTP JSON do kolektora pod TRACE_OTLP_ENDPOINT
+"""
+import contextvars
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+
+import codec
+import logs
+from settings import env_str, env_int, env_float
+
+log = logs.get('tracing')
+
+TRACE_SAMPLE_RATE = env_float('TRACE_SAMPLE_RATE', 0.0)
+TRACE_EXPORT = env_str('TRACE_EXPORT', 'file').lower()
+TRACE_FILE = env_str('TRACE_FILE', '/tmp/chat_domi_traces.jsonl')
+TRACE_OTLP_ENDPOINT = env_str('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_QUEUE_SIZE = env_int('TRACE_QUEUE_SIZE', 10000)
+TRACE_BATCH_SIZE = env_int('TRACE_BATCH_SIZE', 200)
+TRACE_FLUSH_SECONDS = env_float('TRACE_FLUSH_SECONDS', 2)
+
+NAZWA_USLUGI = 'chat_domi'
+
+_POPRAWNY_ID = re.compile(r'^[A-Za-z0-9_.-]{8,64}$')
+
+_biezacy = contextvars.ContextVar('tracing_span', default=None)
+
+_lock = threading.Lock()
+_kolejka = None
+_kolejka_pid = None
+pominiete = 0
+
+
+def nowy_request_id(naglowek=None):
+    """Identyfikator zapytania - z nagłówka X-Request-ID, jeśli ma poprawny format"""
+    if naglowek and _POPRAWNY_ID.match(naglowek):
+        return naglowek
+    return secrets.token_hex(8)
+
+
+class _PustySpan:
+    """Span niespróbkowanego zapytania - wszystkie operacje nic nie robią"""
+    probkowany = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, wyjatek, tb):
+        return False
+
+    def ustaw(self, **atrybuty):
+        pass
+
+
+PUSTY = _PustySpan()
+
+
+class Span:
+    probkowany = True
+
+    def __init__(self, nazwa, trace_id, rodzic_id, atrybuty):
+        self.nazwa = nazwa
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.rodzic_id = rodzic_id
+        self.atrybuty = {k: v for k, v in atrybuty.items() if v is not None}
+        self.blad = None
+        self._token = None
+
+    def ustaw(self, **atrybuty):
+        """Dodaje atrybuty po starcie spanu (np. kod statusu HTTP)"""
+        self.atrybuty.update({k: v for k, v in atrybuty.items() if v is not None})
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        self._token = _biezacy.set(self)
+        return self
+
+    def __exit__(self, typ, wyjatek, tb):
+        self.koniec = time.time_ns()
+        _biezacy.reset(self._token)
+        if wyjatek is not None and not isinstance(wyjatek, GeneratorExit):
+            self.blad = f"{typ.__name__}: {str(wyjatek)[:200]}"
+        _eksportuj(self)
+        return False
+
+    def jako_slownik(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.rodzic_id,
+            'name': self.nazwa,
+            'start': self.start / 1e9,
+            'ms': round((self.koniec - self.start) / 1e6, 2),
+            'attributes': self.atrybuty,
+            'error': self.blad,
+            'pid': os.getpid(),
+        }
+
+
+def slad(nazwa, request_id, **atrybuty):
+    """Span główny zapytania - tu zapada decyzja o próbkowaniu"""
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return PUSTY
+    return Span(nazwa, secrets.token_hex(16), None, {'request.id': request_id, **atrybuty})
+
+
+def span(nazwa, **atrybuty):
+    """Span potomny bieżącego spanu (pusty, gdy zapytanie nie jest próbkowane)"""
+    rodzic = _biezacy.get()
+    if rodzic is None:
+        return PUSTY
+    return Span(nazwa, rodzic.trace_id, rodzic.span_id, atrybuty)
+
+
+def opakuj(nazwa, funkcja, **atrybuty):
+    """Funkcja wywoływana w spanie `nazwa`"""
+    def w_spanie(*args, **kwargs):
+        with span(nazwa, **atrybuty):
+            return funkcja(*args, **kwargs)
+    return w_spanie
+
+
+def w_kontekscie(funkcja):
+    """Funkcja uruchamiana w kopii bieżącego kontekstu - do przekazania do nowego wątku"""
+    kontekst = contextvars.copy_context()
+    return lambda *args, **kwargs: kontekst.run(funkcja, *args, **kwargs)
+
+
+def _eksportuj(span_):
+    global pominiete
+    if TRACE_EXPORT == 'none':
+        return
+    try:
+        _kolejka_procesu().put_nowait(span_)
+    except queue.Full:
+        pominiete += 1
+
+
+def _kolejka_procesu():
+    """Kolejka i wątek eksportu bieżącego procesu (nowe po forku workera)"""
+    global _kolejka, _kolejka_pid
+    if _kolejka is None or _kolejka_pid != os.getpid():
+        with _lock:
+            if _kolejka is None or _kolejka_pid != os.getpid():
+                _kolejka = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+                _kolejka_pid = os.getpid()
+                threading.Thread(target=_eksportuj_w_tle, args=(_kolejka,), daemon=True).start()
+    return _kolejka
+
+
+def _eksportuj_w_tle(kolejka):
+    eksporter = _zapisz_otlp if TRACE_EXPORT == 'otlp' else _zapisz_do_pliku
+    while True:
+        paczka = [kolejka.get()]
+        koniec = time.monotonic() + TRACE_FLUSH_SECONDS
+        while len(paczka) < TRACE_BATCH_SIZE:
+            try:
+                paczka.append(kolejka.get(timeout=max(koniec - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        try:
+            eksporter(paczka)
+        except Exception as e:
+            log.warning("Nie udało się wyeksportować spanów",
+                        extra={"error": str(e)[:200], "spans": len(paczka)})
+
+
+def _zapisz_do_pliku(paczka):
+    linie = ''.join(codec.dumps(s.jako_slownik(), default=str) + '\n' for s in paczka)
+    with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+        f.write(linie)
+
+
+def _atrybut_otlp(klucz, wartosc):
+    if isinstance(wartosc, bool):
+        return {'key': klucz, 'value': {'boolValue': wartosc}}
+    if isinstance(wartosc, int):
+        return {'key': klucz, 'value': {'intValue': str(wartosc)}}
+    if isinstance(wartosc, float):
+        return {'key': klucz, 'value': {'doubleValue': wartosc}}
+    return {'key': klucz, 'value': {'stringValue': str(wartosc)}}
+
+
+def _span_otlp(s):
+    wynik = {
+        'traceId': s.trace_id,
+        'spanId': s.span_id,
+        'name': s.nazwa,
+        'kind': 2 if s.rodzic_id is None else 1,
+        'startTimeUnixNano': str(s.start),
+        'endTimeUnixNano': str(s.koniec),
+        'attributes': [_atrybut_otlp(k, v) for k, v in s.atrybuty.items()],
+        'status': {'code': 2, 'message': s.blad} if s.blad else {'code': 1},
+    }
+    if s.rodzic_id:
+        wynik['parentSpanId'] = s.rodzic_id
+    return wynik
+
+
+def _zapisz_otlp(paczka):
+    import http_client  # import tutaj - http_client importuje tracing
+
+    dane = {'resourceSpans': [{
+        'resource': {'attributes': [_atrybut_otlp('service.name', NAZWA_USLUGI)]},
+        'scopeSpans': [{'scope': {'name': NAZWA_USLUGI}, 'spans': [_span_otlp(s) for s in paczka]}],
+    }]}
+    response = http_client.post(TRACE_OTLP_ENDPOINT, json=dane, timeout=http_client.timeout(5))
+    if response.status_code >= 300:
+        raise Exception(f"Kolektor OTLP: {response.status_code}")
@@ -0,0 +1,110 @@
+"""Rozgrzewanie workera przed przyjęciem pierwszego zapytania.
+
+Świeży worker płaci przy pierwszej wiadomości za DNS, TLS i - na Hugging Face -
+za ładowanie modelu (503 "model is loading"). Rozgrzewka wysyła do każdego
+skonfigurowanego dostawcy małą próbę przez wspólną pulę http_client (połączenie
+zostaje w puli), a HF prosi o `wait_for_model`, żeby model był już załadowany.
+
+Pod gunicornem rozgrzewka biegnie w hooku post_worker_init, czyli zanim worker
+zacznie przyjmować połączenia; całość ograniczona jest przez WARMUP_TIMEOUT
+(musi być krótszy niż timeout gunicorna). Wynik jest widoczny w /readyz.
+Nieudana próba nie blokuje workera - odpowiedzą wtedy kolejni dostawcy.
+"""
+import os
+import threading
+import time
+
+import logs
+from settings import env_bool, env_float
+
+log = logs.get('warmup')
+
+WARMUP_ENABLED = env_bool('WARMUP_ENABLED', True)
+WARMUP_TIMEOUT = env_float('WARMUP_TIMEOUT', 25.0)
+WARMUP_HF_WAIT_FOR_MODEL = env_bool('WARMUP_HF_WAIT_FOR_MODEL', True)
+
+
+class Rozgrzewka:
+    """Stan rozgrzewki bieżącego workera"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.status = 'pending'  # pending, warming, ready
+        self.start = None
+        self.koniec = None
+        self.proby = {}  # nazwa -> {'ok', 'ms', 'detail'}
+
+    def _nowy_proces(self):
+        # Dziecko po forku ma własne połączenia - stan rodzica nie dotyczy workera
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.status = 'pending'
+            self.start = self.koniec = None
+            self.proby = {}
+
+    def gotowy(self):
+        # 'pending' przy zapytaniu oznacza serwer bez rozgrzewki (np. `flask run`) - nie ma na co czekać
+        with self._lock:
+            self._nowy_proces()
+            return self.status != 'warming'
+
+    def uruchom(self, proby, limit=WARMUP_TIMEOUT):
+        """Wykonuje próby (nazwa, funkcja() -> opis) równolegle, najwyżej `limit` sekund"""
+        with self._lock:
+            self._nowy_proces()
+            if self.status != 'pending':
+                return
+            self.status = 'warming'
+            self.start = time.time()
+
+        if not WARMUP_ENABLED:
+            proby = []
+        watki = []
+        for nazwa, funkcja in proby:
+            watek = threading.Thread(target=self._probuj, args=(nazwa, funkcja), daemon=True)
+            watek.start()
+            watki.append(watek)
+
+        koniec = time.monotonic() + limit
+        for watek in watki:
+            watek.join(max(koniec - time.monotonic(), 0))
+
+        with self._lock:
+            for nazwa, _ in proby:
+                # Próba, która nie skończyła się w limicie, dokończy się w tle
+                self.proby.setdefault(nazwa, {'ok': False, 'ms': None, 'detail': 'przekroczony limit rozgrzewki'})
+            self.status = 'ready'
+            self.koniec = time.time()
+        log.info("Worker rozgrzany", extra={"ms": round((self.koniec - self.start) * 1000),
+                                            "probes": {n: p['ok'] for n, p in self.proby.items()}})
+
+    def uruchom_w_tle(self, proby, limit=WARMUP_TIMEOUT):
+        """Rozgrzewka bez blokowania (serwer developerski Flask)"""
+        threading.Thread(target=self.uruchom, args=(proby, limit), daemon=True).start()
+
+    def _probuj(self, nazwa, funkcja):
+        stoper = logs.Stoper()
+        try:
+            ok, opis = True, funkcja()
+        except Exception as e:
+            log.warning("Próba rozgrzewki nieudana", extra={"provider": nazwa, "error": str(e)[:300]})
+            ok, opis = False, str(e)[:200]
+        wynik = {'ok': ok, 'ms': stoper.ms, 'detail': opis}
+        with self._lock:
+            if self.status == 'warming':
+                self.proby[nazwa] = wynik
+
+    def statystyki(self):
+        with self._lock:
+            self._nowy_proces()
+            return {
+                'enabled': WARMUP_ENABLED,
+                'status': self.status,
+                'pid': self._pid,
+                'duration_ms': round((self.koniec - self.start) * 1000) if self.koniec else None,
+                'probes': dict(self.proby),
+            }
+
+
+rozgrzewka = Rozgrzewka()